@@ -1,4 +1,4 @@
-from analysis.utils.math import spectemp_coverage
+from analysis.utils.coverage import spectemp_coverages
 from analysis.utils.misc import *
 import os
 import pickle as pkl
@@ -59,47 +59,19 @@ dyn_range = 65  # threshold dB yielding highest coverage variance
 resize = 0.6  # resize duration
 upper_freq = 11000
 
-# extract horizontal data
-clearspeech_data_h = dict(sound=[], coverage=[])
-for trial_n in range(clearspeech_h.__len__()):
-    sound = slab.Sound(data=np.zeros(48828), samplerate=48828)
-    signals = signals_sample_clear_h[trial_n]
-    country_idx = country_idxs_clear_h[trial_n]
-    trial_composition = [sounds_clear[x][y].resize(resize) for x, y in zip(signals, country_idx)]
-    percentage_filled = spectemp_coverage(trial_composition, dyn_range=dyn_range, upper_freq=upper_freq)
-    clearspeech_data_h["sound"].append(sum(trial_composition))
-    clearspeech_data_h["coverage"].append(percentage_filled)
-
-revspeech_data_h = dict(sound=[], coverage=[])
-for trial_n in range(revspeech_h.__len__()):
-    # reversed
-    sound = slab.Sound(data=np.zeros(int(48828)), samplerate=48828)
-    signals = signals_sample_reversed_h[trial_n]
-    country_idx = country_idxs_reversed_h[trial_n]
-    trial_composition = [sounds_reversed[x][y].resize(resize) for x, y in zip(signals, country_idx)]
-    percentage_filled = spectemp_coverage(trial_composition, dyn_range, upper_freq=upper_freq)
-    revspeech_data_h["sound"].append(sum(trial_composition))
-    revspeech_data_h["coverage"].append(percentage_filled)
-
-clearspeech_data_v = dict(dict(sound=[], coverage=[]))
-for trial_n in range(clearspeech_v.__len__()):
-    sound = slab.Sound(data=np.zeros(48828), samplerate=48828)
-    signals = signals_sample_clear_v[trial_n]
-    country_idx = country_idxs_clear_v[trial_n]
-    trial_composition = [sounds_clear[x][y].resize(resize) for x, y in zip(signals, country_idx)]
-    percentage_filled = spectemp_coverage(trial_composition, dyn_range, upper_freq=upper_freq)
-    clearspeech_data_v["sound"].append(sum(trial_composition))
-    clearspeech_data_v["coverage"].append(percentage_filled)
-
-revspeech_data_v = dict(dict(sound=[], coverage=[]))
-for trial_n in range(revspeech_v.__len__()):
-    sound = slab.Sound(data=np.zeros(int(48828)), samplerate=48828)
-    signals = signals_sample_reversed_v[trial_n]
-    country_idx = country_idxs_reversed_v[trial_n]
-    trial_composition = [sounds_reversed[x][y].resize(resize) for x, y in zip(signals, country_idx)]
-    percentage_filled = spectemp_coverage(trial_composition, dyn_range, upper_freq=upper_freq)
-    revspeech_data_v["sound"].append(sum(trial_composition))
-    revspeech_data_v["coverage"].append(percentage_filled)
+# coverage of all trials, identical talker compositions are computed once and cached across runs
+cache_clear = "Results/coverage_cache_clear.pkl"
+cache_reversed = "Results/coverage_cache_reversed.pkl"
+clearspeech_data_h = dict(coverage=spectemp_coverages(signals_sample_clear_h, country_idxs_clear_h, sounds_clear,
+                                                      dyn_range, upper_freq, resize, cache_file=cache_clear).tolist())
+revspeech_data_h = dict(coverage=spectemp_coverages(signals_sample_reversed_h, country_idxs_reversed_h,
+                                                    sounds_reversed, dyn_range, upper_freq, resize,
+                                                    cache_file=cache_reversed).tolist())
+clearspeech_data_v = dict(coverage=spectemp_coverages(signals_sample_clear_v, country_idxs_clear_v, sounds_clear,
+                                                      dyn_range, upper_freq, resize, cache_file=cache_clear).tolist())
+revspeech_data_v = dict(coverage=spectemp_coverages(signals_sample_reversed_v, country_idxs_reversed_v,
+                                                    sounds_reversed, dyn_range, upper_freq, resize,
+                                                    cache_file=cache_reversed).tolist())
 
 # make list of dicts
 dicts = list()
@@ -4,7 +4,7 @@ import seaborn as sns
 import pickle as pkl
 from labplatform.config import get_config
 sns.set_theme()
-from sklearn.linear_model import LinearRegression
+from analysis.utils.stats import grouped_linregress
 
 
 # load data from all subjects
@@ -35,12 +35,11 @@ df.coverage = coverage.loc["clearspeech_h"]["coverage"]
 df = df.fillna(0)
 
 # model
-x = df.response.values.reshape(-1, 1)
-y = df.coverage.values.reshape(-1, 1)
-model = LinearRegression(fit_intercept=False)
-model.fit(x, y)
-ypred = model.predict(x)
-model.score(x, y)
+x = df.response.values
+y = df.coverage.values
+fit = grouped_linregress(df, "response", "coverage", fit_intercept=False).loc["all"]
+ypred = fit.slope * x
+fit.r2
 
 plt.scatter(x, y)
 plt.plot(x, ypred)
@@ -1,6 +1,6 @@
 import matplotlib.pyplot as plt
 import pandas as pd
-from analysis.utils.stats import mallows_ck
+from analysis.utils.stats import best_subsets
 
 fromfp = "/home/max/labplatform/data/csv/final_df_general.csv"
 df = pd.read_csv(fromfp, index_col=1)
@@ -8,12 +8,11 @@ df.pop("Sub_ID")
 y = df.performance
 df.pop("performance")
 x = df
-# Could take quite awhile to complete...
-models_best = pd.DataFrame(columns=["RSS", "model"])
-for k in range(1, (len(x.columns))):
-    models_best.loc[k] = mallows_ck(k, x, y)
+# best subset of each number of predictors, only these models are fitted
+models_best = best_subsets(x, y, sizes=range(1, len(x.columns)))
+print(models_best[["features", "RSS", "Cp", "AIC", "BIC"]])
 print(models_best.loc[6, "model"].summary())
-print(mallows_ck(k=3, X=x, y=y)["model"].summary())
+print(models_best.loc[3, "model"].summary())
 
 # plotting
 plt.figure(figsize=(20, 10))
@@ -27,22 +26,22 @@ plt.xlabel('# Predictors')
 plt.ylabel('RSS')
 # We will now plot a red dot to indicate the model with the largest adjusted R^2 statistic.
 # The argmax() function can be used to identify the location of the maximum point of a vector
-rsquared_adj = models_best.apply(lambda row: row[1].rsquared_adj, axis=1)
+rsquared_adj = models_best["rsquared_adj"]
 plt.subplot(2, 2, 2)
 plt.plot(rsquared_adj)
-plt.plot(rsquared_adj.argmax(), rsquared_adj.max(), "or")
+plt.plot(rsquared_adj.idxmax(), rsquared_adj.max(), "or")
 plt.xlabel('# Predictors')
 plt.ylabel('adjusted rsquared')
 # We'll do the same for AIC and BIC, this time looking for the models with the SMALLEST statistic
-aic = models_best.apply(lambda row: row[1].aic, axis=1)
+aic = models_best["AIC"]
 plt.subplot(2, 2, 3)
 plt.plot(aic)
-plt.plot(aic.argmin(), aic.min(), "or")
+plt.plot(aic.idxmin(), aic.min(), "or")
 plt.xlabel('# Predictors')
 plt.ylabel('AIC')
-bic = models_best.apply(lambda row: row[1].bic, axis=1)
+bic = models_best["BIC"]
 plt.subplot(2, 2, 4)
 plt.plot(bic)
-plt.plot(bic.argmin(), bic.min(), "or")
+plt.plot(bic.idxmin(), bic.min(), "or")
 plt.xlabel('# Predictors')
 plt.ylabel('BIC')
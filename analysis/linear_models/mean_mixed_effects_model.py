@@ -1,6 +1,6 @@
 from analysis.utils.plotting import *
 import seaborn as sns
-import statsmodels.formula.api as smf
+from analysis.utils.mixed_models import ModelSpec, fit_models
 import statsmodels.api as sm
 import researchpy as rp
 import scipy.stats as stats
@@ -16,9 +16,8 @@ rp.summary_cont(df)
 
 # multiple regression
 # random intercept and slope
-model = smf.mixedlm("response ~ coverage + numjudge + lababble + lanoise + spatmask", data=df,
-                    groups=df["subID"])
-result = model.fit()
+spec = ModelSpec("model", "response ~ coverage + numjudge + lababble + lanoise + spatmask", df, groups="subID")
+result = fit_models([spec], cache_dir=os.path.join(os.path.dirname(fromfp), ".cache"))["model"]
 table = result.summary()
 
 # scatterplot matrix
@@ -0,0 +1,130 @@
+import os
+import pickle
+import logging
+import numpy as np
+import scipy.signal
+import slab
+from concurrent.futures import ProcessPoolExecutor
+from analysis.utils.math import coverage_curve, _p_ref
+
+log = logging.getLogger(__name__)
+
+_sources = None  # source recordings of a worker process, see _init_worker
+
+
+def composition_key(signals, country_idxs):
+    """
+    Key of a trial composition: the sorted (talker id, country index) pairs. The mixture is a sum, so trials with
+    the same recordings in a different order share the key.
+    """
+    return tuple(sorted(zip(signals, (int(idx) for idx in country_idxs))))
+
+
+def spectemp_coverages(signals_sample, country_idxs, sounds, dyn_range=65, upper_freq=11000, resize=0.6,
+                       n_jobs=None, batch_size=16, cache_file=None):
+    """
+    Calculate the spectro-temporal coverage of the talker composition of every trial, the batched equivalent of
+    calling spectemp_coverage([sounds[x][y].resize(resize) for x, y in zip(signals, country_idx)], dyn_range,
+    upper_freq) for each trial.
+
+    Parameters:
+    - signals_sample (iterable): The talker ids of each trial, e.g. df.signals_sample.
+    - country_idxs (iterable): The country index of each talker of each trial, e.g. df.country_idxs.
+    - sounds (dict): The recordings of each talker id, e.g. loaded from numjudge_talker_files_clear.pkl.
+    - dyn_range (float or array-like, optional): The dynamic range(s) in dB. Default is 65.
+    - upper_freq (int, optional): The upper frequency limit. Default is 11000.
+    - resize (float, optional): The duration of the recordings in seconds. Default is 0.6.
+    - n_jobs (int, optional): The number of worker processes. Default is the number of cpus, 1 computes in this
+      process.
+    - batch_size (int, optional): The number of mixtures per STFT call. Default is 16.
+    - cache_file (str, optional): A pickle file with the coverage per composition, read and updated if given.
+
+    Returns:
+    - ndarray: The coverage of each trial, of shape (n_trials, n_dyn_ranges) if several dynamic ranges are given.
+
+    Note:
+    - Each distinct composition is computed once. The mixtures of a batch are summed into a preallocated array and
+      their spectrograms are computed in one call, with the same parameters as slab.Sound.spectrogram.
+
+    """
+    keys = [composition_key(signals, country_idx) for signals, country_idx in zip(signals_sample, country_idxs)]
+    dyn_ranges = np.atleast_1d(np.asarray(dyn_range, dtype=float))
+    setting = (resize, upper_freq, tuple(dyn_ranges))
+    cache = _load_cache(cache_file)
+    coverages = cache.setdefault(setting, dict())
+    todo = [key for key in dict.fromkeys(keys) if key not in coverages]
+    if todo:
+        sources, rows, samplerate = _source_table(sounds, todo, resize)
+        batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+        log.info(f"Computing the coverage of {len(todo)} compositions of {len(keys)} trials")
+        if len(batches) > 1 and n_jobs != 1:
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(sources,)) as pool:
+                results = pool.map(_batch_coverage, batches, [samplerate] * len(batches),
+                                   [upper_freq] * len(batches), [dyn_ranges] * len(batches))
+                results = [coverage for batch in results for coverage in batch]
+        else:
+            results = [coverage for batch in batches for coverage in
+                       _batch_coverage(batch, samplerate, upper_freq, dyn_ranges, sources)]
+        coverages.update(zip(todo, results))
+        if cache_file:
+            _save_cache(cache_file, cache)
+    coverage = np.array([coverages[key] for key in keys]).reshape(len(keys), len(dyn_ranges))
+    return coverage[:, 0] if np.ndim(dyn_range) == 0 else coverage
+
+
+def _source_table(sounds, keys, resize):
+    """
+    The recordings used by the compositions, resized and stacked into one array, and the rows of each composition.
+    """
+    pairs = list(dict.fromkeys(pair for key in keys for pair in key))
+    samplerate = sounds[pairs[0][0]][pairs[0][1]].samplerate
+    n_samples = slab.Signal.in_samples(resize, samplerate)
+    sources = np.zeros((len(pairs), n_samples))  # like Sound.resize, shorter recordings are padded with zeros
+    for i, (talker, country) in enumerate(pairs):
+        data = sounds[talker][country].data[:n_samples, 0]
+        sources[i, :len(data)] = data
+    row = {pair: i for i, pair in enumerate(pairs)}
+    return sources, [[row[pair] for pair in key] for key in keys], samplerate
+
+
+def _init_worker(sources):
+    global _sources
+    _sources = sources
+
+
+def _batch_coverage(rows, samplerate, upper_freq, dyn_ranges, sources=None):
+    sources = _sources if sources is None else sources
+    mixtures = np.zeros((len(rows), sources.shape[1]))
+    for i, row in enumerate(rows):
+        mixtures[i] = sources[row].sum(axis=0)
+    freqs, times, power = scipy.signal.spectrogram(mixtures, fs=samplerate, axis=-1,
+                                                   **_spectrogram_kwargs(samplerate))
+    if upper_freq:
+        power = power[:, freqs < upper_freq, :]
+    power = 10 * np.log10(power / (_p_ref ** 2))
+    return [coverage_curve(p, dyn_ranges) for p in power]
+
+
+def _spectrogram_kwargs(samplerate, window_dur=0.005):
+    """
+    The parameters slab.Sound.spectrogram passes to scipy.signal.spectrogram.
+    """
+    window_n_samples = slab.Signal.in_samples(window_dur, samplerate) * 2
+    step_n_samples = window_n_samples / np.sqrt(np.pi) / 8  # optimal step duration for Gaussian windows
+    window = scipy.signal.windows.gaussian(window_n_samples, (window_n_samples + 1) / 6)
+    return dict(mode="psd", scaling="density", noverlap=window_n_samples - step_n_samples, window=window,
+                nperseg=window_n_samples)
+
+
+def _load_cache(cache_file):
+    if cache_file and os.path.exists(cache_file):
+        with open(cache_file, "rb") as file:
+            return pickle.load(file)
+    return dict()
+
+
+def _save_cache(cache_file, cache):
+    temp = f"{cache_file}.tmp"
+    with open(temp, "wb") as file:
+        pickle.dump(cache, file)
+    os.replace(temp, cache_file)
@@ -29,25 +29,51 @@ def spectemp_coverage(sound_composition, dyn_range, upper_freq):
     # Combine the sounds in the composition
     sound = sum(sound_composition)
 
-    # Calculate the spectrogram and power
+    # Calculate the logarithmic power and the coverage of the dynamic range
+    power = log_power_spectrogram(sound, upper_freq)
+    return float(coverage_curve(power, [dyn_range])[0])
+
+
+def log_power_spectrogram(sound, upper_freq=None):
+    """
+    Calculate the spectrogram of a sound in dB re 20 μPa.
+
+    Parameters:
+    - sound (slab.Sound): The sound to analyse.
+    - upper_freq (int, optional): Only keep frequencies below this limit.
+
+    Returns:
+    - ndarray: The logarithmic power with frequencies along the first and time along the second axis.
+
+    """
     freqs, times, power = sound.spectrogram(show=False)
     if upper_freq:
         power = power[freqs < upper_freq, :]
+    return 10 * np.log10(power / (_p_ref ** 2))
 
-    # Convert power to logarithmic scale for plotting
-    power = 10 * np.log10(power / (_p_ref ** 2))
 
-    # Calculate the maximum and minimum dB values
-    dB_max = power.max()
-    dB_min = dB_max - dyn_range
+def coverage_curve(power, dyn_ranges):
+    """
+    Calculate the spectro-temporal coverage of a logarithmic power spectrogram for many dynamic ranges at once.
 
-    # Select the interval of power values within the specified dynamic range
-    interval = power[np.where((power > dB_min) & (power < dB_max))]
+    Parameters:
+    - power (ndarray): Logarithmic power, e.g. from log_power_spectrogram.
+    - dyn_ranges (array-like): The dynamic ranges in decibels (dB).
 
-    # Calculate the ratio of points within the dynamic range to total points
-    coverage = interval.shape[0] / power.flatten().shape[0]
+    Returns:
+    - ndarray: For each dynamic range, the ratio of spectro-temporal points less than the dynamic range below the
+               maximum (the maximum itself excluded, like in spectemp_coverage) to the total number of points.
 
-    return coverage
+    Note:
+    - The distances of all points from the maximum are sorted once, the coverage of each dynamic range is the
+      position of the range in the sorted distances. Each additional dynamic range costs a binary search instead of
+      another pass over the spectrogram.
+
+    """
+    depth = np.sort(power.max() - power.ravel())
+    n_max = np.searchsorted(depth, 0, side="right")  # points at the maximum
+    counts = np.searchsorted(depth, np.asarray(dyn_ranges, dtype=float), side="left") - n_max
+    return np.maximum(counts, 0) / depth.size
 
 
 def adaptive_mean_threshold(array, window_size, c):
@@ -55,7 +81,8 @@ def adaptive_mean_threshold(array, window_size, c):
     Apply adaptive mean thresholding to an input array.
 
     Parameters:
-    - array (ndarray): Input array of numeric values.
+    - array (ndarray): Input array of numeric values, or a batch of arrays stacked along leading axes, e.g. spectrograms
+                       of shape (n_trials, n_freqs, n_times).
     - window_size (int): Size of the square neighborhood for local threshold calculation.
                          Must be an odd positive integer.
     - c (float): Constant value subtracted from the local mean to determine the threshold.
@@ -68,16 +95,42 @@ def adaptive_mean_threshold(array, window_size, c):
     - AssertionError: If the window_size is not an odd positive integer.
 
     Note:
-    - This function applies adaptive mean thresholding to each pixel in the input array.
     - The local threshold is calculated using a square neighborhood centered at each pixel,
-      where the size of the neighborhood is determined by the window_size parameter.
+      where the size of the neighborhood is determined by the window_size parameter. At the borders the
+      neighborhood is cut to the array and the mean is taken over the remaining pixels.
+    - The local means of all pixels are taken from a summed-area table of the array, so the cost does not depend
+      on the window size.
     - The binary array is obtained by comparing each pixel value with the local threshold,
-      with values above the threshold set to 1 and values below or equal to the threshold set to 0.
+      with values greater than or equal to the threshold set to 1 and values below the threshold set to 0.
 
     """
     assert window_size % 2 == 1 and window_size > 0, "window_size must be an odd positive integer"
 
-    # Calculate the local threshold for each pixel
+    array = np.asarray(array, dtype=float)
+    rows, cols = array.shape[-2:]
+    half = window_size // 2
+
+    # Summed-area table with a leading row and column of zeros, sat[i, j] is the sum of array[:i, :j]
+    sat = np.zeros(array.shape[:-2] + (rows + 1, cols + 1))
+    sat[..., 1:, 1:] = array.cumsum(axis=-2).cumsum(axis=-1)
+
+    # Bounds of the neighborhood of each row and column, cut to the array
+    top = np.clip(np.arange(rows) - half, 0, rows)[:, None]
+    bottom = np.clip(np.arange(rows) + half + 1, 0, rows)[:, None]
+    left = np.clip(np.arange(cols) - half, 0, cols)
+    right = np.clip(np.arange(cols) + half + 1, 0, cols)
+
+    # Local sums from the four corners of each neighborhood, divided by the number of pixels in it
+    sums = sat[..., bottom, right] - sat[..., top, right] - sat[..., bottom, left] + sat[..., top, left]
+    thresh = sums / ((bottom - top) * (right - left)) - c
+
+    return (array >= thresh).astype(float)
+
+
+def _adaptive_mean_threshold_loop(array, window_size, c):
+    """
+    Previous implementation of adaptive_mean_threshold, one window per pixel. Kept as reference for the benchmark.
+    """
     rows, cols = array.shape
     binary = np.zeros((rows, cols))
 
@@ -129,4 +182,18 @@ def variance(data):
 
 
 if __name__ == "__main__":
-    spectemp_coverage(sound_composition=2, dyn_range=0)
+    import timeit
+
+    # benchmark adaptive_mean_threshold against the loop, on a spectrogram sized array. Run with
+    # python -m analysis.utils.math, as a script this file would shadow the math module of the standard library
+    power = np.random.default_rng(0).normal(60, 10, (120, 400))
+    for window_size in (3, 11, 31):
+        assert np.array_equal(adaptive_mean_threshold(power, window_size, 2),
+                              _adaptive_mean_threshold_loop(power, window_size, 2))
+        loop = timeit.timeit(lambda: _adaptive_mean_threshold_loop(power, window_size, 2), number=1)
+        table = timeit.timeit(lambda: adaptive_mean_threshold(power, window_size, 2), number=10) / 10
+        print(f"window {window_size}: loop {loop * 1000:.0f} ms, summed-area table {table * 1000:.2f} ms "
+              f"({loop / table:.0f}x)")
+    batch = np.random.default_rng(1).normal(60, 10, (50, 120, 400))
+    table = timeit.timeit(lambda: adaptive_mean_threshold(batch, 11, 2), number=1)
+    print(f"batch of {len(batch)}: summed-area table {table * 1000:.0f} ms")
@@ -1,8 +1,21 @@
 import pandas as pd
 import os
+import json
+import glob
+import logging
+import itertools
 import slab
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from Speakers.speaker_config import SpeakerArray
+from analysis.utils.results_index import ResultsIndex
+try:
+    import pyarrow  # parquet engine for the results cache
+except ImportError:
+    pyarrow = None
+    logging.info("WARNING: pyarrow not found, results will not be cached. Maybe try installing: pip install pyarrow")
+
+log = logging.getLogger(__name__)
 
 
 def load_dataframe(data_dir, exp_name="NumJudge", plane="h"):
@@ -20,7 +33,12 @@ def load_dataframe(data_dir, exp_name="NumJudge", plane="h"):
     """
 
     dfs = list()  # List to store individual DataFrames from each file
-    files = search_for_files(data_dir=data_dir, exp_name=exp_name, plane=plane)  # Search for files in the specified directory
+    index = ResultsIndex(data_dir)  # Look up the files of the experiment and plane in the index of the directory
+    index.update()
+    entries = index.select(paradigm=exp_name, plane=plane)
+    _warn_unmatched(index, exp_name)
+    index.close()
+    files = [entry.path for entry in entries]
 
     # Iterate over each file
     for file in files:
@@ -35,17 +53,143 @@ def load_dataframe(data_dir, exp_name="NumJudge", plane="h"):
                 data_dict[k].append(v)
 
         # Create a DataFrame using the collected data
-        df = pd.DataFrame(columns=data_dict.keys())  # Create an empty DataFrame with columns as data_dict keys
-        for key in data_dict.keys():
-            df[key] = pd.Series(data_dict[key])  # Add each key's data as a column in the DataFrame
-
         df = pd.DataFrame.from_dict(data_dict, orient="index")  # Transpose the DataFrame
         df = df.transpose()
 
         dfs.append(df)  # Append the DataFrame to the list
 
     # Concatenate all DataFrames into a single DataFrame
-    return pd.concat(dfs, keys=_extract_subject_ids_from_files(files), names=["Sub_ID"])
+    return pd.concat(dfs, keys=[entry.subject for entry in entries], names=["Sub_ID"])
+
+
+def load_results(data_dir, exp_name="NumJudge", plane="h", fill=("plane", "mode", "reversed_speech", "talker"),
+                 cache=True, n_jobs=None, cohort=None):
+    """
+    Faster, typed variant of load_dataframe. Like there, the n-th row of a file holds the n-th value written under each
+    tag, and the files are concatenated with the subject ids as index level "Sub_ID". Differences:
+
+    - list valued fields (actual, perceived, accuracy, headpose, speakers_sample, ...) are split into one numeric column
+      per element, named {key}_{i}, missing values are NaN.
+    - scalar columns get numeric, boolean or string dtypes instead of object, dict valued fields (sequence, stairs)
+      are kept as JSON strings.
+    - the session level columns in fill (plane, mode, ...) are forward filled within each file.
+
+    The files are looked up in the ResultsIndex of data_dir and parsed in parallel. Each parsed file is cached as
+    Parquet in data_dir/.cache, keyed by the hash of the file, so only new or changed files are parsed again.
+
+    Parameters:
+    - data_dir (str): The directory path where the data files are located.
+    - exp_name (str, optional): The name of the experiment. Default is "NumJudge".
+    - plane (str, optional): The plane of the data. Default is "h".
+    - fill (tuple, optional): Columns to forward fill within each file.
+    - cache (bool, optional): Read and write the Parquet cache, needs pyarrow. Default is True.
+    - n_jobs (int, optional): Number of worker processes for parsing. Default is the number of cpus, 1 parses in
+      this process.
+    - cohort (str, optional): Only load this cohort, p (pilot) or t (test). Default loads all.
+
+    Returns:
+    - pd.DataFrame: A pandas DataFrame containing the loaded data from the files.
+    """
+    entries, tables = _load_indexed_tables(data_dir, exp_name, plane, fill, cache, n_jobs, cohort)
+    return pd.concat(tables, keys=[entry.subject for entry in entries], names=["Sub_ID"])
+
+
+def _load_indexed_tables(data_dir, exp_name, plane, fill=(), cache=True, n_jobs=None, cohort=None):
+    """
+    Index entries and typed tables of the selected results files, see load_results. plane None selects both planes.
+    """
+    index = ResultsIndex(data_dir)
+    index.update()
+    entries = index.select(paradigm=exp_name, plane=plane, cohort=cohort)
+    _warn_unmatched(index, exp_name)
+    cache_dir = os.path.dirname(index.path) if cache and pyarrow is not None else None
+    if cache_dir:
+        _prune_results_cache(cache_dir, index.hashes())
+    index.close()
+    tables = [_read_results_cache(cache_dir, entry.hash) if cache_dir else None for entry in entries]
+    missing = [i for i, table in enumerate(tables) if table is None]
+    if len(missing) > 1 and n_jobs != 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            parsed = list(pool.map(_parse_results_file, [entries[i].path for i in missing]))
+    else:
+        parsed = [_parse_results_file(entries[i].path) for i in missing]
+    for i, table in zip(missing, parsed):
+        tables[i] = table
+        if cache_dir:
+            table.to_parquet(os.path.join(cache_dir, f"{entries[i].hash}.parquet"))
+    for table in tables:
+        for key in fill:
+            if key in table:
+                table[key] = table[key].ffill()
+    return entries, tables
+
+
+def _read_results_cache(cache_dir, file_hash):
+    cache_file = os.path.join(cache_dir, f"{file_hash}.parquet")
+    if os.path.exists(cache_file):
+        return pd.read_parquet(cache_file)
+    return None
+
+
+def _prune_results_cache(cache_dir, hashes):
+    for cache_file in glob.glob(os.path.join(glob.escape(cache_dir), "*.parquet")):
+        if os.path.splitext(os.path.basename(cache_file))[0] not in hashes:
+            os.remove(cache_file)
+
+
+def _warn_unmatched(index, exp_name):
+    """
+    Warns about the files containing exp_name which are skipped because they are not named like results files.
+    """
+    skipped = [path for path in index.unmatched() if exp_name in os.path.basename(path)]
+    if skipped:
+        log.warning(f"Skipped {len(skipped)} {exp_name} files whose names do not match the results file pattern: "
+                    f"{', '.join(skipped)}")
+
+
+def _parse_results_file(file):
+    """
+    Parses one results file into a typed DataFrame, see load_results.
+    """
+    values = dict()
+    with open(file, "r") as f:
+        for line in f:
+            if line.strip():
+                for key, value in json.loads(line).items():
+                    values.setdefault(key, list()).append(value)
+    n_rows = max((len(v) for v in values.values()), default=0)
+    columns = dict()
+    for key, column in values.items():
+        columns.update(_typed_columns(key, column + [None] * (n_rows - len(column))))
+    return pd.DataFrame(columns, index=pd.RangeIndex(n_rows))
+
+
+def _typed_columns(key, values):
+    """
+    Converts the values of one tag into one or more typed columns.
+    """
+    present = [v for v in values if v is not None]
+    if any(isinstance(v, dict) for v in present) or any(isinstance(e, (list, dict)) for v in present if
+                                                         isinstance(v, list) for e in v):
+        return {key: pd.Series([None if v is None else json.dumps(v) for v in values], dtype="string")}
+    if any(isinstance(v, list) for v in present):
+        width = max(len(v) for v in present if isinstance(v, list))
+        rows = [v if isinstance(v, list) else [v] if v is not None else [] for v in values]
+        return {f"{key}_{i}": _typed_series([row[i] if i < len(row) else None for row in rows])
+                for i in range(width)}
+    return {key: _typed_series(values)}
+
+
+def _typed_series(values):
+    present = [v for v in values if v is not None]
+    if present and all(isinstance(v, bool) for v in present):
+        return pd.Series(values, dtype="boolean")
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+        return pd.Series([np.nan if v is None else v for v in values], dtype=float)
+    numeric = pd.to_numeric(pd.Series(values, dtype="string"), errors="coerce")
+    if numeric.notna().sum() == len(present):  # numbers stored as strings, e.g. talker ids
+        return numeric.astype(float)
+    return pd.Series([None if v is None else str(v) for v in values], dtype="string")
 
 
 def search_for_files(data_dir, exp_name, plane):
@@ -67,112 +211,108 @@ def search_for_files(data_dir, exp_name, plane):
     # Walk through the directory tree
     for root, dirs, files in os.walk(data_dir):
         for file in files:
-            # Check if the file name contains the experiment name and plane
-            if exp_name in file and plane in file:
+            # Check if the file is a results file and its name contains the experiment name and plane
+            if file.endswith(".txt") and exp_name in file and plane in file:
                 filelist.append(os.path.join(root, file))  # Add the file path to the list
 
     return filelist
 
 
-def _extract_subject_ids_from_files(files):
+def extract_subject_ids_from_dataframe(dataframe):
     """
-    Extracts subject IDs from a list of file names.
+    Extracts unique subject IDs from the index values of a pandas DataFrame.
 
     Parameters:
-    - files (list): A list of file names from which to extract the subject IDs.
+    - dataframe (pd.DataFrame): The pandas DataFrame from which to extract the subject IDs.
 
     Returns:
-    - list: A list of subject IDs extracted from the file names.
+    - list: A list of unique subject IDs extracted from the index values of the DataFrame.
 
     """
 
-    subject_ids = []  # List to store the extracted subject IDs
-
-    # Iterate over each file name
-    for file in files:
-        # Iterate from 0 to 99 (assuming subject IDs are in the range of sub_00 to sub_99)
-        for i in range(100):
-            if i < 10:
-                # Check if the file name contains sub_0i (where i is a single-digit number)
-                if f"sub_0{i}" in file:
-                    subject_ids.append(f"sub_0{i}")  # Add the subject ID to the list
-            if i >= 10:
-                # Check if the file name contains sub_i (where i is a double-digit number)
-                if f"sub_{i}" in file:
-                    subject_ids.append(f"sub_{i}")  # Add the subject ID to the list
+    subject_ids = np.unique([x[0] for x in dataframe.index.values]).tolist()
+    # Extracts the subject IDs from the index values of the DataFrame
 
     return subject_ids
 
 
-def extract_subject_ids_from_dataframe(dataframe):
+def coordinates_array(dataset, width=2):
     """
-    Extracts unique subject IDs from the index values of a pandas DataFrame.
+    Expands a column of [azimuth, elevation] lists (actual, perceived, accuracy, headpose) into a 2-D float array in
+    one go. Missing cells and entries (None or NaN) become NaN, so np.isnan(array) is the mask of missing values.
 
     Parameters:
-    - dataframe (pd.DataFrame): The pandas DataFrame from which to extract the subject IDs.
+    - dataset (iterable): The column of lists, e.g. df.accuracy.
+    - width (int, optional): The number of entries per cell. Default is 2.
 
     Returns:
-    - list: A list of unique subject IDs extracted from the index values of the DataFrame.
+    - ndarray: A float array of shape (len(dataset), width).
 
     """
 
-    subject_ids = np.unique([x[0] for x in dataframe.index.values]).tolist()
-    # Extracts the subject IDs from the index values of the DataFrame
+    cells = dataset.tolist() if hasattr(dataset, "tolist") else list(dataset)
+    try:
+        complete = all(len(x) == width for x in cells)  # fails on missing cells
+    except TypeError:
+        complete = False
+    if complete:
+        flat = list(itertools.chain.from_iterable(cells))
+    else:  # pad short and truncate long cells, so that ragged rows are not shifted into the neighbouring trials
+        missing = [np.nan] * width
+        flat = itertools.chain.from_iterable(list(x)[:width] + missing[len(x):] if isinstance(
+            x, (list, tuple, np.ndarray)) else missing for x in cells)
+        flat = list(flat)
+    return np.array(flat, dtype=float).reshape(-1, width)  # None entries become NaN
+
+
+def azimuth_array(dataset):
+    """
+    Azimuth column of coordinates_array(dataset). NaN where the value is missing.
+    """
+    return coordinates_array(dataset)[:, 0]
 
-    return subject_ids
+
+def elevation_array(dataset):
+    """
+    Elevation column of coordinates_array(dataset). NaN where the value is missing.
+    """
+    return coordinates_array(dataset)[:, 1]
 
 
 def get_azimuth_from_df(dataset):
     """
-    Extracts azimuth values from a dataset and returns them as a list.
+    Extracts azimuth values from a dataset, see azimuth_array.
 
     Parameters:
     - dataset (iterable): The dataset from which to extract azimuth values.
 
     Returns:
-    - list: A list of azimuth values extracted from the dataset.
+    - ndarray: The azimuth values extracted from the dataset, NaN where the value is missing.
 
     """
 
-    azimuth = list()  # List to store the extracted azimuth values
-
-    # Iterate over each element in the dataset
-    for x in dataset:
-        if x is None:
-            azimuth.append(None)  # Append None if the element is None
-        else:
-            azimuth.append(x[0])  # Append the first element of x to the azimuth list
-
-    return azimuth
+    return azimuth_array(dataset)
 
 
 def get_elevation_from_df(dataset):
     """
-    Extracts elevation values from a dataset and returns them as a list.
+    Extracts elevation values from a dataset, see elevation_array.
 
     Parameters:
     - dataset (iterable): The dataset from which to extract elevation values.
 
     Returns:
-    - list: A list of elevation values extracted from the dataset.
+    - ndarray: The elevation values extracted from the dataset, NaN where the value is missing.
 
     """
 
-    elevation = list()  # List to store the extracted elevation values
-
-    # Iterate over each element in the dataset
-    for x in dataset:
-        if x is None:
-            elevation.append(None)  # Append None if the element is None
-        else:
-            elevation.append(x[1])  # Append the second element of x to the elevation list
-
-    return elevation
+    return elevation_array(dataset)
 
 
 def replace_in_array(array, to_replace_val=None, replace_with_val=0):
     """
-    Replaces values in an array with a specified replacement value.
+    Replaces values in an array with a specified replacement value. Numeric input is converted to a new float array,
+    for to_replace_val None both None and NaN count as missing and are replaced. The input is not changed.
 
     Parameters:
     - array (list or ndarray): The array in which values will be replaced.
@@ -184,11 +324,15 @@ def replace_in_array(array, to_replace_val=None, replace_with_val=0):
 
     """
 
-    for i, val in enumerate(array):
-        if val == to_replace_val:
-            array[i] = replace_with_val  # Replace the value at index i with replace_with_val
-
-    return array
+    try:
+        values = np.array(array, dtype=float)  # None becomes NaN
+    except (TypeError, ValueError):  # not numeric, replace element by element
+        return [replace_with_val if val == to_replace_val else val for val in array]
+    if to_replace_val is None:
+        values[np.isnan(values)] = replace_with_val
+    else:
+        values[values == to_replace_val] = replace_with_val
+    return values
 
 
 def crosstab(index, columns, values=None, rownames=None, colnames=None, aggfunc=None, margins=True,
@@ -0,0 +1,268 @@
+import os
+import pickle
+import hashlib
+import logging
+import warnings
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import statsmodels
+import statsmodels.formula.api as smf
+
+log = logging.getLogger(__name__)
+
+# One mixed linear model: the formula, the data it is fitted to (already sliced to the condition, e.g. reversed
+# speech in the horizontal plane) and the column with the groups of the random effects, e.g. "subID".
+ModelSpec = namedtuple("ModelSpec", ["name", "formula", "data", "groups", "re_formula", "vc_formula"],
+                       defaults=(None, None))
+
+_data = None  # data of a resampling worker process, see _init_worker
+
+
+class MixedModelSummary:
+    """
+    The parts of a fitted statsmodels MixedLMResults the analysis uses, small enough to cache and to send between
+    processes.
+
+    Attributes:
+    - name (str): The name of the ModelSpec.
+    - formula (str): The formula of the fixed effects.
+    - params (pandas Series): The fixed effects.
+    - bse (pandas Series): The standard errors of the fixed effects.
+    - pvalues (pandas Series): The Wald test p-values of the fixed effects.
+    - conf_int (pandas DataFrame): The Wald 95% confidence intervals of the fixed effects.
+    - cov_re (pandas DataFrame): The covariance matrix of the random effects.
+    - scale (float): The residual variance.
+    - llf, aic, bic (float): The (restricted) log-likelihood and information criteria, AIC and BIC are NaN for REML.
+    - converged (bool): Whether the optimizer converged.
+    - nobs, ngroups (int): The number of observations and groups.
+    - resid, fittedvalues (pandas Series): The residuals and fitted values.
+
+    """
+
+    def __init__(self, name, formula, result):
+        fixed = result.fe_params.index
+        self.name = name
+        self.formula = formula
+        self.params = result.fe_params
+        self.bse = result.bse_fe
+        self.pvalues = result.pvalues[fixed]
+        self.conf_int = result.conf_int().loc[fixed]
+        self.cov_re = result.cov_re
+        self.scale = result.scale
+        self.llf, self.aic, self.bic = result.llf, result.aic, result.bic
+        self.converged = result.converged
+        self.nobs = int(result.nobs)
+        self.ngroups = result.model.n_groups
+        self.resid = result.resid
+        self.fittedvalues = result.fittedvalues
+        self._summary = result.summary()
+
+    def summary(self):
+        return self._summary
+
+    def __repr__(self):
+        return f"MixedModelSummary(name='{self.name}', formula='{self.formula}', nobs={self.nobs}, " \
+               f"ngroups={self.ngroups}, converged={self.converged})"
+
+
+def fit_models(specs, n_jobs=None, cache_dir=None, **fit_kwargs):
+    """
+    Fit a batch of mixed linear models, e.g. the same formula for each condition.
+
+    Parameters:
+    - specs (list): ModelSpec tuples, the names must be unique.
+    - n_jobs (int, optional): The number of worker processes. Default is the number of cpus, 1 fits in this process.
+    - cache_dir (str, optional): A directory the summaries are cached in, keyed by the hash of the data, the formula,
+      the groups and fit_kwargs. A model is only refitted when one of those changed.
+    - **fit_kwargs: Passed on to MixedLM.fit, e.g. reml=False or method="lbfgs".
+
+    Returns:
+    - dict: The MixedModelSummary of each spec by name.
+
+    Example::
+
+        formula = "response ~ coverage + spatmask + lababble + lanoise + numjudge"
+        specs = [ModelSpec(name, formula, pd.read_csv(f"final_df_{name}.csv", index_col=0), "subID")
+                 for name in ["clearspeech_h", "clearspeech_v", "revspeech_h", "revspeech_v"]]
+        results = fit_models(specs, cache_dir="Results/mixedlm")
+        results["revspeech_h"].summary()
+
+    """
+    names = [spec.name for spec in specs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"The names of the specs must be unique: {names}")
+    keys = [_cache_key("fit", spec, fit_kwargs) for spec in specs]
+    results = {spec.name: _load_cached(cache_dir, key) for spec, key in zip(specs, keys)}
+    todo = [(spec, key) for spec, key in zip(specs, keys) if results[spec.name] is None]
+    if todo:
+        log.info(f"Fitting {len(todo)} of {len(specs)} models")
+        if len(todo) > 1 and n_jobs != 1:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                fitted = list(pool.map(_fit_spec, [spec for spec, _ in todo], [fit_kwargs] * len(todo)))
+        else:
+            fitted = [_fit_spec(spec, fit_kwargs) for spec, _ in todo]
+        for (spec, key), summary in zip(todo, fitted):
+            results[spec.name] = summary
+            _save_cached(cache_dir, key, summary)
+    return results
+
+
+def bootstrap_fixed_effects(spec, n_boot=1000, alpha=0.05, seed=None, n_jobs=None, cache_dir=None,
+                            return_samples=False, **fit_kwargs):
+    """
+    Percentile confidence intervals of the fixed effects from a cluster bootstrap: whole groups (e.g. subjects) are
+    drawn with replacement and the model is refitted to each sample. A group drawn twice enters the sample as two
+    groups.
+
+    Parameters:
+    - spec (ModelSpec): The model.
+    - n_boot (int, optional): The number of bootstrap samples. Default is 1000.
+    - alpha (float, optional): The confidence intervals cover 1 - alpha. Default is 0.05.
+    - seed (int, optional): The seed of the samples. Each sample has its own seed, so the result does not depend on
+      n_jobs.
+    - n_jobs (int, optional): The number of worker processes. Default is the number of cpus, 1 fits in this process.
+    - cache_dir (str, optional): A directory the estimates are cached in, only used if seed is given.
+    - return_samples (bool, optional): Whether to also return the estimates of all samples. Default is False.
+    - **fit_kwargs: Passed on to MixedLM.fit.
+
+    Returns:
+    - pandas DataFrame: The estimate, lower and upper bound of each fixed effect.
+    - pandas DataFrame: The fixed effects of each bootstrap sample, NaN where the fit failed, if return_samples.
+
+    """
+    estimate = _fit_spec(spec, fit_kwargs).params
+    samples = _resample(spec, "bootstrap", n_boot, seed, n_jobs, cache_dir, fit_kwargs, list(estimate.index))
+    lower, upper = np.nanpercentile(samples, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    ci = pd.DataFrame({"estimate": estimate, "lower": lower, "upper": upper}, index=samples.columns)
+    return (ci, samples) if return_samples else ci
+
+
+def permutation_fixed_effects(spec, n_permutations=1000, columns=None, seed=None, n_jobs=None, cache_dir=None,
+                              return_samples=False, **fit_kwargs):
+    """
+    Permutation p-values of the fixed effects: the values of a predictor are permuted across all observations, which
+    breaks its relation to the response while keeping the other predictors and the groups, and the model is refitted.
+
+    Parameters:
+    - spec (ModelSpec): The model.
+    - n_permutations (int, optional): The number of permutations of each predictor. Default is 1000.
+    - columns (list, optional): The predictors to test, columns of the data. Default is every column that is a fixed
+      effect of the model.
+    - seed (int, optional): The seed of the permutations. Each permutation has its own seed, so the result does not
+      depend on n_jobs.
+    - n_jobs (int, optional): The number of worker processes. Default is the number of cpus, 1 fits in this process.
+    - cache_dir (str, optional): A directory the estimates are cached in, only used if seed is given.
+    - return_samples (bool, optional): Whether to also return the estimates of all permutations. Default is False.
+    - **fit_kwargs: Passed on to MixedLM.fit.
+
+    Returns:
+    - pandas DataFrame: The estimate and two-sided p-value, (k + 1) / (n_permutations + 1), of each predictor.
+    - pandas DataFrame: The estimate of each predictor under each permutation, if return_samples.
+
+    """
+    estimate = _fit_spec(spec, fit_kwargs).params
+    if columns is None:
+        columns = [column for column in estimate.index if column in spec.data.columns]
+    samples = pd.concat([_resample(spec, column, n_permutations, seed, n_jobs, cache_dir, fit_kwargs,
+                                   list(estimate.index))[column] for column in columns], axis=1)
+    observed = estimate[columns]
+    exceed = (np.abs(samples) >= np.abs(observed) * (1 - 1e-12)).sum(axis=0)
+    p_value = (exceed + 1) / (samples.notna().sum(axis=0) + 1)
+    result = pd.DataFrame({"estimate": observed, "p_value": p_value})
+    return (result, samples) if return_samples else result
+
+
+def _fit_spec(spec, fit_kwargs):
+    return MixedModelSummary(spec.name, spec.formula, _fit(spec, spec.data, fit_kwargs))
+
+
+def _fit(spec, data, fit_kwargs):
+    model = smf.mixedlm(spec.formula, data=data, groups=data[spec.groups], re_formula=spec.re_formula,
+                        vc_formula=spec.vc_formula)
+    return model.fit(**fit_kwargs)
+
+
+def _resample(spec, kind, n, seed, n_jobs, cache_dir, fit_kwargs, names):
+    """
+    Fixed effects of n refits, kind is "bootstrap" or the column to permute.
+    """
+    key = _cache_key(f"{kind}-{n}-{seed}", spec, fit_kwargs) if seed is not None else None
+    samples = _load_cached(cache_dir, key)
+    if samples is not None:
+        return samples
+    seeds = np.random.SeedSequence(seed).spawn(n)
+    n_blocks = min(n, 4 * (n_jobs or os.cpu_count() or 1))
+    blocks = [seeds[i::n_blocks] for i in range(n_blocks)]
+    log.info(f"Fitting {n} {'bootstrap samples' if kind == 'bootstrap' else 'permutations of ' + kind} of {spec.name}")
+    if n_jobs == 1:
+        estimates = [_resample_block(spec, kind, block, names, fit_kwargs) for block in blocks]
+    else:
+        # the data is sent to each worker once, not with every block
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(spec.data,)) as pool:
+            estimates = list(pool.map(_resample_block, [spec._replace(data=None)] * n_blocks, [kind] * n_blocks,
+                                      blocks, [names] * n_blocks, [fit_kwargs] * n_blocks))
+    samples = np.empty((n, len(names)))
+    for i, block in enumerate(estimates):  # undo the interleaving of the blocks
+        samples[i::n_blocks] = block
+    samples = pd.DataFrame(samples, columns=names)
+    failed = samples.isna().any(axis=1).sum()
+    if failed:
+        log.info(f"{failed} of {n} fits of {spec.name} failed, their estimates are NaN")
+    _save_cached(cache_dir, key, samples)
+    return samples
+
+
+def _init_worker(data):
+    global _data
+    _data = data
+
+
+def _resample_block(spec, kind, seeds, names, fit_kwargs):
+    data = _data if spec.data is None else spec.data
+    if kind == "bootstrap":
+        codes, uniques = pd.factorize(data[spec.groups])
+        rows = [np.flatnonzero(codes == group) for group in range(len(uniques))]
+    estimates = np.full((len(seeds), len(names)), np.nan)
+    for i, seed in enumerate(seeds):
+        rng = np.random.default_rng(seed)
+        if kind == "bootstrap":
+            drawn = [rows[group] for group in rng.integers(len(rows), size=len(rows))]
+            sample = data.iloc[np.concatenate(drawn)].copy()
+            sample[spec.groups] = np.repeat(np.arange(len(drawn)), [len(group) for group in drawn])
+        else:
+            sample = data.copy()
+            sample[kind] = rng.permutation(sample[kind].to_numpy())
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")  # convergence warnings of single refits
+                estimates[i] = _fit(spec, sample, fit_kwargs).fe_params.reindex(names)
+        except (np.linalg.LinAlgError, ValueError):
+            pass
+    return estimates
+
+
+def _cache_key(kind, spec, fit_kwargs):
+    data_hash = pd.util.hash_pandas_object(spec.data, index=True).to_numpy()
+    content = repr((kind, spec.formula, spec.groups, spec.re_formula, spec.vc_formula, sorted(fit_kwargs.items()),
+                    list(spec.data.columns), statsmodels.__version__))
+    return hashlib.sha1(content.encode() + data_hash.tobytes()).hexdigest()
+
+
+def _load_cached(cache_dir, key):
+    path = os.path.join(cache_dir, f"{key}.pkl") if cache_dir and key else None
+    if path and os.path.exists(path):
+        with open(path, "rb") as file:
+            return pickle.load(file)
+    return None
+
+
+def _save_cached(cache_dir, key, value):
+    if not cache_dir or not key:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{key}.pkl")
+    with open(f"{path}.tmp", "wb") as file:
+        pickle.dump(value, file)
+    os.replace(f"{path}.tmp", path)
@@ -0,0 +1,175 @@
+import os
+import logging
+import sqlite3
+import hashlib
+import pandas as pd
+from analysis.utils.results_index import ResultsIndex
+from analysis.utils.misc import _load_indexed_tables
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+    logging.info("WARNING: duckdb not found, the results database falls back to SQLite. Maybe try installing: "
+                 "pip install duckdb")
+
+log = logging.getLogger(__name__)
+
+# paradigm, table name and columns the views rely on, added as NULL if no session recorded them yet
+PARADIGMS = {"NumJudge": ("numjudge", ["reversed_speech", "response", "solution", "rt", "is_correct"]),
+             "LocaAccu": ("locaaccu", ["mode", "rt"]),
+             "SpatMask": ("spatmask", ["threshold", "threshold_speaker_id", "sequence", "stairs"])}
+
+# columns written once per session, forward filled to every trial of the session
+SESSION_COLUMNS = ("mode", "reversed_speech", "talker", "sequence", "plan_seed")
+
+VIEWS = {
+    "numjudge_clear": "SELECT * FROM numjudge WHERE NOT reversed_speech",
+    "numjudge_reversed": "SELECT * FROM numjudge WHERE reversed_speech",
+    "locaaccu_noise": "SELECT * FROM locaaccu WHERE mode = 'noise'",
+    "locaaccu_babble": "SELECT * FROM locaaccu WHERE mode = 'babble'",
+    # masker_condition is the masker position from the trial sequence, only valid for staircases run one after the
+    # other; masker_speaker_id is recorded with the threshold and also valid for interleaved staircases
+    "spatmask_thresholds": "SELECT subject, cohort, session, plane, trial AS staircase, threshold, "
+                           "threshold_speaker_id AS masker_speaker_id, "
+                           "CAST(json_extract(sequence, '$.trials[' || CAST(trial AS VARCHAR) || ']') AS INTEGER) "
+                           "AS masker_condition, stairs FROM spatmask WHERE threshold IS NOT NULL",
+}
+
+
+class ResultsDatabase:
+    """
+    Embedded SQL database over the results of all sessions, stored in data_dir/.cache. There is one table per paradigm
+    (numjudge, locaaccu, spatmask) with one row per trial, in the layout of analysis.utils.misc.load_results plus the
+    columns subject, cohort, session (start of the session), plane and trial (row within the session). The columns in
+    SESSION_COLUMNS, e.g. reversed_speech and mode, are filled for every trial, so the views in VIEWS are plain
+    filters:
+
+    - numjudge_clear, numjudge_reversed: NumJudge trials with forward or reversed speech.
+    - locaaccu_noise, locaaccu_babble: LocaAccu trials with noise or babble stimuli.
+    - spatmask_thresholds: one row per SpatMask staircase with threshold and masker.
+
+    Uses DuckDB if installed, SQLite otherwise. refresh() rebuilds the table of a paradigm only when its files changed
+    according to the ResultsIndex, otherwise opening the database is all it takes.
+
+    Example::
+
+        db = ResultsDatabase(data_dir)
+        db.refresh()
+        rts = db.query("SELECT subject, plane, avg(rt) AS rt FROM numjudge_reversed GROUP BY subject, plane")
+        babble_h = db.view("locaaccu_babble", plane="h")
+    """
+
+    def __init__(self, data_dir, path=None, backend=None, n_jobs=None):
+        """
+        Parameters:
+        - data_dir (str): directory with the subject folders of the results files.
+        - path (str, optional): database file, defaults to data_dir/.cache/results.duckdb or results.sqlite.
+        - backend (str, optional): "duckdb" or "sqlite", defaults to duckdb if installed.
+        - n_jobs (int, optional): number of worker processes for parsing the results files.
+        """
+        self.backend = backend or ("duckdb" if duckdb is not None else "sqlite")
+        if self.backend not in ("duckdb", "sqlite"):
+            raise ValueError(f"backend must be duckdb or sqlite, not {self.backend}")
+        self.data_dir = data_dir
+        self.path = path or os.path.join(data_dir, ".cache", f"results.{self.backend}")
+        self.n_jobs = n_jobs
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection = duckdb.connect(self.path) if self.backend == "duckdb" else \
+            sqlite3.connect(self.path, isolation_level=None)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS sources (paradigm VARCHAR PRIMARY KEY, "
+                                "fingerprint VARCHAR)")
+
+    def refresh(self):
+        """
+        Rebuilds the tables of the paradigms with new, changed or removed results files and recreates the views.
+        """
+        index = ResultsIndex(self.data_dir)
+        index.update()
+        fingerprints = dict()
+        for paradigm in PARADIGMS:
+            entries = index.select(paradigm=paradigm)
+            if entries:
+                fingerprints[paradigm] = hashlib.sha1(" ".join(f"{entry.path}:{entry.hash}" for entry in
+                                                               entries).encode()).hexdigest()
+        index.close()
+        stored = dict(self.query("SELECT paradigm, fingerprint FROM sources").itertuples(index=False))
+        for paradigm, fingerprint in fingerprints.items():
+            if stored.get(paradigm) != fingerprint:
+                self._write_table(paradigm, self._load_paradigm(paradigm))
+                self.connection.execute("DELETE FROM sources WHERE paradigm = ?", [paradigm])
+                self.connection.execute("INSERT INTO sources VALUES (?, ?)", [paradigm, fingerprint])
+                log.info(f"Rebuilt the {PARADIGMS[paradigm][0]} table")
+        for paradigm in set(stored) - set(fingerprints):  # all files of the paradigm were removed
+            self.connection.execute(f"DROP TABLE IF EXISTS {PARADIGMS[paradigm][0]}")
+            self.connection.execute("DELETE FROM sources WHERE paradigm = ?", [paradigm])
+        self._create_views()
+
+    def _load_paradigm(self, paradigm):
+        entries, tables = _load_indexed_tables(self.data_dir, paradigm, plane=None, fill=SESSION_COLUMNS,
+                                               n_jobs=self.n_jobs)
+        frames = list()
+        for entry, table in zip(entries, tables):
+            frame = table.drop(columns="plane", errors="ignore")
+            frame.insert(0, "trial", range(len(frame)))
+            for position, (column, value) in enumerate([("subject", entry.subject), ("cohort", entry.cohort),
+                                                         ("session", entry.started), ("plane", entry.plane)]):
+                frame.insert(position, column, pd.Series([value] * len(frame), index=frame.index, dtype="string"))
+            frames.append(frame)
+        frame = pd.concat(frames, ignore_index=True)
+        for column in PARADIGMS[paradigm][1]:
+            if column not in frame:
+                dtype = "string" if column in ("mode", "sequence", "stairs") else float
+                frame[column] = pd.Series(None, index=frame.index, dtype=dtype)
+        return frame
+
+    def _write_table(self, paradigm, frame):
+        table = PARADIGMS[paradigm][0]
+        if self.backend == "duckdb":
+            self.connection.register("frame", frame)
+            self.connection.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM frame")
+            self.connection.unregister("frame")
+        else:
+            frame.to_sql(table, self.connection, if_exists="replace", index=False)
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_subject_plane ON {table} (subject, plane)")
+
+    def _create_views(self):
+        tables = set(self.tables())
+        for name, query in VIEWS.items():
+            self.connection.execute(f"DROP VIEW IF EXISTS {name}")
+            if name.split("_")[0] in tables:
+                self.connection.execute(f"CREATE VIEW {name} AS {query}")
+
+    def tables(self):
+        """
+        Paradigm tables in the database.
+        """
+        names = {table for table, _ in PARADIGMS.values()}
+        if self.backend == "duckdb":
+            found = self.query("SELECT table_name AS name FROM information_schema.tables "
+                               "WHERE table_type = 'BASE TABLE'")
+        else:
+            found = self.query("SELECT name FROM sqlite_master WHERE type = 'table'")
+        return [name for name in found["name"] if name in names]
+
+    def query(self, sql, parameters=()):
+        """
+        Runs a SQL query with ? placeholders for the parameters.
+
+        Returns:
+        - pd.DataFrame: the result of the query.
+        """
+        if self.backend == "duckdb":
+            return self.connection.execute(sql, list(parameters)).df()
+        return pd.read_sql_query(sql, self.connection, params=list(parameters))
+
+    def view(self, name, **where):
+        """
+        Rows of a table or view, filtered by column values, e.g. view("numjudge_clear", plane="h", subject="sub_01").
+        """
+        sql = f"SELECT * FROM {name}"
+        if where:
+            sql += " WHERE " + " AND ".join(f"{column} = ?" for column in where)
+        return self.query(sql, where.values())
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,141 @@
+import os
+import re
+import sqlite3
+import hashlib
+import logging
+import datetime
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+# sub_01_NumJudge_h_p_2024-05-02-10-31-12.txt, written by slab.ResultsFile from the settings of setup_experiment.
+# Early pilot files have no cohort.
+FILENAME_PATTERN = re.compile(r"^(?P<subject>sub_\d+)_(?P<paradigm>[A-Za-z]+)_(?P<plane>[hv])(?:_(?P<cohort>[a-z]+))?"
+                              r"_(?P<started>\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2})\.txt$")
+
+IndexEntry = namedtuple("IndexEntry", ["path", "subject", "paradigm", "plane", "cohort", "started", "mtime_ns", "size",
+                                       "hash"])
+
+
+class ResultsIndex:
+    """
+    Persistent index of the results files in a data directory, stored as SQLite database in data_dir/.cache. For each
+    file it records subject, paradigm, plane and cohort parsed from the file name, the start of the session and the
+    modification time, size and SHA-1 hash of the file. update() only stats the files and hashes the new or changed
+    ones, so selecting the files of a paradigm costs the same no matter how many sessions were recorded. The hash
+    identifies the content of a file, e.g. to key the cache of load_results.
+
+    Example::
+
+        index = ResultsIndex(data_dir)
+        index.update()
+        for entry in index.select(paradigm="NumJudge", plane="h"):
+            print(entry.subject, entry.path)
+    """
+
+    def __init__(self, data_dir, path=None):
+        """
+        Parameters:
+        - data_dir (str): directory with the subject folders of the results files.
+        - path (str, optional): database file, defaults to data_dir/.cache/results_index.sqlite.
+        """
+        self.data_dir = data_dir
+        self.path = path or os.path.join(data_dir, ".cache", "results_index.sqlite")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, subject TEXT, "
+                                    "paradigm TEXT, plane TEXT, cohort TEXT, started TEXT, mtime_ns INTEGER, "
+                                    "size INTEGER, hash TEXT, indexed TEXT)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS files_paradigm_plane ON files (paradigm, plane)")
+
+    def update(self):
+        """
+        Adds new and changed results files to the index and removes deleted ones. Folders starting with a dot, like
+        the cache, are skipped.
+
+        Returns:
+        - tuple: number of added or changed and number of removed files.
+        """
+        known = {path: (mtime_ns, size) for path, mtime_ns, size in
+                 self.connection.execute("SELECT path, mtime_ns, size FROM files")}
+        seen = set()
+        changed = list()
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        for root, dirs, files in os.walk(self.data_dir):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in files:
+                if not name.endswith(".txt"):
+                    continue
+                file = os.path.join(root, name)
+                path = os.path.relpath(file, self.data_dir)
+                seen.add(path)
+                stat = os.stat(file)
+                if known.get(path) == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                match = FILENAME_PATTERN.match(name)
+                if match is None:
+                    log.warning(f"{path} is not named like a results file, it is indexed without subject and "
+                                "paradigm and not selected")
+                    fields = dict.fromkeys(["subject", "paradigm", "plane", "cohort", "started"])
+                else:
+                    fields = match.groupdict()
+                changed.append((path, fields["subject"], fields["paradigm"], fields["plane"], fields["cohort"],
+                                fields["started"], stat.st_mtime_ns, stat.st_size, _file_hash(file), now))
+        removed = [(path,) for path in known if path not in seen]
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", changed)
+            self.connection.executemany("DELETE FROM files WHERE path = ?", removed)
+        if changed or removed:
+            log.info(f"Indexed {len(changed)} new or changed and removed {len(removed)} results files")
+        return len(changed), len(removed)
+
+    def select(self, paradigm=None, plane=None, cohort=None, subjects=None):
+        """
+        Files matching all given criteria, ordered by subject and start of the session.
+
+        Parameters:
+        - paradigm (str, optional): NumJudge, SpatMask or LocaAccu.
+        - plane (str, optional): h or v.
+        - cohort (str, optional): p (pilot) or t (test).
+        - subjects (list, optional): subject ids, e.g. ["sub_01", "sub_02"].
+
+        Returns:
+        - list: IndexEntry tuples with the absolute path of each file.
+        """
+        criteria = {"paradigm": paradigm, "plane": plane, "cohort": cohort}
+        where = [f"{column} = ?" for column, value in criteria.items() if value is not None]
+        parameters = [value for value in criteria.values() if value is not None]
+        if subjects is not None:
+            subjects = list(subjects)
+            where.append(f"subject IN ({', '.join('?' * len(subjects))})")
+            parameters.extend(subjects)
+        query = f"SELECT {', '.join(IndexEntry._fields)} FROM files"
+        if where:
+            query += f" WHERE {' AND '.join(where)}"
+        rows = self.connection.execute(query + " ORDER BY subject, started, path", parameters)
+        return [IndexEntry(os.path.join(self.data_dir, row[0]), *row[1:]) for row in rows]
+
+    def unmatched(self):
+        """
+        Files not named like results files, which select() never returns.
+
+        Returns:
+        - list: absolute paths of the files.
+        """
+        rows = self.connection.execute("SELECT path FROM files WHERE paradigm IS NULL ORDER BY path")
+        return [os.path.join(self.data_dir, row[0]) for row in rows]
+
+    def hashes(self):
+        return {row[0] for row in self.connection.execute("SELECT hash FROM files")}
+
+    def close(self):
+        self.connection.close()
+
+
+def _file_hash(file):
+    digest = hashlib.sha1()
+    with open(file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
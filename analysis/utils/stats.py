@@ -1,9 +1,11 @@
 from statsmodels.regression.linear_model import OLS
 import itertools
+from scipy.special import comb
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
+from concurrent.futures import ProcessPoolExecutor
 
 
 def mallows_ck(k, X, y):
@@ -16,116 +18,393 @@ def mallows_ck(k, X, y):
     - y (pandas Series): The target variable.
 
     Returns:
-    - best_model (pandas Series): The best model selected based on Mallows' C_p criterion.
+    - best_model (pandas Series): The best model selected based on Mallows' C_p criterion, with the fitted "model",
+      its "RSS" and the other columns of best_subsets.
 
-    This function performs Mallows' C_p criterion for feature selection to identify the best model
-    with a given number of predictors. It fits multiple linear regression models for all possible
-    combinations of k predictors and returns the model with the lowest residual sum of squares (RSS).
+    This function finds the best model with a given number of predictors, the combination of k predictors with the
+    lowest residual sum of squares (RSS), see best_subsets.
 
     """
-    results = []
-
-    def process_subset(feature_set, X, y):
-        # Fit a linear regression model and calculate RSS
-        model = OLS(y, X[list(feature_set)])
-        regr = model.fit()
-        RSS = ((regr.predict(X[list(feature_set)]) - y) ** 2).sum()
-        return {"model": regr, "RSS": RSS}
-
-    for combo in itertools.combinations(X.columns, k):
-        results.append(process_subset(combo, X, y))
-
-    # Create a DataFrame to store model results
-    models = pd.DataFrame(results)
-
-    # Select the model with the lowest RSS
-    best_model = models.loc[models['RSS'].argmin()]
+    best_model = best_subsets(X, y, sizes=[k]).loc[k]
 
     # Print information about the modeling process
-    print("Processed", models.shape[0], "models on", k, "predictors")
+    print("Processed", best_model["n_evaluated"], "models on", k, "predictors")
 
     # Return the best model and its associated information
     return best_model
 
 
-def permutation_test(group1, group2, n_permutations=10000, plot=True, **kwargs):
+def best_subsets(X, y, sizes=None, method="auto", fit=True, n_jobs=1):
     """
-    Perform a permutation test to compare two groups.
+    Best subset selection: the combination of predictors with the lowest residual sum of squares (RSS) for each number
+    of predictors, with the criteria to compare the sizes. Like in mallows_ck, the predictors are used as given, add
+    a constant column to X for an intercept.
 
     Parameters:
-    - group1 (pandas Series or numpy array): Data for the first group.
-    - group2 (pandas Series or numpy array): Data for the second group.
-    - n_permutations (int, optional): Number of permutations to perform (default is 10000).
-    - plot (bool, optional): Whether to plot the permutation distribution (default is True).
+    - X (pandas DataFrame): The feature matrix.
+    - y (pandas Series): The target variable.
+    - sizes (iterable, optional): The numbers of predictors to consider. Default is 1 to the number of columns.
+    - method (str, optional): "exhaustive" evaluates all subsets, "branch_and_bound" skips the subsets that cannot
+      beat the best one found so far. Default is "auto", exhaustive for the sizes with at most 2^18 subsets.
+    - fit (bool, optional): Whether to fit a statsmodels OLS of the best subset of each size. Default is True.
+    - n_jobs (int, optional): The number of worker processes the sizes are spread over. Default is 1, computes in this
+      process.
 
     Returns:
-    - p_value (float): The p-value for the permutation test.
-
-    The permutation test assesses whether the difference between the means of two groups is
-    statistically significant by randomly permuting the data and computing the p-value.
+    - pandas DataFrame: One row per size k with the columns features (tuple of column names), RSS, rsquared_adj, Cp
+      (Mallows' C_p with the error variance of the model with all predictors), AIC, BIC, n_evaluated (the number of
+      subsets whose RSS was computed) and model (the fitted OLS results, None if fit is False).
+
+    Note:
+    - The RSS of a subset S is y'y - b_S' G_SS^-1 b_S, with the Gram matrix G = X'X and b = X'y computed once.
+      The exhaustive search solves the systems of many subsets in one batched call. The branch and bound search walks
+      the tree of subsets obtained by removing predictors from the full set (Narendra & Fukunaga, 1977; Furnival &
+      Wilson, 1974). Removing predictors never decreases the RSS, so a branch is skipped once its RSS is above the
+      best subset of size k found. The RSS of all children of a node follows from the inverse of its Gram matrix,
+      which is downdated instead of inverted at each node. How much it skips depends on the data, with many similar
+      predictors the exhaustive search is faster, hence the choice by the number of subsets.
+    - AIC and BIC are those of statsmodels for a model with k parameters. Like there, rsquared_adj is centered if the
+      subset contains a constant column and uncentered otherwise.
 
     """
+    columns = list(X.columns)
+    X_data = np.asarray(X, dtype=float)
+    y_data = np.asarray(y, dtype=float)
+    n, p = X_data.shape
+    sizes = range(1, p + 1) if sizes is None else [int(k) for k in sizes]
+    if method not in ("auto", "branch_and_bound", "exhaustive"):
+        raise ValueError(f"method must be auto, branch_and_bound or exhaustive, not {method}")
+    if any(k < 1 or k > p for k in sizes):
+        raise ValueError(f"sizes must be between 1 and the number of predictors ({p})")
+
+    # Like statsmodels, a nonzero column without variation is a constant, the R^2 of subsets containing one is centered
+    constant = (np.ptp(X_data, axis=0) == 0) & np.any(X_data != 0, axis=0)
+    tss_centered = np.sum((y_data - y_data.mean()) ** 2)
+
+    # The RSS does not depend on the scale of the predictors, scaling them to unit norm conditions the Gram matrix
+    X_data = X_data / np.linalg.norm(X_data, axis=0)
+    gram, xty, yty = X_data.T @ X_data, X_data.T @ y_data, y_data @ y_data
+    if n_jobs == 1 or len(sizes) == 1:
+        results = [_best_subset(gram, xty, yty, k, method) for k in sizes]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_best_subset, *zip(*[(gram, xty, yty, k, method) for k in sizes])))
+
+    rss_full = yty - xty @ np.linalg.pinv(gram) @ xty
+    sigma2 = rss_full / (n - p) if n > p else np.nan
+    rows = list()
+    for k, (subset, rss, n_evaluated) in zip(sizes, results):
+        features = tuple(columns[i] for i in subset)
+        llf = -n / 2 * (np.log(2 * np.pi) + np.log(rss / n) + 1)
+        if constant[list(subset)].any():
+            rsquared_adj = 1 - (n - 1) / (n - k) * rss / tss_centered
+        else:
+            rsquared_adj = 1 - n / (n - k) * rss / yty
+        rows.append({"features": features, "RSS": rss, "rsquared_adj": rsquared_adj,
+                     "Cp": rss / sigma2 - n + 2 * k, "AIC": -2 * llf + 2 * k, "BIC": -2 * llf + np.log(n) * k,
+                     "n_evaluated": n_evaluated,
+                     "model": OLS(y, X[list(features)]).fit() if fit else None})
+    return pd.DataFrame(rows, index=pd.Index(sizes, name="k"))
+
+
+def _best_subset(gram, xty, yty, k, method):
+    """
+    Indices, RSS and number of evaluated subsets of the best subset of k predictors.
+    """
+    p = len(xty)
+    if method == "exhaustive" or (method == "auto" and comb(p, k, exact=True) <= 2 ** 18):
+        return _best_subset_exhaustive(gram, xty, yty, k)
+    inverse = np.linalg.pinv(gram)
+    best = [None, np.inf, 1]
+
+    def visit(subset, inverse, beta, rss, candidates):
+        # subset: predictors of the node, candidates: positions in subset which its descendants may still remove
+        if len(subset) == k:
+            if rss < best[1]:
+                best[:2] = list(subset), rss
+            return
+        # RSS of the subsets without one of the candidates: rss + beta_j^2 / inverse_jj
+        increase = beta[candidates] ** 2 / np.diagonal(inverse)[candidates]
+        order = [candidates[i] for i in np.argsort(increase)]
+        best[2] += len(order)
+        for i, j in enumerate(order):
+            rest = order[i + 1:]
+            if len(subset) - 1 - len(rest) > k:  # removing all later candidates leaves more than k predictors
+                break
+            child_rss = rss + increase[candidates.index(j)]
+            if child_rss >= best[1]:
+                continue
+            keep = [m for m in range(len(subset)) if m != j]
+            child_inverse = inverse - np.outer(inverse[:, j], inverse[j]) / inverse[j, j]
+            child_beta = beta - inverse[:, j] * beta[j] / inverse[j, j]
+            visit([subset[m] for m in keep], child_inverse[np.ix_(keep, keep)], child_beta[keep], child_rss,
+                  [keep.index(m) for m in rest])
+
+    beta = inverse @ xty
+    visit(list(range(p)), inverse, beta, yty - xty @ beta, list(range(p)))
+    return tuple(best[0]), float(best[1]), best[2]
+
+
+def _best_subset_exhaustive(gram, xty, yty, k, chunk_size=2 ** 14):
+    best, best_rss, n_evaluated = None, np.inf, 0
+    combinations = itertools.combinations(range(len(xty)), k)
+    while (chunk := np.array(list(itertools.islice(combinations, chunk_size)), dtype=np.intp)).size:
+        grams = gram[chunk[:, :, None], chunk[:, None, :]]
+        b = xty[chunk]
+        try:
+            beta = np.linalg.solve(grams, b[..., None])[..., 0]
+        except np.linalg.LinAlgError:  # collinear predictors
+            beta = (np.linalg.pinv(grams) @ b[..., None])[..., 0]
+        rss = yty - np.einsum("ij,ij->i", b, beta)
+        i = rss.argmin()
+        if rss[i] < best_rss:
+            best, best_rss = tuple(chunk[i].tolist()), float(rss[i])
+        n_evaluated += len(chunk)
+    return best, best_rss, n_evaluated
+
+
+def grouped_linregress(data, x, y, by=None, fit_intercept=True):
+    """
+    Simple linear regression of y on x in every group of a DataFrame, e.g. the localization gain of each subject,
+    condition and plane, computed from grouped sums in one pass over all groups.
 
-    # Initialize a list to save the results of each permutation
-    results = list()
-
-    # Concatenate the two groups to create a pooled dataset
-    pooled = pd.concat([group1, group2])
-
-    # Get the length of the first group (used for sampling)
-    len_group = len(group1)
-
-    # Calculate the observed difference in means between the two groups
-    observed_diff = group1.mean() - group2.mean()
-
-    # Perform n_permutations permutations
-    for _ in range(n_permutations):
-        # Randomly permute the pooled data
-        permuted = np.random.permutation(pooled)
+    Parameters:
+    - data (pandas DataFrame): The observations of all groups.
+    - x (str): The column of the predictor.
+    - y (str): The column of the response.
+    - by (str or list, optional): The columns or index levels defining the groups, e.g. ["Sub_ID", "condition",
+      "plane"]. Default is one group with all observations.
+    - fit_intercept (bool, optional): Whether to fit an intercept, otherwise the line goes through the origin.
+      Default is True.
 
-        # Calculate the mean for each permuted group
-        assigned1 = permuted[:len_group].mean()
-        assigned2 = permuted[len_group:].mean()
+    Returns:
+    - pandas DataFrame: One row per group with the columns n (the number of observations), slope, intercept, r2 (the
+      coefficient of determination, like sklearn's LinearRegression.score) and mse (the mean squared residual).
 
-        # Calculate the difference in means for this permutation
-        results.append(assigned1 - assigned2)
+    Observations where x or y is NaN are left out. Groups with fewer than two observations or without variance in x
+    get NaN, r2 is NaN for groups without variance in y.
 
-    # Convert results to a numpy array and take absolute values
-    results = np.abs(np.array(results))
+    """
+    xs = data[x].to_numpy(dtype=float)
+    ys = data[y].to_numpy(dtype=float)
+    if by is None:
+        codes, keys = np.zeros(len(data), dtype=np.intp), pd.Index(["all"])
+    else:
+        grouped = data.groupby(by, sort=True)
+        codes, keys = grouped.ngroup().to_numpy(), grouped.size().index
+    valid = ~(np.isnan(xs) | np.isnan(ys)) & (codes >= 0)  # ngroup is -1 for NaN keys
+    codes, xs, ys = codes[valid], xs[valid], ys[valid]
+
+    def sums(values):
+        return np.bincount(codes, weights=values, minlength=len(keys))
+
+    n = np.bincount(codes, minlength=len(keys))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_x, mean_y = sums(xs) / n, sums(ys) / n
+        dx, dy = xs - mean_x[codes], ys - mean_y[codes]  # centered in two passes, the sums stay accurate
+        sxx, syy, sxy = sums(dx * dx), sums(dy * dy), sums(dx * dy)
+        if fit_intercept:
+            denominator = sxx
+            slope = sxy / sxx
+            intercept = mean_y - slope * mean_x
+            ss_res = syy - slope * sxy
+        else:
+            denominator, raw_xy = sums(xs * xs), sums(xs * ys)
+            slope = raw_xy / denominator
+            intercept = np.zeros(len(keys))
+            ss_res = sums(ys * ys) - slope * raw_xy
+        ss_res = np.maximum(ss_res, 0)
+        r2 = np.where(syy > 0, 1 - ss_res / syy, np.nan)
+        mse = ss_res / n
+    undefined = (n < 2) | (denominator <= 0)
+    slope[undefined] = intercept[undefined] = r2[undefined] = mse[undefined] = np.nan
+    return pd.DataFrame({"n": n, "slope": slope, "intercept": intercept, "r2": r2, "mse": mse}, index=keys)
+
+
+class PermutationResult:
+    """
+    Result of permutation_tests.
+
+    Attributes:
+    - statistic (float or ndarray): The observed mean difference, one per comparison.
+    - p_value (float or ndarray): The permutation p-value of each comparison.
+    - p_value_max (float or ndarray): The p-value of each comparison corrected for multiple comparisons with the
+      maximum statistic over all comparisons (Westfall & Young, 1993). Equals p_value for a single comparison.
+    - null_distribution (ndarray): The mean differences under the null hypothesis, of shape (n_permutations,) or
+      (n_permutations, n_comparisons).
+    - alternative (str): "two-sided", "greater" or "less".
+    - paired (bool): Whether the observations were paired (sign-flip test).
 
-    # Count how many permutations have a difference as extreme as or more extreme than observed_diff
-    values_as_or_more_extreme = sum(results >= observed_diff)
+    """
 
-    # Calculate the p-value
-    num_simulations = results.shape[0]
-    p_value = values_as_or_more_extreme / num_simulations
+    def __init__(self, statistic, p_value, p_value_max, null_distribution, alternative, paired):
+        self.statistic = statistic
+        self.p_value = p_value
+        self.p_value_max = p_value_max
+        self.null_distribution = null_distribution
+        self.alternative = alternative
+        self.paired = paired
+
+    @property
+    def n_permutations(self):
+        return len(self.null_distribution)
+
+    def __repr__(self):
+        return f"PermutationResult(statistic={self.statistic}, p_value={self.p_value}, " \
+               f"p_value_max={self.p_value_max}, n_permutations={self.n_permutations}, " \
+               f"alternative='{self.alternative}', paired={self.paired})"
+
+    def plot(self, comparison=0, **kwargs):
+        """
+        Plot the permutation distribution of a comparison and the observed difference, the absolute values for a
+        two-sided test.
+        """
+        null = self.null_distribution if self.null_distribution.ndim == 1 else self.null_distribution[:, comparison]
+        observed = np.atleast_1d(self.statistic)[comparison]
+        label = "Mean Difference Between Groups"
+        if self.alternative == "two-sided":
+            null, observed, label = np.abs(null), abs(observed), "Absolute " + label
 
-    if plot:
         # Plot the permutation distribution and observed difference
-        density_plot = sns.kdeplot(results, fill=True, **kwargs)
+        density_plot = sns.kdeplot(null, fill=True, **kwargs)
         density_plot.set(
-            xlabel='Absolute Mean Difference Between Groups',
+            xlabel=label,
             ylabel='Proportion of Permutations'
         )
 
         # Add a line to show the actual difference observed in the data
         density_plot.axvline(
-            x=observed_diff,
+            x=observed,
             color='red',
             linestyle='--'
         )
 
         # Add a legend to the plot
         plt.legend(
-            labels=['Permutation Distribution', f'Observed Difference: {round(observed_diff, 2)}'],
+            labels=['Permutation Distribution', f'Observed Difference: {round(observed, 2)}'],
             loc='upper right'
         )
 
         # Display the plot
         plt.show()
 
-    return p_value
+
+def permutation_tests(group1, group2, n_permutations=10000, paired=False, alternative="two-sided", seed=None,
+                      block_size=None, n_jobs=1):
+    """
+    Perform permutation tests of the mean difference between two groups, for one or many comparisons at once.
+
+    Parameters:
+    - group1 (array-like): Data for the first group, of shape (n_observations,) or (n_observations, n_comparisons).
+    - group2 (array-like): Data for the second group, with the same number of comparisons.
+    - n_permutations (int, optional): Number of permutations to perform (default is 10000).
+    - paired (bool, optional): Paired observations, tested by flipping the signs of the differences (default is
+      False, the group labels are permuted).
+    - alternative (str, optional): "two-sided", "greater" (group1 > group2) or "less" (default is "two-sided").
+    - seed (int, optional): Seed of the random number generator, the same seed gives the same result for any n_jobs.
+    - block_size (int, optional): Number of permutations generated at once, by default chosen to keep a block below
+      about 32 MB.
+    - n_jobs (int, optional): Number of processes the blocks are split across (default is 1, None uses all cpus).
+
+    Returns:
+    - PermutationResult: The observed differences, p-values and null distribution.
+
+    For many comparisons (columns), every permutation reassigns the observations of all comparisons alike, and
+    p_value_max compares each observed difference with the maximum over all comparisons of each permutation.
+    The p-values are (number of permutations at least as extreme as observed + 1) / (n_permutations + 1).
+
+    """
+    if alternative not in ("two-sided", "greater", "less"):
+        raise ValueError(f"alternative must be two-sided, greater or less, not {alternative}")
+    group1 = np.asarray(group1, dtype=float)
+    group2 = np.asarray(group2, dtype=float)
+    single = group1.ndim == 1
+    group1 = group1.reshape(len(group1), -1)
+    group2 = group2.reshape(len(group2), -1)
+    if paired:
+        if group1.shape != group2.shape:
+            raise ValueError("Paired groups must have the same shape")
+        data, n_group1 = group1 - group2, None
+        observed = data.mean(axis=0)
+    else:
+        if group1.shape[1] != group2.shape[1]:
+            raise ValueError("Both groups must have the same number of comparisons")
+        data, n_group1 = np.concatenate([group1, group2]), len(group1)
+        observed = group1.mean(axis=0) - group2.mean(axis=0)
+
+    # Split the permutations into blocks, each with its own seed
+    block_size = block_size or max(1, 2 ** 22 // data.size)
+    sizes = [min(block_size, n_permutations - start) for start in range(0, n_permutations, block_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    n = len(sizes)
+    if n_jobs != 1 and n > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            blocks = list(pool.map(_permutation_block, [data] * n, [n_group1] * n, sizes, seeds))
+    else:
+        blocks = [_permutation_block(data, n_group1, size, block_seed) for size, block_seed in zip(sizes, seeds)]
+    null = np.concatenate(blocks)
+
+    # Count the permutations at least as extreme as observed, with a tolerance for rounding errors
+    tolerance = 1e-12 * np.maximum(1, np.abs(observed))
+    if alternative == "two-sided":
+        extreme_null, extreme_observed = np.abs(null), np.abs(observed) - tolerance
+    elif alternative == "greater":
+        extreme_null, extreme_observed = null, observed - tolerance
+    else:
+        extreme_null, extreme_observed = -null, -observed - tolerance
+    p_value = ((extreme_null >= extreme_observed).sum(axis=0) + 1) / (n_permutations + 1)
+    p_value_max = ((extreme_null.max(axis=1)[:, None] >= extreme_observed).sum(axis=0) + 1) / (n_permutations + 1)
+
+    if single:
+        return PermutationResult(float(observed[0]), float(p_value[0]), float(p_value_max[0]), null[:, 0],
+                                 alternative, paired)
+    return PermutationResult(observed, p_value, p_value_max, null, alternative, paired)
+
+
+def _permutation_block(data, n_group1, size, seed):
+    """
+    Mean differences of a block of permutations, of shape (size, n_comparisons).
+    """
+    rng = np.random.default_rng(seed)
+    if n_group1 is None:  # paired, flip the signs of the differences
+        signs = rng.integers(0, 2, size=(size, len(data)), dtype=np.int8) * 2 - 1
+        return signs @ data / len(data)
+    # Each row is a permutation of the observations, the first n_group1 are assigned to group 1
+    order = rng.permuted(np.broadcast_to(np.arange(len(data)), (size, len(data))), axis=1)[:, :n_group1]
+    sum1 = data[order].sum(axis=1)
+    return sum1 / n_group1 - (data.sum(axis=0) - sum1) / (len(data) - n_group1)
+
+
+def permutation_test(group1, group2, n_permutations=10000, plot=True, **kwargs):
+    """
+    Perform a permutation test to compare two groups.
+
+    Parameters:
+    - group1 (pandas Series or numpy array): Data for the first group.
+    - group2 (pandas Series or numpy array): Data for the second group.
+    - n_permutations (int, optional): Number of permutations to perform (default is 10000).
+    - plot (bool, optional): Whether to plot the permutation distribution (default is True).
+
+    Returns:
+    - p_value (float): The two-sided p-value for the permutation test.
+
+    The permutation test assesses whether the difference between the means of two groups is
+    statistically significant by randomly permuting the data and computing the p-value, see permutation_tests.
+
+    """
+    result = permutation_tests(group1, group2, n_permutations=n_permutations)
+    if plot:
+        result.plot(**kwargs)
+    return result.p_value
 
 
 if __name__ == "__main__":
-    pass
+    import timeit
+
+    # benchmark: 100k permutations of two groups of 100 observations
+    rng = np.random.default_rng(0)
+    a, b = rng.normal(0.3, 1, 100), rng.normal(0, 1, 100)
+    duration = timeit.timeit(lambda: permutation_tests(a, b, n_permutations=100000, seed=1), number=1)
+    print(f"{permutation_tests(a, b, n_permutations=100000, seed=1)}\n100k permutations: {duration:.2f} s")
+    duration = timeit.timeit(lambda: permutation_tests(a, b, n_permutations=100000, paired=True, seed=1), number=1)
+    print(f"100k sign flips: {duration:.2f} s")
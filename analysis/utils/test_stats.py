@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+import pytest
+from statsmodels.api import add_constant
+from statsmodels.regression.linear_model import OLS
+from analysis.utils.stats import best_subsets
+
+
+def _data(n=40, p=5, seed=0):
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.normal(size=(n, p)), columns=[f"x{i}" for i in range(p)])
+    y = pd.Series(3 + X @ rng.normal(size=p) + rng.normal(size=n), name="y")
+    return X, y
+
+
+@pytest.mark.parametrize("constant", [False, True])
+def test_best_subsets_rsquared_adj_matches_statsmodels(constant):
+    X, y = _data()
+    if constant:
+        X = add_constant(X)
+    models = best_subsets(X, y)
+    for k, row in models.iterrows():
+        expected = OLS(y, X[list(row["features"])]).fit().rsquared_adj
+        assert row["rsquared_adj"] == pytest.approx(expected)
+        assert row["rsquared_adj"] == pytest.approx(row["model"].rsquared_adj)
@@ -1,7 +1,6 @@
 import pickle
 import os
-from sklearn.linear_model import LinearRegression
-import numpy as np
+from analysis.utils.stats import grouped_linregress
 import pandas as pd
 
 root = "/home/max/labplatform/data/DataFrames/"
@@ -11,21 +10,16 @@ su_fpv = os.path.join(root, "spatmask_abs_distance_v.pkl")
 suh = pickle.load(open(su_fph, "rb"))
 suv = pickle.load(open(su_fpv, "rb"))
 
-model = LinearRegression(fit_intercept=True)  # linear regression model
-
 single_subs = dict()
 for col in suh.columns:
     single_subs[col] = list()
     for thresh1, thresh2 in zip(suh[col][:13], suh[col][13:]):
         single_subs[col].append((thresh1 + thresh2) / 2)
 
-slopes = list()
-X = np.array(list((single_subs.keys()))).reshape(-1, 1)
-Y = [x for x in zip(single_subs[17.5], single_subs[35.0], single_subs[52.5])]
-
-for y in Y:
-    model.fit(X, y)
-    slopes.append(model.coef_)
+# slope of the thresholds over the masker distances of each subject
+thresholds = pd.DataFrame(single_subs)[[17.5, 35.0, 52.5]].rename_axis(index="subject", columns="distance")
+thresholds = thresholds.stack().rename("threshold").reset_index()
+slopes = grouped_linregress(thresholds, "distance", "threshold", by="subject")["slope"].to_numpy()
 
 # save slopes and processed spatmask data
 csvpath = "/home/max/labplatform/data/csv"
@@ -3,7 +3,7 @@ import os
 from labplatform.config import get_config
 import seaborn as sns
 import matplotlib.pyplot as plt
-from sklearn.linear_model import LinearRegression
+from analysis.utils.stats import grouped_linregress
 sns.set_theme()
 
 """
@@ -29,65 +29,27 @@ babble_h = locaaccu_h[np.where(filled_h=="babble", True, False)]  # True where r
 
 sub_ids = extract_subject_ids_from_dataframe(locaaccu_v)  # subject IDs
 
-model = LinearRegression(fit_intercept=True)  # linear regression model
-
-babble_data_v = dict(gain=[], r2=[], mse=[])  # dict to store data
-babble_data_h = dict(gain=[], r2=[], mse=[])  # dict to store data
-noise_data_v = dict(gain=[], r2=[], mse=[])  # dict to store data
-noise_data_h = dict(gain=[], r2=[], mse=[])  # dict to store data
-
 """
 LOCALIZATION ACCURACY
 """
 
-for sub in sub_ids:  # iterate through all subjects
-    ### vertical plane babble ###
-    actual_v = get_elevation_from_df(babble_v.loc[sub].actual)
-    perceived_v = get_elevation_from_df(babble_v.loc[sub].perceived)
-    actual_v = replace_in_array(actual_v)  # get right shape
-    perceived_v = replace_in_array(perceived_v)  # get right shape
-    # fit locaaccu data to model for first subject
-    model.fit(np.reshape(actual_v, (-1, 1)), perceived_v)  # fit model
-    babble_data_v["r2"].append(model.score(np.reshape(actual_v, (-1, 1)), perceived_v))  # R²
-    babble_data_v["gain"].append(model.coef_[0])  # slope
-    babble_data_v["mse"].append(np.mean(np.abs(np.subtract(perceived_v, actual_v)) ** 2))  # mean squared error
-
-    ### horizontal plane babble ###
-    actual_h = get_azimuth_from_df(babble_h.loc[sub].actual)
-    perceived_h = get_azimuth_from_df(babble_h.loc[sub].perceived)
-    actual_h = replace_in_array(actual_h)  # get right shape
-    perceived_h = replace_in_array(perceived_h)  # get right shape
-    model.fit(np.reshape(actual_h, (-1, 1)), perceived_h)  # fit model
-    babble_data_h["r2"].append(model.score(np.reshape(actual_h, (-1, 1)), perceived_h))  # R²
-    babble_data_h["gain"].append(model.coef_[0])  # slope
-    babble_data_h["mse"].append(np.mean(np.abs(np.subtract(perceived_h, actual_h)) ** 2))  # mean squared error
-
-    ### vertical plane noise ###
-    actual_v = get_elevation_from_df(noise_v.loc[sub].actual)
-    perceived_v = get_elevation_from_df(noise_v.loc[sub].perceived)
-    actual_v = replace_in_array(actual_v)  # get right shape
-    perceived_v = replace_in_array(perceived_v)  # get right shape
-    # fit locaaccu data to model for first subject
-    model.fit(np.reshape(actual_v, (-1, 1)), perceived_v)  # fit model
-    noise_data_v["r2"].append(model.score(np.reshape(actual_v, (-1, 1)), perceived_v))  # R²
-    noise_data_v["gain"].append(model.coef_[0])  # slope
-    noise_data_v["mse"].append(np.mean(np.abs(np.subtract(perceived_v, actual_v)) ** 2))  # mean squared error
-
-    ### horizontal plane noise ###
-    actual_h = get_azimuth_from_df(noise_h.loc[sub].actual)
-    perceived_h = get_azimuth_from_df(noise_h.loc[sub].perceived)
-    actual_h = replace_in_array(actual_h)  # get right shape
-    perceived_h = replace_in_array(perceived_h)  # get right shape
-    model.fit(np.reshape(actual_h, (-1, 1)), perceived_h)  # fit model
-    noise_data_h["r2"].append(model.score(np.reshape(actual_h, (-1, 1)), perceived_h))  # R²
-    noise_data_h["gain"].append(model.coef_[0])  # slope
-    noise_data_h["mse"].append(np.mean(np.abs(np.subtract(perceived_h, actual_h)) ** 2))  # mean squared error
-
-plt.scatter(babble_data_h["gain"], babble_data_v["gain"])
-plt.scatter(noise_data_h["gain"], noise_data_v["gain"])
+# actual and perceived position of every trial, missing responses count as 0 like before
+locaaccu = pd.concat([pd.DataFrame({"condition": condition, "plane": plane,
+                                    "actual": replace_in_array(coordinate(df.actual)),
+                                    "perceived": replace_in_array(coordinate(df.perceived))}, index=df.index)
+                      for df, condition, plane, coordinate in [(babble_v, "babble", "v", elevation_array),
+                                                               (babble_h, "babble", "h", azimuth_array),
+                                                               (noise_v, "noise", "v", elevation_array),
+                                                               (noise_h, "noise", "h", azimuth_array)]])
+# gain (slope), R² and mean squared residual of every subject, condition and plane
+locaaccu_fits = grouped_linregress(locaaccu, "actual", "perceived", by=["Sub_ID", "condition", "plane"])
+gain = locaaccu_fits["slope"].unstack(["condition", "plane"]).reindex(sub_ids)
+
+plt.scatter(gain["babble", "h"], gain["babble", "v"])
+plt.scatter(gain["noise", "h"], gain["noise", "v"])
 for i, txt in enumerate(sub_ids):
-    plt.annotate(txt, (babble_data_h["gain"][i], babble_data_v["gain"][i]))
-    plt.annotate(txt, (noise_data_h["gain"][i], noise_data_v["gain"][i]))
+    plt.annotate(txt, (gain["babble", "h"].iloc[i], gain["babble", "v"].iloc[i]))
+    plt.annotate(txt, (gain["noise", "h"].iloc[i], gain["noise", "v"].iloc[i]))
 plt.xlabel("Horizontal")
 plt.ylabel("Vertical")
 plt.title("Localization Accuracy")
@@ -107,53 +69,29 @@ filled_h = numjudge_h.reversed_speech.ffill()
 clear_h = numjudge_h[np.where(filled_h==False, True, False)]  # True where reversed_speech is True
 reversed_h = numjudge_h[np.where(filled_h==True, True, False)]  # True where reversed_speech is False
 
-clear_data_v = dict(gain=[], correct=[])  # dict to store data
-clear_data_h = dict(gain=[], correct=[])  # dict to store data
-reversed_data_v = dict(gain=[], correct=[])  # dict to store data
-reversed_data_h = dict(gain=[], correct=[])  # dict to store data
-
-for sub in sub_ids:
-    # horizontal
-    # fit clear numjudge data to model
-    x = list(clear_h.loc[sub].solution.values)
-    y = list(clear_h.loc[sub].response.fillna(0).values)
-    clear_data_h["gain"].append(np.polyfit(np.log(x), y, 1)[0])  # slope
-    correct_responses = [x for x in clear_h.loc[sub].is_correct if x == True]
-    clear_data_h["correct"].append(correct_responses.__len__() / clear_h.loc[sub].is_correct.__len__())
-
-    # fit reversed numjudge data to model
-    x = list(reversed_h.loc[sub].solution.values)
-    y = list(reversed_h.loc[sub].response.fillna(0).values)
-    reversed_data_h["gain"].append(np.polyfit(np.log(x), y, 1)[0])  # slope
-    correct_responses = [x for x in reversed_h.loc[sub].is_correct if x == True]
-    reversed_data_h["correct"].append(correct_responses.__len__() / reversed_h.loc[sub].is_correct.__len__())
-
-    # vertical
-    # fit clear numjudge data to model
-    x = list(clear_v.loc[sub].solution.values)
-    y = list(clear_v.loc[sub].response.fillna(0).values)
-    clear_data_v["gain"].append(np.polyfit(np.log(x), y, 1)[0])  # slope
-    correct_responses = [x for x in clear_v.loc[sub].is_correct if x == True]
-    clear_data_v["correct"].append(correct_responses.__len__() / clear_v.loc[sub].is_correct.__len__())
-
-    # fit reversed numjudge data to model
-    x = list(reversed_v.loc[sub].solution.values)
-    y = list(reversed_v.loc[sub].response.fillna(0).values)
-    reversed_data_v["gain"].append(np.polyfit(np.log(x), y, 1)[0])  # slope
-    correct_responses = [x for x in reversed_v.loc[sub].is_correct if x == True]
-    reversed_data_v["correct"].append(correct_responses.__len__() / reversed_v.loc[sub].is_correct.__len__())
+# slope of the response over the log number of talkers and percentage correct of every subject, speech and plane
+numjudge = pd.concat([pd.DataFrame({"speech": speech, "plane": plane,
+                                    "log_solution": np.log(df.solution.astype(float)),
+                                    "response": df.response.fillna(0).astype(float),
+                                    "correct": (df.is_correct == True).astype(float)}, index=df.index)
+                      for df, speech, plane in [(clear_h, "clear", "h"), (reversed_h, "reversed", "h"),
+                                                (clear_v, "clear", "v"), (reversed_v, "reversed", "v")]])
+keys = ["Sub_ID", "speech", "plane"]
+numjudge_gain = grouped_linregress(numjudge, "log_solution", "response", by=keys)["slope"]
+numjudge_gain = numjudge_gain.unstack(["speech", "plane"]).reindex(sub_ids)
+numjudge_correct = numjudge.groupby(keys)["correct"].mean().unstack(["speech", "plane"]).reindex(sub_ids)
 
 # gain
-plt.scatter(clear_data_h["gain"], clear_data_v["gain"])
-plt.scatter(reversed_data_h["gain"], reversed_data_v["gain"])
+plt.scatter(numjudge_gain["clear", "h"], numjudge_gain["clear", "v"])
+plt.scatter(numjudge_gain["reversed", "h"], numjudge_gain["reversed", "v"])
 plt.title("Numerosity Judgement performance gain")
 plt.xlabel("Horizontal")
 plt.ylabel("Vertical")
 plt.legend(["Forward speech", "Reversed speech"])
 
 # percent correct
-plt.scatter(clear_data_h["correct"], clear_data_v["correct"])
-plt.scatter(reversed_data_h["correct"], reversed_data_v["correct"])
+plt.scatter(numjudge_correct["clear", "h"], numjudge_correct["clear", "v"])
+plt.scatter(numjudge_correct["reversed", "h"], numjudge_correct["reversed", "v"])
 plt.title("Numerosity Judgement percentage correct")
 plt.xlabel("Horizontal")
 plt.ylabel("Vertical")
@@ -161,13 +99,13 @@ plt.legend(["Forward speech", "Reversed speech"])
 
 # save gain data
 csvpath = "/home/max/labplatform/data/csv"
-df = pd.DataFrame(clear_data_h["gain"], columns=["clearspeech_h_gain"])
+df = pd.DataFrame({"clearspeech_h_gain": numjudge_gain["clear", "h"].to_numpy()})
 df.to_csv(os.path.join(csvpath, "numjudge_clearspeech_h_gain.csv"))
-df = pd.DataFrame(clear_data_v["gain"], columns=["clearspeech_v_gain"])
+df = pd.DataFrame({"clearspeech_v_gain": numjudge_gain["clear", "v"].to_numpy()})
 df.to_csv(os.path.join(csvpath, "numjudge_clearspeech_v_gain.csv"))
 
-df = pd.DataFrame(reversed_data_h["gain"], columns=["revspeech_h_gain"])
+df = pd.DataFrame({"revspeech_h_gain": numjudge_gain["reversed", "h"].to_numpy()})
 df.to_csv(os.path.join(csvpath, "numjudge_revspeech_h_gain.csv"))
-df = pd.DataFrame(reversed_data_v["gain"], columns=["revspeech_v_gain"])
+df = pd.DataFrame({"revspeech_v_gain": numjudge_gain["reversed", "v"].to_numpy()})
 df.to_csv(os.path.join(csvpath, "numjudge_revspeech_v_gain.csv"))
 
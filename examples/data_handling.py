@@ -1,35 +1,17 @@
 import os
-import pandas as pd
-import slab
 from labplatform.config import get_config
 import seaborn as sns
 import matplotlib.pyplot as plt
+from analysis.utils.results_db import ResultsDatabase
 
 fp = os.path.join(get_config("DATA_ROOT"), "MSL")
-exp_name = "NumJudge"
 plane = "v"
-columns = ["response", "solution", "rt", "is_correct"]
-responses = list()
-solutions = list()
-rts = list()
-is_corrects = list()
 
-for root, dirs, files in os.walk(fp):
-    for file in files:
-        if exp_name in file and plane in file:
-            data_path = os.path.join(root, file)
-            responses.extend(slab.ResultsFile.read_file(data_path, "response"))
-            solutions.extend(slab.ResultsFile.read_file(data_path, "solution"))
-            rts.extend(slab.ResultsFile.read_file(data_path, "rt"))
-            is_corrects.extend(slab.ResultsFile.read_file(data_path, "is_correct"))
-        else:
-            continue
-
-df = pd.DataFrame(columns=["response", "solution", "rt", "is_correct"])
-df["response"] = responses
-df["solution"] = solutions
-df["rt"] = rts
-df["is_correct"] = is_corrects
+# only new or changed results files are read, the selection runs in the database
+db = ResultsDatabase(fp)
+db.refresh()
+df = db.query("SELECT response, solution, rt, is_correct FROM numjudge WHERE plane = ?", [plane])
+db.close()
 
 plot = sns.lineplot(data=df, x=df.solution.dropna(), y=df.response.dropna(), err_style="bars", errorbar=("se", 2))
 plot.set_xticks(range(2, 6))
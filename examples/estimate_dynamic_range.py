@@ -34,50 +34,30 @@ signals_sample_clear_h = clearspeech_h.signals_sample  # talker IDs
 country_idxs_clear_h = clearspeech_h.country_idxs  # indices of the country names from a talker
 
 # variance of dynamic range effect
-variances = dict()
-p_ref = 2e-5  # 20 μPa, the standard reference pressure for sound in air
 upper_freq = 11000  # upper frequency limit that carries information for speech
+dyn_ranges = np.arange(1, 91)
 
-# extract horizontal data
-for dyn_range in range(1, 91):
-    observations = list()
-    variances[dyn_range] = list()
-    for trial_n in range(len(clearspeech_h)):
-        signals = signals_sample_clear_h[trial_n]
-        country_idx = country_idxs_clear_h[trial_n]
-        trial_composition = [sounds_clear[x][y].resize(0.6) for x, y in zip(signals, country_idx)]
-        sound = sum(trial_composition)
-        freqs, times, power = sound.spectrogram(show=False)
-        power = power[freqs < upper_freq, :]
-        power = 10 * np.log10(power / (p_ref ** 2))  # logarithmic power for plotting
-        dB_max = power.max()
-        dB_min = dB_max - dyn_range
-        interval = power[np.where((power > dB_min) & (power < dB_max))]
-        percentage_filled = interval.shape[0] / power.flatten().shape[0]
-        observations.append(percentage_filled)
-    variances[dyn_range].append(variance(observations))
-
-plt.plot(variances.keys(), variances.values())  # plot results
-plt.title("Dynamic Range Variance Distribution")
-plt.xlabel("Dynamic Range [dB]")
-plt.ylabel("Variance of Spectro-temporal Coverage")
-
+# the spectrogram of each trial is calculated once, the coverage of all dynamic ranges follows from it
 clearspeech_data_h = dict(sound=[], coverage=[])
-dyn_range = 65  # highest variance
+coverages = list()
 for trial_n in range(len(clearspeech_h)):
     signals = signals_sample_clear_h[trial_n]
     country_idx = country_idxs_clear_h[trial_n]
     trial_composition = [sounds_clear[x][y].resize(0.6) for x, y in zip(signals, country_idx)]
     sound = sum(trial_composition)
-    freqs, times, power = sound.spectrogram(show=False)
-    power = 10 * np.log10(power / (p_ref ** 2))  # logarithmic power for plotting
-    power = power[freqs < upper_freq, :]
-    dB_max = power.max()
-    dB_min = dB_max - dyn_range
-    interval = power[np.where((power > dB_min) & (power < dB_max))]
-    percentage_filled = interval.shape[0] / power.flatten().shape[0]
+    power = log_power_spectrogram(sound, upper_freq)
+    coverages.append(coverage_curve(power, dyn_ranges))
     clearspeech_data_h["sound"].append(sound)
-    clearspeech_data_h["coverage"].append(percentage_filled)
+coverages = np.array(coverages)  # trials x dynamic ranges
+variances = coverages.var(axis=0)
+
+plt.plot(dyn_ranges, variances)  # plot results
+plt.title("Dynamic Range Variance Distribution")
+plt.xlabel("Dynamic Range [dB]")
+plt.ylabel("Variance of Spectro-temporal Coverage")
+
+dyn_range = 65  # highest variance
+clearspeech_data_h["coverage"] = coverages[:, dyn_ranges == dyn_range][:, 0].tolist()
 
 sns.lineplot(x=clearspeech_h.solution, y=clearspeech_data_h["coverage"])
 plt.title("Spectral Coverage Clearspeech Horizontal")
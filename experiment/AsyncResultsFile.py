@@ -0,0 +1,159 @@
+import os
+import pathlib
+import json
+import copy
+import queue
+import atexit
+import datetime
+import threading
+import logging
+import numpy as np
+import slab
+
+log = logging.getLogger(__name__)
+
+
+class AsyncResultsFile(slab.ResultsFile):
+    """
+    Drop-in replacement for slab.ResultsFile which takes the file access off the experiment thread. write() only
+    records a snapshot of the data, commit() hands all records of the trial as one batch to a background thread, which
+    serializes them, appends them to the file in one go and syncs the file to disk according to the durability policy.
+    The file is a JSON Lines file with one {tag: data} line per write, exactly like slab.ResultsFile writes it, so it
+    can be read with slab.ResultsFile.read_file and analysis.utils.misc.load_dataframe.
+    """
+
+    def __init__(self, subject="test", folder=None, filename=None, fsync_every=1, path=None):
+        """
+        Args:
+            subject: determines the name of the sub-folder and files.
+            folder: folder in which all results are saved, defaults to slab.psychoacoustics.results_folder.
+            filename: appended to the subject name in the file name.
+            fsync_every: sync the file to disk after every n-th commit. 1 makes every trial durable, 0 only flushes to
+                the operating system and syncs when the file is closed.
+            path: append to this existing file instead of creating a new one, e.g. when resuming a session.
+        """
+        super().__init__(subject=subject, folder=folder, filename=filename)
+        if path is not None:
+            self.path = pathlib.Path(path)
+        self.fsync_every = fsync_every
+        self._records = list()  # records of the current trial
+        self._queue = queue.Queue()
+        self._error = None
+        self._n_commits = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker, name=f"results writer {self.name}", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, data, tag=None):
+        """
+        Records data for the current trial. Like slab.ResultsFile.write, but the data is written to the file with the
+        next commit().
+
+        Args:
+            data: data to save, must be JSON serializable [string, list, dict, numpy array, ...]. If data is an
+                object, the __dict__ is extracted and saved.
+            tag: The tag is prepended as a key. If None is provided, the current time is used.
+        """
+        self._raise_error()
+        if tag is None or tag == "time":
+            tag = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")  # time of the call, not of the write
+        self._records.append((tag, self._snapshot(data)))
+
+    def commit(self):
+        """
+        Hands the records of the current trial to the writer thread. Call this at the end of each trial.
+        """
+        self._raise_error()
+        if self._records:
+            self._queue.put(self._records)
+            self._records = list()
+
+    def enqueue(self, function):
+        """
+        Calls function in the writer thread once all records committed so far are written.
+        """
+        self._raise_error()
+        self._queue.put(function)
+
+    def flush(self):
+        """
+        Commits pending records and blocks until everything is written.
+        """
+        self.commit()
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """
+        Writes all pending records, syncs the file to disk and stops the writer thread.
+        """
+        if self._closed:
+            return
+        self.commit()
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        atexit.unregister(self.close)
+        self._raise_error()
+
+    def read(self, tag=None):
+        self.flush()
+        return super().read(tag)
+
+    def clear(self):
+        self.flush()
+        super().clear()
+
+    @staticmethod
+    def _snapshot(data):
+        # the experiment keeps changing its attributes after the write, so take a copy of mutable data
+        if isinstance(data, (str, int, float, bool, type(None), np.generic)):
+            return data
+        if isinstance(data, np.ndarray):
+            return data.copy()
+        if hasattr(data, "__dict__"):
+            data = data.__dict__
+        return copy.deepcopy(data)
+
+    @staticmethod
+    def _serialize(tag, data):
+        try:
+            data = json.loads(data)  # if payload is already json, parse it into python object
+        except (json.JSONDecodeError, TypeError):
+            pass  # if payload is not json - all good, will be encoded later
+        return json.dumps({tag: data}, default=AsyncResultsFile._to_builtin) + "\n"
+
+    @staticmethod
+    def _to_builtin(obj):
+        if isinstance(obj, (np.ndarray, np.generic)):
+            return obj.tolist()
+        raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+    def _worker(self):
+        with open(self.path, "a") as file:
+            while True:
+                records = self._queue.get()
+                try:
+                    if records is None:
+                        file.flush()
+                        os.fsync(file.fileno())
+                        return
+                    if callable(records):
+                        records()
+                        continue
+                    file.write("".join(self._serialize(tag, data) for tag, data in records))
+                    file.flush()
+                    self._n_commits += 1
+                    if self.fsync_every and self._n_commits % self.fsync_every == 0:
+                        os.fsync(file.fileno())
+                except Exception as e:
+                    log.error(f"Could not write results to {self.path}: {e}")
+                    self._error = e
+                finally:
+                    self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
@@ -17,6 +17,12 @@ try:
 except ModuleNotFoundError:
     PySpin = False
 import cv2
+import time
+import slab
+from experiment.ReplayCapture import ReplayCapture
+from headpose_estimation.cam_tracking.calibrate_intrinsics import load_intrinsics, get_intrinsics, \
+    scale_camera_matrix, camera_serial
+from headpose_estimation.cam_tracking import pose_fusion
 import PIL
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
@@ -40,6 +46,22 @@ class ArUcoCamSetting(DeviceSetting):
     device_name = Str("FireFly", group="status", dsec="Name of the device")
     device_type = Str("Camera", group='status', dsec='Type of the device')
     sampling_freq = CFloat(1.0, group='primary', dsec='Sampling frequency of the device (Hz)', reinit=False)
+    backend = Str("flir", group="primary", dsec="Frame source, flir for the cameras or replay for recorded frames")
+    replay_sources = List(group="primary", dsec="Video files or image folders replayed by each camera")
+    replay_rate = Any("original", group="primary", dsec="Replay rate: original, max or a speed factor", reinit=False)
+    resolution = CFloat(1.0, group="primary", dsec="Scale factor applied to the images before detection", reinit=False)
+    detector_config = Str(os.path.join(get_config(setting="BASE_DIRECTORY"), "config", "aruco_config.txt"),
+                          group="status", dsec="Detector parameter file written by tune_detector.py")
+    intrinsics_file = Str(os.path.join(get_config(setting="CAL_ROOT"), "camera_intrinsics.pkl"), group="status",
+                          dsec="Camera intrinsics written by calibrate_intrinsics.py")
+    fusion = Bool(False, group="primary", dsec="Fuse the markers of all cameras into one head orientation",
+                  reinit=False)
+    # the defaults are placeholders, measure the camera rotations with ArUcoCam.calibrate_extrinsics before using fusion
+    camera_rotations = List([[180, 0, 0], [180, 0, 0]], group="primary", reinit=False,
+                            dsec="Rotation vectors (degrees) of the cameras in the dome frame (x right, y up, z ahead) "
+                                 "as measured by calibrate_extrinsics")
+    board_rotations = List([[0, 0, 0], [0, 0, 0]], group="primary", reinit=False,
+                           dsec="Rotation vectors (degrees) of the marker board seen by each camera on the head")
 
 
 class ArUcoCam(Device):
@@ -53,17 +75,25 @@ class ArUcoCam(Device):
                    cv2.aruco.Dictionary_get(cv2.aruco.DICT_5X5_100)]
     params = cv2.aruco.DetectorParameters_create()
     cams = List()
+    intrinsics = List()  # (serial, calibrated camera matrix or None, distortion coefficients or None) per camera
     offset = Any()
     calibrated = Bool()
     _output_specs = {'type': setting.type, 'sampling_freq': setting.sampling_freq,
                      'dtype': setting.dtype, "shape": setting.shape}
     pose = Any()
+    pose_confidence = Float()
+    marker_rvecs = List()  # marker rotation vectors per camera of the last get_pose, None for cameras without markers
 
     def _initialize(self, **kwargs):
         """
         Initializes the device and sets the state to "created". Necessary before running the device.
         """
-        self.cams = [EasyPySpin.VideoCapture(0), EasyPySpin.VideoCapture(1)]
+        self.load_detector_config()
+        if self.setting.backend == "replay":
+            self.cams = [ReplayCapture(source, rate=self.setting.replay_rate) for source in self.setting.replay_sources]
+        else:
+            self.cams = [EasyPySpin.VideoCapture(0), EasyPySpin.VideoCapture(1)]
+        self.load_intrinsics()
 
     def _configure(self, **kwargs):
         """
@@ -110,6 +140,64 @@ class ArUcoCam(Device):
                 if key == ord("q"):
                     break
 
+    def load_detector_config(self, file=None):
+        """
+        Loads the aruco detector parameters and the resolution from a config file as written by
+        headpose_estimation/cam_tracking/tune_detector.py. Keeps the defaults if the file does not exist.
+        Args:
+            file: path to the config file, defaults to setting.detector_config.
+        """
+        file = file or self.setting.detector_config
+        self.params = cv2.aruco.DetectorParameters_create()
+        if not os.path.isfile(file):
+            log.info(f"No detector config found at {file}, using default detector parameters")
+            return
+        for name, value in slab.load_config(file)._asdict().items():
+            if name == "resolution":
+                self.setting.resolution = value
+            else:
+                setattr(self.params, name, value)
+        log.info(f"Loaded detector config from {file}")
+
+    def load_intrinsics(self, file=None):
+        """
+        Loads the camera matrix and distortion coefficients of each camera from the calibration file written by
+        headpose_estimation/cam_tracking/calibrate_intrinsics.py. Uncalibrated cameras fall back to focal length =
+        image width and no lens distortion.
+        Args:
+            file: path to the calibration file, defaults to setting.intrinsics_file.
+        """
+        intrinsics = load_intrinsics(file or self.setting.intrinsics_file)
+        image_size = (self.setting.shape[1], self.setting.shape[0])
+        self.intrinsics = list()
+        for i, c in enumerate(self.cams):
+            serial = camera_serial(c, i)
+            camera_matrix, dist_coeffs = get_intrinsics(intrinsics, serial, image_size)
+            if camera_matrix is None:
+                log.warning(f"No intrinsic calibration found for camera {serial}, head pose might be unreliable")
+            self.intrinsics.append((serial, camera_matrix, dist_coeffs))
+
+    def record(self, folder, n_frames=100):
+        """
+        Records frames of all cameras as image sequences which can be replayed with the replay backend. Each camera
+        gets a sub folder cam0, cam1, ... containing the frames and a timestamps.txt.
+        Args:
+            folder: folder in which the recordings are saved.
+            n_frames: number of frames recorded per camera.
+        """
+        for i, c in enumerate(self.cams):
+            cam_folder = os.path.join(folder, f"cam{i}")
+            os.makedirs(cam_folder, exist_ok=True)
+            timestamps = list()
+            for n in range(n_frames):
+                ret, frame = c.read()
+                if frame is None:
+                    continue
+                timestamps.append(time.time())
+                cv2.imwrite(os.path.join(cam_folder, f"frame_{n:06d}.png"), frame)
+            np.savetxt(os.path.join(cam_folder, "timestamps.txt"), timestamps)
+        log.info(f"Recorded {n_frames} frames per camera into {folder}")
+
     def retrieve(self):
         if self.calibrated:
             pose = self.get_pose()  # Get image as numpy array
@@ -126,22 +214,32 @@ class ArUcoCam(Device):
         else:
             self.pose = self.get_pose()
 
-    def get_pose(self, plot=False, resolution=1.0):
+    def get_pose(self, plot=False, resolution=None):
+        resolution = resolution or self.setting.resolution
         pose = [None, None]
+        marker_rvecs = [None] * len(self.cams)
         for i, c in enumerate(self.cams):
             while True:  # avoid breaking when image is NoneType
                 ret, image = c.read()
+                if image is None and not c.isOpened():
+                    log.warning(f"Camera {i} is not delivering frames")
+                    break
                 if image is not None:
                     if image.ndim == 3:
                         image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
                     if resolution < 1.0:
                         image = self.change_res(image, resolution)
-                    _pose, info = self.pose_from_image(image=image, dictionary=self.aruco_dicts[i])
+                    camera_matrix, dist_coeffs = self.intrinsics[i][1:] if i < len(self.intrinsics) else (None, None)
+                    if camera_matrix is not None and resolution != 1.0:
+                        camera_matrix = scale_camera_matrix(camera_matrix, image.shape[1] / self.setting.shape[1])
+                    _pose, info = self.pose_from_image(image=image, dictionary=self.aruco_dicts[i],
+                                                       camera_matrix=camera_matrix, dist_coeffs=dist_coeffs)
                     if plot:
                         if _pose is None:
                             image = self.draw_markers(image, _pose, self.aruco_dicts[i], info)
                         plt.imshow(image)
                     if _pose:
+                        marker_rvecs[i] = [marker[2] for marker in info]
                         _pose = np.asarray(_pose)[:, 2].astype('float16')
                         # remove outliers
                         d = np.abs(_pose - np.median(_pose))  # deviation from median
@@ -153,22 +251,72 @@ class ArUcoCam(Device):
                     break
                 else:
                     continue
+        self.marker_rvecs = marker_rvecs
+        if self.setting.fusion:
+            return self.fuse_pose(marker_rvecs)
+        self.pose_confidence = sum(p is not None for p in pose) / len(pose)
         return pose
 
-    def pose_from_image(self, image, dictionary):  # get pose
+    def fuse_pose(self, marker_rvecs):
+        """
+        Combines the markers of all cameras into one head orientation using the camera and board rotations of the
+        setting. Sets pose_confidence, which is 0 if no camera detected the markers and decreases if a camera drops out
+        or the markers disagree.
+        Args:
+            marker_rvecs: list of marker rotation vectors per camera, None for cameras without detections.
+
+        Returns:
+            [azimuth, elevation] of the head in degrees, [None, None] if no markers were detected.
+        """
+        camera_rotations = [pose_fusion.rotation_from_degrees(r) for r in self.setting.camera_rotations]
+        board_rotations = [pose_fusion.rotation_from_degrees(r) for r in self.setting.board_rotations]
+        rotation, self.pose_confidence = pose_fusion.fuse(marker_rvecs, camera_rotations, board_rotations)
+        if rotation is None:
+            return [None, None]
+        return list(pose_fusion.azimuth_elevation(rotation))
+
+    def calibrate_extrinsics(self, n_frames=30):
+        """
+        Measures the camera rotations for fusion while the subject faces the central speaker (azimuth and elevation 0)
+        and writes them into setting.camera_rotations. The board rotations of the setting must match how the marker
+        board is mounted. Cameras that detect no markers keep their rotation.
+        Args:
+            n_frames: number of frames per camera the marker rotations are averaged over.
+
+        Returns:
+            the camera rotations (rotation vectors in degrees).
+        """
+        collected = [list() for _ in self.cams]
+        for _ in range(n_frames):
+            self.get_pose()
+            for i, rvecs in enumerate(self.marker_rvecs):
+                collected[i].extend(rvecs or [])
+        board_rotations = [pose_fusion.rotation_from_degrees(r) for r in self.setting.board_rotations]
+        measured = pose_fusion.camera_rotations_from_reference(collected, board_rotations)
+        camera_rotations = list(self.setting.camera_rotations)
+        for i, rotation in enumerate(measured):
+            if rotation is None:
+                log.warning(f"Camera {i} detected no markers, its rotation is not calibrated")
+            else:
+                camera_rotations[i] = rotation
+        self.setting.camera_rotations = camera_rotations
+        log.info(f"Camera rotations: {camera_rotations}")
+        return camera_rotations
+
+    def pose_from_image(self, image, dictionary, camera_matrix=None, dist_coeffs=None):  # get pose
         (corners, ids, rejected) = cv2.aruco.detectMarkers(image, dictionary=dictionary, parameters=self.params)
         if len(corners) == 0:
             return None, [0, 0, 0, 0]
         else:
-            size = image.shape
-            focal_length = size[1]
-            center = (size[1] / 2, size[0] / 2)
-            camera_matrix = np.array([[focal_length, 0, center[0]],
-                                         [0, focal_length, center[1]],
-                                         [0, 0, 1]], dtype="double")
-            dist_coeffs = np.zeros((4, 1))  # Assuming no lens distortion
-            # camera_matrix = numpy.loadtxt('mtx.txt')
-            # dist_coeffs = numpy.loadtxt('dist.txt')
+            if camera_matrix is None:  # uncalibrated camera
+                size = image.shape
+                focal_length = size[1]
+                center = (size[1] / 2, size[0] / 2)
+                camera_matrix = np.array([[focal_length, 0, center[0]],
+                                          [0, focal_length, center[1]],
+                                          [0, 0, 1]], dtype="double")
+            if dist_coeffs is None:
+                dist_coeffs = np.zeros((4, 1))  # Assuming no lens distortion
             rotation_vec, translation_vec, _objPoints = \
                 cv2.aruco.estimatePoseSingleMarkers(corners, .05, camera_matrix, dist_coeffs)
             pose = []  # numpy.zeros([len(translation_vec), 2])
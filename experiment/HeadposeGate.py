@@ -0,0 +1,103 @@
+import time
+import logging
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class HeadposeGate:
+    """
+    Orientation gate which holds back the next trial until the subject looks straight ahead. The gate polls a pose
+    source (any device with a retrieve() method and a pose attribute, e.g. ArUcoCam) at a fixed rate instead of
+    spinning, and opens once the RMS deviation of the pose stayed below the threshold for the dwell time. A sample has to
+    exceed threshold + hysteresis to restart the dwell, so jitter around the threshold does not keep the gate closed.
+    The warning cue is rate limited and the total waiting time can be bounded by a timeout.
+    """
+
+    def __init__(self, threshold=15.0, hysteresis=2.5, dwell=0.2, poll_interval=0.05, cue_interval=1.5,
+                 timeout=None):
+        """
+        Args:
+            threshold: maximal RMS deviation (degrees) of the head pose from straight ahead.
+            hysteresis: additional deviation (degrees) that is tolerated while dwelling before the dwell restarts.
+            dwell: time in seconds the pose has to stay inside the threshold before the gate opens.
+            poll_interval: minimal time in seconds between two pose samples.
+            cue_interval: minimal time in seconds between two warning cues.
+            timeout: maximal time in seconds the gate stays closed. None waits indefinitely.
+        """
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.dwell = dwell
+        self.poll_interval = poll_interval
+        self.cue_interval = cue_interval
+        self.timeout = timeout
+        self.is_open = False
+        self.deviation = None
+        self.gate_times = list()  # time in seconds each trial was gated
+
+    @property
+    def last_gate_time(self):
+        return self.gate_times[-1] if self.gate_times else None
+
+    @staticmethod
+    def rms_deviation(pose):
+        """
+        Root mean square deviation of a pose from straight ahead. Returns None if the pose is incomplete, i.e. the
+        markers could not be detected.
+        """
+        if pose is None:
+            return None
+        try:
+            pose = np.asarray(pose, dtype=float)
+        except (TypeError, ValueError):
+            return None
+        if not pose.size or np.isnan(pose).any():
+            return None
+        return float(np.sqrt(np.mean(pose ** 2)))
+
+    def wait(self, source, cue=None):
+        """
+        Block until the subject looks straight ahead, the gate times out or no further samples are needed.
+
+        Args:
+            source: pose source providing retrieve() and pose, usually ArUcoCam.
+            cue: callable playing the warning cue. Called at most once per cue_interval while the pose is off center.
+
+        Returns:
+            time in seconds the trial was gated.
+        """
+        self.is_open = False
+        t_start = time.time()
+        t_last_cue = -np.inf
+        t_inside = None  # time since which the pose is continuously inside the threshold
+        while True:
+            t_sample = time.time()
+            source.retrieve()
+            self.deviation = self.rms_deviation(source.pose)
+            if self.deviation is None:
+                log.info("Cannot detect markers, make sure cameras are set up correctly and arucomarkers can be "
+                         "detected.")
+                t_inside = None
+            elif self.deviation <= self.threshold:
+                if t_inside is None:
+                    t_inside = t_sample
+                if t_sample - t_inside >= self.dwell:
+                    self.is_open = True
+                    break
+            elif t_inside is not None and self.deviation <= self.threshold + self.hysteresis:
+                pass  # within hysteresis band, keep dwelling
+            else:
+                t_inside = None
+                log.info("Subject is not looking straight ahead")
+                if cue is not None and t_sample - t_last_cue >= self.cue_interval:
+                    cue()
+                    t_last_cue = time.time()
+            if self.timeout is not None and time.time() - t_start >= self.timeout:
+                log.warning(f"Head pose gate timed out after {self.timeout} s, starting trial anyway")
+                break
+            remaining = self.poll_interval - (time.time() - t_sample)
+            if remaining > 0:
+                time.sleep(remaining)  # rate limit pose acquisition
+        gate_time = time.time() - t_start
+        self.gate_times.append(gate_time)
+        return gate_time
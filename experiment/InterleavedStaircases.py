@@ -0,0 +1,94 @@
+import random
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class InterleavedStaircases:
+    """
+    Runs one adaptive track (slab.Staircase or PsiStaircase) per condition, interleaved from trial to trial instead of
+    one block after the other. Each track advances independently with its own responses and is retired as soon as it
+    is finished, the remaining tracks continue until all are done.
+
+    The order is scheduled in rounds, each round presents every active track once: in random order ("random", the
+    same track is not presented twice in a row across rounds if avoidable) or always in the order of the conditions
+    ("round_robin"). The next track is known before the current trial ends (see peek), so the stimuli of the next
+    trial can be prepared early.
+
+    Example::
+
+        tracks = InterleavedStaircases(conditions=[1, 2, 3], make_track=lambda: slab.Staircase(start_val=0))
+        for condition, stairs in tracks:
+            level = stairs.__next__()
+            stairs.add_response(stairs.simulate_response(-10))
+        print(tracks.thresholds())
+    """
+
+    def __init__(self, conditions, make_track, order="random"):
+        """
+        Args:
+            conditions: one track is created for each condition, e.g. the masker positions.
+            make_track: function without arguments returning a new track.
+            order: "random" or "round_robin".
+        """
+        if order not in ("random", "round_robin"):
+            raise ValueError(f"order must be random or round_robin, not {order}")
+        self.conditions = list(conditions)
+        self.tracks = {condition: make_track() for condition in self.conditions}
+        self.order = order
+        self.this_condition = None
+        self.this_trial_n = 0
+        self.history = list()  # condition of every trial
+        self._round = list()
+
+    @property
+    def active(self):
+        return [condition for condition in self.conditions if not self.tracks[condition].finished]
+
+    @property
+    def finished(self):
+        return not self.active
+
+    def peek(self):
+        """
+        Condition of the next trial, None if all tracks are finished.
+        """
+        active = self.active
+        self._round = [condition for condition in self._round if condition in active]
+        if not self._round:
+            self._round = list(active)
+            if self.order == "random" and len(active) > 1:
+                random.shuffle(self._round)
+                if self._round[0] == self.this_condition:
+                    self._round.append(self._round.pop(0))  # no repetition across rounds
+        return self._round[0] if self._round else None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """
+        Advances to the next track.
+
+        Returns:
+            condition and track of the next trial. Draw the intensity with next(track) and pass the response to
+            track.add_response, like for a single staircase.
+        """
+        condition = self.peek()
+        if condition is None:
+            raise StopIteration
+        self._round.pop(0)
+        self.this_condition = condition
+        self.this_trial_n += 1
+        self.history.append(condition)
+        return condition, self.tracks[condition]
+
+    def thresholds(self):
+        """
+        Threshold of each finished track, None for tracks that are still running.
+        """
+        return {condition: track.threshold() if track.finished else None for condition, track in self.tracks.items()}
+
+    def __str__(self):
+        return f'Interleaved staircases ({self.order}), trial {self.this_trial_n}, {len(self.active)} of ' \
+               f'{len(self.conditions)} tracks active'
@@ -6,6 +6,9 @@ from labplatform.config import get_config
 from experiment.RP2 import RP2Device
 from experiment.RX8 import RX8Device
 from experiment.Camera import ArUcoCam
+from experiment.HeadposeGate import HeadposeGate
+from experiment.AsyncResultsFile import AsyncResultsFile
+from experiment.TrialPlan import plan_localization_accuracy, plan_path, new_seed
 from Speakers.speaker_config import SpeakerArray
 import os
 from traits.api import List, Str, Int, Dict, Float, Any
@@ -57,6 +60,11 @@ class LocalizationAccuracyExperiment(ExperimentLogic):
     accuracy = Any()
     rt = Any()
     solution = Any()
+    headpose_gate = Any()
+    gate_time = Float()
+    checkpoint = Any()  # SessionCheckpoint, written after each trial
+    checkpoint_attributes = ["sequence", "error", "plan"]
+    plan = Any()  # TrialPlan if planned is set in the config, otherwise the trials are drawn at run time
 
 
     def _devices_default(self):
@@ -67,6 +75,9 @@ class LocalizationAccuracyExperiment(ExperimentLogic):
                 "RX8": rx8,
                 "ArUcoCam": cam}
 
+    def _headpose_gate_default(self):
+        return HeadposeGate(threshold=15)
+
     def _initialize(self, **kwargs):
         self.devices["RX8"].handle.write("playbuflen",
                                          self.setting.stim_duration * self.devices["RX8"].setting.sampling_freq,
@@ -80,10 +91,12 @@ class LocalizationAccuracyExperiment(ExperimentLogic):
 
     def _stop(self, **kwargs):
         log.info(f"Final mean error - azimuth: {np.mean(np.array(self.error)[:, 0])}, elevation: {np.mean(np.array(self.error)[:, 1])}")
+        self.results.flush()
 
     def setup_experiment(self, info=None):
-        self.results.write(self.sequence, "sequence")
-        self.results.write(np.ndarray.tolist(np.array(self.devices["ArUcoCam"].pose)), "offset")
+        resumed = self.checkpoint is not None and self.checkpoint.resuming
+        if not resumed:
+            self.results.write(np.ndarray.tolist(np.array(self.devices["ArUcoCam"].pose)), "offset")
         self.devices["RX8"].handle.write(tag='bitmask',
                                          value=1,
                                          procs="RX81")  # illuminate central speaker LED
@@ -94,6 +107,18 @@ class LocalizationAccuracyExperiment(ExperimentLogic):
             self.load_pinknoise()
         else:
             log.error("Unable to load stimuli! Abort experiment ... ")
+        if resumed:
+            self.checkpoint.restore(self)  # sequence position, errors so far, plan, random state and camera offset
+        elif getattr(config, "planned", False):
+            seed = getattr(config, "plan_seed", None)
+            seed = new_seed() if seed is None else seed
+            self.plan = plan_localization_accuracy(seed, conditions=self.setting.conditions,
+                                                   trial_number=self.setting.trial_number, n_signals=len(self.signals))
+            self.sequence = self.plan.sequence
+            self.plan.save(plan_path(self.results.path))
+            self.results.write(seed, "plan_seed")
+        if not resumed:
+            self.results.write(self.sequence, "sequence")
         self.devices["RX8"].handle.write("data0", self.paradigm_start.data.flatten(), procs="RX81")
         self.devices["RX8"].handle.write("chan0", 1, procs="RX81")
         self.devices["RX8"].handle.trigger("zBusA", proc=self.devices["RX8"].handle)
@@ -102,8 +127,9 @@ class LocalizationAccuracyExperiment(ExperimentLogic):
         # self.devices["RX8"].handle.write("playbuflen",
                                          # self.devices["RX8"].setting.sampling_freq*self.setting.stim_duration,
                                          # procs=self.devices["RX8"].handle.procs)
-        self.results.write(self.plane, "plane")
-        self.results.write(self.mode, "mode")
+        if not resumed:
+            self.results.write(self.plane, "plane")
+            self.results.write(self.mode, "mode")
         time.sleep(1)
 
     def _prepare_trial(self):
@@ -115,7 +141,10 @@ class LocalizationAccuracyExperiment(ExperimentLogic):
         self.sequence.print_trial_info()
         self.solution = self.sequence.this_trial - 1
         self.pick_speaker_this_trial(speaker_id=self.solution)
-        signal = random.choice(self.signals)
+        if self.plan is not None:
+            signal = self.signals[self.plan.trial(self.sequence.this_n)["signal"]]
+        else:
+            signal = random.choice(self.signals)
         sound = self.target.apply_equalization(signal, level_only=False)
         self.devices["RX8"].handle.write(tag=f"data0",
                                          value=sound.data[:, 0].flatten(),
@@ -171,6 +200,10 @@ class LocalizationAccuracyExperiment(ExperimentLogic):
         self.results.write(self.accuracy, "accuracy")
         self.results.write(self.rt, "rt")
         self.results.write(self.target.id, "target_spk_id")
+        self.results.write(self.gate_time, "gate_time")
+        self.results.commit()  # hand the records of this trial to the writer thread
+        if self.checkpoint is not None:
+            self.checkpoint.save(self)
 
     def load_babble(self, sound_type="babble-numbers-reversed-n13-shifted_resamp_48828"):
         sound_root = get_config(setting="SOUND_ROOT")
@@ -234,25 +267,15 @@ class LocalizationAccuracyExperiment(ExperimentLogic):
         log.info('Calibration complete!')
 
     def check_headpose(self):
-        while True:
-            #self.devices["ArUcoCam"].configure()
-            self.devices["ArUcoCam"].retrieve()
-            # self.devices["ArUcoCam"].pause()
-            try:
-                if np.sqrt(np.mean(np.array(self.devices["ArUcoCam"].pose) ** 2)) > 15:
-                    log.info("Subject is not looking straight ahead")
-                    self.devices["RX8"].clear_channels(n_channels=1, proc=["RX81", "RX82"])
-                    self.devices["RX8"].handle.write("data0", self.off_center.data.flatten(), procs="RX81")
-                    self.devices["RX8"].handle.write("chan0", 1, procs="RX81")
-                    #self.devices["RX8"].start()
-                    #self.devices["RX8"].pause()
-                    self.devices["RX8"].handle.trigger("zBusA", proc=self.devices["RX8"].handle)
-                    self.devices["RX8"].wait_to_finish_playing()
-                else:
-                    break
-            except TypeError:
-                log.info("Cannot detect markers, make sure cameras are set up correctly and arucomarkers can be detected.")
-                continue
+        self.gate_time = self.headpose_gate.wait(self.devices["ArUcoCam"], cue=self.play_off_center_cue)
+        log.info(f"Head pose gate open after {round(self.gate_time, 3)} s")
+
+    def play_off_center_cue(self):
+        self.devices["RX8"].clear_channels(n_channels=1, proc=["RX81", "RX82"])
+        self.devices["RX8"].handle.write("data0", self.off_center.data.flatten(), procs="RX81")
+        self.devices["RX8"].handle.write("chan0", 1, procs="RX81")
+        self.devices["RX8"].handle.trigger("zBusA", proc=self.devices["RX8"].handle)
+        self.devices["RX8"].wait_to_finish_playing()
 
 
 if __name__ == "__main__":
@@ -290,6 +313,6 @@ if __name__ == "__main__":
     la = LocalizationAccuracyExperiment(subject=subject, experimenter=experimenter)
     la.load_pinknoise()
     la.calibrate_camera()
-    la.results = slab.ResultsFile(subject=subject.name)
+    la.results = AsyncResultsFile(subject=subject.name)
     la.start()
     # nj.configure_traits()
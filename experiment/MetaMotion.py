@@ -0,0 +1,243 @@
+from labplatform.core.Setting import DeviceSetting
+from labplatform.core.Device import Device
+from traits.api import Str, Any, Tuple, Int, Float, CFloat, Bool, Instance
+import threading
+import logging
+import time
+import numpy as np
+try:
+    from mbientlab.metawear import MetaWear, libmetawear, parse_value
+    from mbientlab.metawear.cbindings import FnVoid_VoidP_DataP, SensorFusionMode, SensorFusionAccRange, \
+        SensorFusionGyroRange, SensorFusionData
+except ModuleNotFoundError:
+    logging.info("WARNING: mbientlab package not found, maybe try installing: pip install metawear")
+
+log = logging.getLogger(__name__)
+
+
+class PoseBuffer:
+    """
+    Fixed size ring buffer of timestamped head pose samples (timestamp, azimuth, elevation). Written by the sensor
+    callback and read by the experiment thread, so all access is guarded by a lock. Nothing is allocated per sample.
+    """
+
+    def __init__(self, size=512):
+        self.data = np.full((size, 3), np.nan)
+        self.size = size
+        self.head = 0  # index the next sample is written to
+        self.count = 0  # total number of samples written
+        self.lock = threading.Lock()
+
+    def append(self, timestamp, azimuth, elevation):
+        with self.lock:
+            self.data[self.head] = timestamp, azimuth, elevation
+            self.head = (self.head + 1) % self.size
+            self.count += 1
+
+    def latest(self, n=None):
+        """
+        Returns:
+            copy of the last n samples (all buffered samples if n is None) in chronological order.
+        """
+        with self.lock:
+            n = min(self.count, self.size) if n is None else min(n, self.count, self.size)
+            idx = (self.head - n + np.arange(n)) % self.size
+            return self.data[idx].copy()
+
+    def window(self, duration, now=None):
+        """
+        Samples of the last duration seconds.
+        """
+        now = time.perf_counter() if now is None else now
+        samples = self.latest()
+        return samples[samples[:, 0] >= now - duration]
+
+    def clear(self):
+        with self.lock:
+            self.data[:] = np.nan
+            self.head = 0
+            self.count = 0
+
+
+class MetaMotionSetting(DeviceSetting):
+    """
+    Class for defining the IMU settings. primary group parameters are supposed to be changed and sometimes
+    reinitialized, whereas status group parameters are not.
+    """
+    address = Str("E1:CD:49:19:08:19", group="status", dsec="Bluetooth address of the MetaMotion sensor")
+    device_name = Str("MetaMotion", group="status", dsec="Name of the device")
+    type = Str("head_pose", group="status", dsec="nature of the signal")
+    shape = Tuple(2, group="status", dsec="azimuth and elevation")
+    sampling_freq = Float(100, group="status", dsec="Output rate of the sensor fusion (Hz)")
+    buffer_size = Int(512, group="primary", dsec="Number of samples kept in the ring buffer")
+    window = CFloat(0.1, group="primary", dsec="Duration (s) of the window the pose is averaged over", reinit=False)
+    outlier_threshold = CFloat(2.0, group="primary", dsec="Samples deviating more than this many median absolute "
+                                                          "deviations from the median are discarded", reinit=False)
+    connection_attempts = Int(20, group="primary", dsec="Number of attempts to connect to the sensor")
+
+
+class MetaMotion(Device):
+    """
+    MetaWear MetaMotion IMU as head pose source, an alternative to ArUcoCam with the same retrieve() / pose interface.
+    The sensor fusion output is pushed by the BLE callback into a ring buffer with a timestamp per sample, so reading
+    the pose does not poll the sensor and only evaluates the last window of unique samples.
+    """
+    setting = MetaMotionSetting()
+    sensor = Any()
+    buffer = Instance(PoseBuffer)
+    callback = Any()
+    pose = Any()
+    offset = Any()
+    calibrated = Bool()
+    _output_specs = {'type': setting.type, 'sampling_freq': setting.sampling_freq, "shape": setting.shape}
+
+    def _initialize(self, **kwargs):
+        """
+        Connects to the sensor, configures the sensor fusion and subscribes to the euler angles.
+        """
+        self.buffer = PoseBuffer(self.setting.buffer_size)
+        self.sensor = MetaWear(self.setting.address)
+        for attempt in range(self.setting.connection_attempts):
+            try:
+                self.sensor.connect()
+                break
+            except Exception as e:
+                log.info(f"Connecting to sensor {self.setting.address} failed ({e}), retrying ...")
+                time.sleep(0.5)
+        else:
+            raise ConnectionError(f"Could not connect to sensor {self.setting.address}")
+        board = self.sensor.board
+        libmetawear.mbl_mw_settings_set_connection_parameters(board, 7.5, 7.5, 0, 6000)
+        time.sleep(1.5)
+        libmetawear.mbl_mw_sensor_fusion_set_mode(board, SensorFusionMode.IMU_PLUS)
+        libmetawear.mbl_mw_sensor_fusion_set_acc_range(board, SensorFusionAccRange._8G)
+        libmetawear.mbl_mw_sensor_fusion_set_gyro_range(board, SensorFusionGyroRange._2000DPS)
+        libmetawear.mbl_mw_sensor_fusion_write_config(board)
+        self.callback = FnVoid_VoidP_DataP(self.data_handler)  # keep a reference, otherwise it is garbage collected
+        signal = libmetawear.mbl_mw_sensor_fusion_get_data_signal(board, SensorFusionData.EULER_ANGLE)
+        libmetawear.mbl_mw_datasignal_subscribe(signal, None, self.callback)
+        libmetawear.mbl_mw_sensor_fusion_enable_data(board, SensorFusionData.EULER_ANGLE)
+        libmetawear.mbl_mw_sensor_fusion_start(board)
+        log.info("MetaMotion sensor started")
+
+    def _configure(self, **kwargs):
+        pass
+
+    def _start(self, **kwargs):
+        pass
+
+    def _pause(self, **kwargs):
+        pass
+
+    def _stop(self):
+        """
+        Stops the sensor fusion, unsubscribes and disconnects.
+        """
+        board = self.sensor.board
+        libmetawear.mbl_mw_sensor_fusion_stop(board)
+        signal = libmetawear.mbl_mw_sensor_fusion_get_data_signal(board, SensorFusionData.EULER_ANGLE)
+        libmetawear.mbl_mw_datasignal_unsubscribe(signal)
+        libmetawear.mbl_mw_debug_disconnect(board)
+        log.info("MetaMotion sensor disconnected")
+
+    def data_handler(self, ctx, data):
+        """
+        Sensor callback, writes valid samples into the ring buffer.
+        """
+        euler = parse_value(data)
+        self.add_sample(euler.yaw, euler.roll)
+
+    def add_sample(self, azimuth, elevation, timestamp=None):
+        pose = np.array((azimuth, elevation))
+        if np.isnan(pose).any() or not np.all((-180 <= pose) & (pose <= 360)) or np.any(np.abs(pose) <= 1e-3):
+            return  # filter invalid values
+        if pose[0] > 180:
+            pose[0] -= 360
+        timestamp = time.perf_counter() if timestamp is None else timestamp
+        self.buffer.append(timestamp, pose[0], pose[1])
+
+    def get_pose(self, window=None):
+        """
+        Robust mean of the samples in the last window: samples deviating more than outlier_threshold median absolute
+        deviations from the median are discarded before averaging.
+        Args:
+            window: duration in seconds, defaults to setting.window.
+
+        Returns:
+            [azimuth, elevation] in degrees, [None, None] if the sensor delivered no sample within the window.
+        """
+        samples = self.buffer.window(window or self.setting.window)[:, 1:]
+        if not len(samples):
+            return [None, None]
+        median = np.median(samples, axis=0)
+        d = np.abs(samples - median)  # deviation from median
+        mdev = np.median(d, axis=0)  # median deviation
+        inliers = d <= self.setting.outlier_threshold * np.where(mdev > 0, mdev, np.inf)
+        pose = [float(np.mean(samples[inliers[:, i], i])) if inliers[:, i].any() else float(median[i])
+                for i in range(2)]
+        return pose
+
+    def get_stability(self, window=None):
+        """
+        Mean absolute difference (degrees) between consecutive samples in the last window, per axis.
+        """
+        samples = self.buffer.window(window or self.setting.window)[:, 1:]
+        if len(samples) < 2:
+            return None
+        return np.mean(np.abs(np.diff(samples, axis=0)), axis=0)
+
+    def wait_for_stable(self, limit=0.2, window=1.0, timeout=None):
+        """
+        Blocks until the mean sample to sample change within the window is below limit on both axes.
+        Args:
+            limit: maximal change in degrees.
+            window: duration in seconds the pose has to be stable.
+            timeout: maximal waiting time in seconds, None waits indefinitely.
+
+        Returns:
+            True if the pose is stable, False after a timeout.
+        """
+        t_start = time.time()
+        while True:
+            diff = self.get_stability(window)
+            if diff is not None and np.all(diff < limit):
+                return True
+            if timeout is not None and time.time() - t_start >= timeout:
+                return False
+            time.sleep(window / 10)
+
+    def calibrate(self, window=1.0, timeout=5.0):
+        """
+        Uses the current head pose as the offset, the subject has to face the central speaker (azimuth and elevation
+        0). Waits for a stable pose and averages it over the window.
+        Args:
+            window: duration in seconds the pose is averaged over.
+            timeout: maximal waiting time in seconds for a stable pose.
+
+        Returns:
+            the offset [azimuth, elevation], None if the calibration was unsuccessful.
+        """
+        log.info("Calibrating sensor ...")
+        if not self.wait_for_stable(window=window, timeout=timeout):
+            log.warning("Head pose not stable, calibrating anyway ...")
+        offset = self.get_pose(window)
+        if None in offset:
+            log.warning("Calibration unsuccessful, the sensor delivered no samples!")
+            return None
+        self.offset = offset
+        self.calibrated = True
+        log.info(f"Sensor offset: {offset}")
+        return offset
+
+    def retrieve(self):
+        pose = self.get_pose()
+        if self.calibrated:
+            for i, coord in enumerate(pose):
+                if coord is None:
+                    log.warning("Could not acquire head pose")
+                    pose[i] = 99
+            if self.offset:
+                pose = [pose[0] - self.offset[0], pose[1] - self.offset[1]]  # subtract offset
+            else:
+                log.warning("Sensor not calibrated, head pose might be unreliable ...")
+        self.pose = pose
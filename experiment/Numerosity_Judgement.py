@@ -6,6 +6,9 @@ from labplatform.config import get_config
 from experiment.RP2 import RP2Device
 from experiment.RX8 import RX8Device
 from experiment.Camera import ArUcoCam
+from experiment.HeadposeGate import HeadposeGate
+from experiment.AsyncResultsFile import AsyncResultsFile
+from experiment.TrialPlan import plan_numerosity_judgement, plan_path, new_seed
 from Speakers.speaker_config import SpeakerArray
 import os
 from traits.api import List, Str, Int, Dict, Float, Any, Bool
@@ -56,6 +59,11 @@ class NumerosityJudgementExperiment(ExperimentLogic):
     rt = Any()
     is_correct = Bool()
     reversed_speech = Bool(False)
+    headpose_gate = Any()
+    gate_time = Float()
+    checkpoint = Any()  # SessionCheckpoint, written after each trial
+    checkpoint_attributes = ["sequence", "plan"]
+    plan = Any()  # TrialPlan if planned is set in the config, otherwise the trials are drawn at run time
 
     def _devices_default(self):
         rp2 = RP2Device()
@@ -65,6 +73,9 @@ class NumerosityJudgementExperiment(ExperimentLogic):
                 "RX8": rx8,
                 "ArUcoCam": cam}
 
+    def _headpose_gate_default(self):
+        return HeadposeGate(threshold=12.5)
+
     def _initialize(self, **kwargs):
         self.devices["RX8"].handle.write("playbuflen",
                                          self.setting.stim_duration * self.devices["RX8"].setting.sampling_freq,
@@ -78,18 +89,31 @@ class NumerosityJudgementExperiment(ExperimentLogic):
         pass
 
     def _stop(self, **kwargs):
-        pass
+        self.results.flush()
 
     def setup_experiment(self, info=None):
-        self.results.write(self.reversed_speech, "reversed_speech")
-        self.results.write(self.plane, "plane")
-        self.results.write(self.sequence, "sequence")
-        self.results.write(np.ndarray.tolist(np.array(self.devices["ArUcoCam"].offset)), "offset")
+        resumed = self.checkpoint is not None and self.checkpoint.resuming
+        self.load_speakers()
+        self.load_signals()
+        if resumed:
+            self.checkpoint.restore(self)  # sequence position, plan, random state and camera offset
+        elif getattr(config, "planned", False):
+            seed = getattr(config, "plan_seed", None)
+            seed = new_seed() if seed is None else seed
+            self.plan = plan_numerosity_judgement(seed, conditions=self.setting.conditions,
+                                                  trial_number=self.setting.trial_number,
+                                                  n_speakers=len(self.speakers), talkers=list(self.signals.keys()))
+            self.sequence = self.plan.sequence
+            self.plan.save(plan_path(self.results.path))
+            self.results.write(seed, "plan_seed")
+        if not resumed:
+            self.results.write(self.reversed_speech, "reversed_speech")
+            self.results.write(self.plane, "plane")
+            self.results.write(self.sequence, "sequence")
+            self.results.write(np.ndarray.tolist(np.array(self.devices["ArUcoCam"].offset)), "offset")
         self.devices["RX8"].handle.write(tag='bitmask',
                                          value=1,
                                          procs="RX81")  # illuminate central speaker LED
-        self.load_speakers()
-        self.load_signals()
         self.devices["RX8"].handle.write("data0", self.paradigm_start.data.flatten(), procs="RX81")
         self.devices["RX8"].handle.write("chan0", 1, procs="RX81")
         self.devices["RX8"].handle.trigger("zBusA", proc=self.devices["RX8"].handle)
@@ -156,9 +180,13 @@ class NumerosityJudgementExperiment(ExperimentLogic):
         self.results.write(self.solution, "solution")
         self.results.write(self.rt, "rt")
         self.results.write(self.is_correct, "is_correct")
-        self.results.write(np.ndarray.tolist(np.array(self.devices["ArUcoCam"].pose)), "headpose")
+        self.results.write(np.array(self.devices["ArUcoCam"].pose), "headpose")
         self.results.write([x.id for x in self.speakers_sample], "speakers_sample")
         self.results.write([x for x in self.signals_sample.keys()], "signals_sample")
+        self.results.write(self.gate_time, "gate_time")
+        self.results.commit()  # hand the records of this trial to the writer thread
+        if self.checkpoint is not None:
+            self.checkpoint.save(self)
 
     def load_signals(self, sound_type="tts-countries_n13_resamp_48828"):
         sound_type = "tts-countries-reversed_n13_resamp_48828" if self.reversed_speech else sound_type
@@ -194,11 +222,18 @@ class NumerosityJudgementExperiment(ExperimentLogic):
 
     def pick_speakers_this_trial(self, n_speakers):
         # speakers_no_rep = list(x for x in self.speakers if x not in self.speakers_sample)
-        self.speakers_sample = random.sample(self.speakers, n_speakers)
+        if self.plan is not None:
+            self.speakers_sample = [self.speakers[i] for i in self.plan.trial(self.sequence.this_n)["speakers"]]
+        else:
+            self.speakers_sample = random.sample(self.speakers, n_speakers)
 
     def pick_signals_this_trial(self, n_signals):
-        talkers = random.sample(list(self.signals.keys()), n_signals)
-        country_idxs = random.sample(range(13), n_signals)
+        if self.plan is not None:
+            talkers = self.plan.label("talkers", self.sequence.this_n)
+            country_idxs = self.plan.trial(self.sequence.this_n)["countries"]
+        else:
+            talkers = random.sample(list(self.signals.keys()), n_signals)
+            country_idxs = random.sample(range(13), n_signals)
         sample = dict()
         for idx, talker in enumerate(talkers):
             country_id = country_idxs[idx]
@@ -234,27 +269,16 @@ class NumerosityJudgementExperiment(ExperimentLogic):
         log.info('Calibration complete!')
 
     def check_headpose(self):
-        while True:
-            #self.devices["ArUcoCam"].configure()
-            self.devices["ArUcoCam"].retrieve()
-            # self.devices["ArUcoCam"].pause()
-            try:
-                if np.sqrt(np.mean(np.array(self.devices["ArUcoCam"].pose) ** 2)) > 12.5:
-                    log.info("Subject is not looking straight ahead")
-                    # self.devices["RX8"].clear_channels(n_channels=5, proc=["RX81", "RX82"])
-                    for idx in range(6):  # clear all speakers before loading warning tone
-                        self.devices["RX8"].handle.write(f"chan{idx}", 99, procs=["RX81", "RX82"])
-                    self.devices["RX8"].handle.write("data0", self.off_center.data.flatten(), procs="RX81")
-                    self.devices["RX8"].handle.write("chan0", 1, procs="RX81")
-                    #self.devices["RX8"].start()
-                    #self.devices["RX8"].pause()
-                    self.devices["RX8"].handle.trigger("zBusA", proc=self.devices["RX8"].handle)
-                    self.devices["RX8"].wait_to_finish_playing()
-                else:
-                    break
-            except TypeError:
-                log.info("Cannot detect markers, make sure cameras are set up correctly and arucomarkers can be detected.")
-                continue
+        self.gate_time = self.headpose_gate.wait(self.devices["ArUcoCam"], cue=self.play_off_center_cue)
+        log.info(f"Head pose gate open after {round(self.gate_time, 3)} s")
+
+    def play_off_center_cue(self):
+        for idx in range(6):  # clear all speakers before loading warning tone
+            self.devices["RX8"].handle.write(f"chan{idx}", 99, procs=["RX81", "RX82"])
+        self.devices["RX8"].handle.write("data0", self.off_center.data.flatten(), procs="RX81")
+        self.devices["RX8"].handle.write("chan0", 1, procs="RX81")
+        self.devices["RX8"].handle.trigger("zBusA", proc=self.devices["RX8"].handle)
+        self.devices["RX8"].wait_to_finish_playing()
 
 
 if __name__ == "__main__":
@@ -290,7 +314,7 @@ if __name__ == "__main__":
     # subject.file_path
     experimenter = "Max"
     nj = NumerosityJudgementExperiment(subject=subject, experimenter=experimenter)
-    nj.results = slab.ResultsFile(subject=subject.name)
+    nj.results = AsyncResultsFile(subject=subject.name)
     nj.devices["RP2"].experiment = nj
     nj.calibrate_camera()
     nj.start()
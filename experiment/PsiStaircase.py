@@ -0,0 +1,175 @@
+import logging
+import numpy as np
+import slab
+
+log = logging.getLogger(__name__)
+
+_likelihoods = dict()  # precomputed likelihood grids, shared by all staircases with the same parameter space
+
+
+def likelihood_grid(intensities, thresholds, slopes, guess_rate, lapse_rate):
+    """
+    Probability of a correct response for every combination of stimulus intensity, threshold and slope of a logistic
+    psychometric function, p = guess + (1 - guess - lapse) / (1 + exp(-slope * (intensity - threshold))). The grid is
+    computed once per parameter space and cached.
+
+    Returns:
+        array of shape (n_intensities, n_thresholds * n_slopes).
+    """
+    key = (tuple(intensities), tuple(thresholds), tuple(slopes), guess_rate, lapse_rate)
+    if key not in _likelihoods:
+        x = np.asarray(intensities, dtype=float)[:, None, None]
+        alpha = np.asarray(thresholds, dtype=float)[None, :, None]
+        beta = np.asarray(slopes, dtype=float)[None, None, :]
+        p = guess_rate + (1 - guess_rate - lapse_rate) / (1 + np.exp(-beta * (x - alpha)))
+        _likelihoods[key] = p.reshape(len(intensities), -1)
+    return _likelihoods[key]
+
+
+class PsiStaircase(slab.Staircase):
+    """
+    Bayesian adaptive procedure (Psi method, Kontsevich & Tyler 1999, the single stimulus dimension case of QUEST+) as
+    a drop-in replacement for slab.Staircase. The posterior over threshold and slope of a logistic psychometric
+    function is updated after every response, and the next intensity is the one which minimizes the expected entropy
+    of the posterior. The staircase finishes after max_trials, or earlier once the posterior standard deviation of the
+    threshold falls below threshold_sd. threshold() returns the posterior mean of the threshold.
+
+    Example::
+
+        stairs = PsiStaircase(min_val=-30, max_val=10, guess_rate=1/8, threshold_sd=1.5)
+        for level in stairs:
+            stairs.add_response(stairs.simulate_response(-10))
+        print(stairs.threshold(), stairs.threshold_sd_current)
+    """
+
+    def __init__(self, start_val=None, min_val=-30, max_val=10, step=1, thresholds=None, slopes=None,
+                 guess_rate=0.5, lapse_rate=0.02, min_trials=10, max_trials=60, threshold_sd=None, n_pretrials=0,
+                 label=''):
+        """
+        Args:
+            start_val: intensity of the first trial, defaults to the most informative intensity.
+            min_val, max_val, step: grid of intensities the procedure chooses from.
+            thresholds: grid of candidate thresholds, defaults to the intensity grid.
+            slopes: grid of candidate slopes (per unit of intensity), defaults to 15 log spaced values from 0.1 to 3.
+            guess_rate: probability of a correct guess, 1 / number of response alternatives.
+            lapse_rate: probability of an error independent of the intensity.
+            min_trials: number of trials before the threshold_sd criterion is applied.
+            max_trials: maximal number of trials.
+            threshold_sd: stop once the posterior standard deviation of the threshold is below this value. None only
+                stops after max_trials.
+            n_pretrials: number of trials at start_val before the procedure begins, not used for the posterior.
+        """
+        self.stim_intensities = np.round(np.arange(min_val, max_val + step / 2, step), 8)
+        self.thresholds = self.stim_intensities if thresholds is None else np.asarray(thresholds, dtype=float)
+        self.slopes = np.geomspace(0.1, 3, 15) if slopes is None else np.asarray(slopes, dtype=float)
+        self.guess_rate = guess_rate
+        self.lapse_rate = lapse_rate
+        self.min_trials = min_trials
+        self.max_trials = max_trials
+        self.threshold_sd = threshold_sd
+        self.posterior = np.full(len(self.thresholds) * len(self.slopes), 1 / (len(self.thresholds) * len(self.slopes)))
+        self.threshold_sd_current = None
+        super().__init__(start_val=start_val if start_val is not None else self._best_intensity(), n_reversals=None,
+                         n_pretrials=n_pretrials, step_type="lin", min_val=min_val, max_val=max_val, label=label)
+
+    @property
+    def _likelihood(self):
+        return likelihood_grid(self.stim_intensities, self.thresholds, self.slopes, self.guess_rate,
+                               self.lapse_rate)
+
+    def _best_intensity(self):
+        """
+        Intensity with the minimal expected entropy of the posterior after the next response.
+        """
+        p_correct = self._likelihood * self.posterior  # joint of parameters and a correct response, per intensity
+        p_incorrect = self.posterior - p_correct
+        expected_entropy = np.zeros(len(self.stim_intensities))
+        for joint in (p_correct, p_incorrect):
+            marginal = joint.sum(axis=1, keepdims=True)
+            posterior = joint / marginal
+            # expected entropy, weighted with the probability of the response
+            expected_entropy -= marginal[:, 0] * np.sum(posterior * np.log(np.where(posterior > 0, posterior, 1)),
+                                                        axis=1)
+        return float(self.stim_intensities[np.argmin(expected_entropy)])
+
+    def add_response(self, result, intensity=None):
+        """
+        Adds a correct (True or 1) or incorrect (False or 0) response to the last trial, updates the posterior and
+        chooses the intensity of the next trial.
+        """
+        result = bool(result)
+        self.data.append(result)
+        if intensity is not None:
+            self.intensities[-1] = intensity
+        if self.this_trial_n <= 0:  # pretrial
+            return
+        idx = np.argmin(np.abs(self.stim_intensities - self.intensities[-1]))
+        likelihood = self._likelihood[idx] if result else 1 - self._likelihood[idx]
+        self.posterior = self.posterior * likelihood
+        self.posterior /= self.posterior.sum()
+        thresholds = self.marginal_thresholds()
+        mean = np.sum(thresholds * self.thresholds)
+        self.threshold_sd_current = float(np.sqrt(np.sum(thresholds * (self.thresholds - mean) ** 2)))
+        next_intensity = self._best_intensity()
+        direction = "up" if next_intensity > self.intensities[-1] else "down" if next_intensity < \
+            self.intensities[-1] else self.current_direction
+        if direction != self.current_direction:  # only for display, the procedure does not use reversals
+            self.reversal_points.append(self.this_trial_n)
+            self.reversal_intensities.append(self.intensities[-1])
+        self.current_direction = direction
+        self._next_intensity = next_intensity
+        if self.this_trial_n >= self.max_trials or (self.threshold_sd is not None and self.this_trial_n >=
+                                                    self.min_trials and self.threshold_sd_current < self.threshold_sd):
+            self.finished = True
+
+    def marginal_thresholds(self):
+        return self.posterior.reshape(len(self.thresholds), len(self.slopes)).sum(axis=1)
+
+    def marginal_slopes(self):
+        return self.posterior.reshape(len(self.thresholds), len(self.slopes)).sum(axis=0)
+
+    def threshold(self, n=0):
+        """
+        Posterior mean of the threshold, intensity at which performance is halfway between guess rate and 1 - lapse
+        rate. n is ignored and only kept for compatibility with slab.Staircase.
+        """
+        return float(np.sum(self.marginal_thresholds() * self.thresholds))
+
+    def slope(self):
+        """
+        Posterior mean of the slope.
+        """
+        return float(np.sum(self.marginal_slopes() * self.slopes))
+
+    def summary(self):
+        """
+        Compact, JSON serializable record of the staircase to write into the results file instead of the object, whose
+        attributes hold the posterior and the parameter grids as arrays.
+
+        Returns:
+            dict with the presented intensities and responses, the reversal intensities and the posterior mean and
+            standard deviation of threshold and slope.
+        """
+        thresholds, slopes = self.marginal_thresholds(), self.marginal_slopes()
+        threshold, slope = self.threshold(), self.slope()
+        return {"label": self.label,
+                "intensities": [float(i) for i in self.intensities],
+                "data": [bool(d) for d in self.data],
+                "n_pretrials": int(self.n_pretrials),
+                "reversal_intensities": [float(i) for i in self.reversal_intensities],
+                "finished": bool(self.finished),
+                "threshold": threshold,
+                "threshold_sd": float(np.sqrt(np.sum(thresholds * (self.thresholds - threshold) ** 2))),
+                "slope": slope,
+                "slope_sd": float(np.sqrt(np.sum(slopes * (self.slopes - slope) ** 2)))}
+
+    def __str__(self):
+        return f'Psi staircase, trial {self.this_trial_n} of at most {self.max_trials}, threshold ' \
+               f'{self.threshold():.1f} +- {self.threshold_sd_current or np.nan:.1f}'
+
+    def print_trial_info(self):
+        print(
+            f'{self.label} | trial # {self.this_trial_n}: intensity '
+            f'{round(self.intensities[-1], 2) if self.intensities else round(self._next_intensity, 2)}, threshold '
+            f'{self.threshold():.2f} (sd {self.threshold_sd_current or np.nan:.2f}), response '
+            f'{self.data[-1] if self.data else None}')
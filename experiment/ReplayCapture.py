@@ -0,0 +1,165 @@
+import os
+import glob
+import time
+import logging
+import numpy as np
+import cv2
+
+log = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+
+class ReplayCapture:
+    """
+    Offline stand-in for EasyPySpin.VideoCapture. Serves frames from a recorded video file or an image sequence through
+    the same read() interface, so that ArUcoCam can be run, profiled and tuned without the FLIR cameras.
+    Image sequences can be given as a folder, a glob pattern or a list of files. If the folder contains a
+    timestamps.txt (one timestamp in seconds per frame, as written by ArUcoCam.record), those timestamps are used,
+    otherwise the frames are assumed to be equally spaced at fps.
+    """
+
+    def __init__(self, source, rate="original", fps=30.0, loop=False, preload=False):
+        """
+        Args:
+            source: path to a video file, a folder or glob pattern of images, or a list of image paths.
+            rate: "original" serves the frames at their recorded rate, "max" serves them as fast as they are read. A
+                number is interpreted as a playback speed factor relative to the original rate.
+            fps: frame rate of image sequences without timestamps.
+            loop: whether to start again from the first frame once the recording is exhausted.
+            preload: decode all frames into memory first, so that file decoding does not add to the measured timing.
+        """
+        self.source = source
+        self.rate = rate
+        self.loop = loop
+        self.timestamp = None  # recording timestamp of the last frame in seconds
+        self._video = None
+        self._files = None
+        self._frames = None
+        self._pos = 0
+        self._t_start = None
+        self._opened = True
+        if isinstance(source, (list, tuple)):
+            self._files = sorted(source)
+        elif os.path.isdir(source):
+            self._files = sorted(os.path.join(source, f) for f in os.listdir(source)
+                                 if f.lower().endswith(IMAGE_EXTENSIONS))
+        elif any(c in source for c in "*?["):
+            self._files = sorted(glob.glob(source))
+        else:
+            self._video = cv2.VideoCapture(source)
+            if not self._video.isOpened():
+                raise FileNotFoundError(f"Could not open video file {source}")
+            fps = self._video.get(cv2.CAP_PROP_FPS) or fps
+        self.fps = fps
+        if self._files is not None:
+            if not self._files:
+                raise FileNotFoundError(f"No images found in {source}")
+            self.timestamps = self._read_timestamps()
+        else:
+            n_frames = int(self._video.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.timestamps = np.arange(n_frames) / self.fps
+        if preload:
+            frames = list()
+            for self._pos in range(len(self.timestamps)):
+                ret, frame = self._decode()
+                if not ret:
+                    break
+                frames.append(frame)
+            self._frames = frames
+            self.timestamps = self.timestamps[:len(frames)]
+            self._rewind()
+
+    def _read_timestamps(self):
+        folder = os.path.dirname(self._files[0])
+        timestamp_file = os.path.join(folder, "timestamps.txt")
+        if os.path.isfile(timestamp_file):
+            timestamps = np.loadtxt(timestamp_file, ndmin=1)
+            if len(timestamps) == len(self._files):
+                return timestamps - timestamps[0]
+            log.warning(f"Number of timestamps does not match number of frames in {folder}, using {self.fps} fps")
+        return np.arange(len(self._files)) / self.fps
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def _decode(self):
+        if self._frames is not None:
+            if self._pos >= len(self._frames):
+                return False, None
+            return True, self._frames[self._pos]
+        if self._video is not None:
+            return self._video.read()
+        if self._pos >= len(self._files):
+            return False, None
+        frame = cv2.imread(self._files[self._pos], cv2.IMREAD_UNCHANGED)
+        return frame is not None, frame
+
+    def _rewind(self):
+        self._pos = 0
+        self._t_start = None
+        if self._video is not None:
+            self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def _wait_for_frame(self, timestamp):
+        if self.rate == "max":
+            return
+        speed = 1.0 if self.rate == "original" else float(self.rate)
+        if self._t_start is None:
+            self._t_start = time.perf_counter() - timestamp / speed
+        delay = self._t_start + timestamp / speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def read(self):
+        """
+        Returns:
+            tuple of (success, frame) like cv2.VideoCapture.read and EasyPySpin.VideoCapture.read.
+        """
+        if not self._opened:
+            return False, None
+        if self._pos >= len(self.timestamps):
+            if not self.loop:
+                self._opened = False
+                return False, None
+            self._rewind()
+        ret, frame = self._decode()
+        if not ret:
+            self._opened = False
+            return False, None
+        self.timestamp = self.timestamps[self._pos]
+        self._wait_for_frame(self.timestamp)
+        self._pos += 1
+        return True, frame
+
+    def isOpened(self):
+        return self._opened
+
+    def release(self):
+        self._opened = False
+        self._frames = None
+        if self._video is not None:
+            self._video.release()
+
+    def get(self, prop_id):
+        if prop_id == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop_id == cv2.CAP_PROP_FRAME_COUNT:
+            return len(self)
+        if prop_id == cv2.CAP_PROP_POS_FRAMES:
+            return self._pos
+        if prop_id == cv2.CAP_PROP_POS_MSEC:
+            return 0.0 if self.timestamp is None else self.timestamp * 1000
+        if self._video is not None:
+            return self._video.get(prop_id)
+        return 0.0
+
+    def set(self, prop_id, value):
+        if prop_id == cv2.CAP_PROP_POS_FRAMES:
+            self._pos = int(value)
+            self._t_start = None
+            self._opened = True
+            if self._video is not None and self._frames is None:
+                self._video.set(cv2.CAP_PROP_POS_FRAMES, int(value))
+            return True
+        return False
@@ -0,0 +1,109 @@
+import os
+import pickle
+import random
+import pathlib
+import logging
+import numpy as np
+from labplatform.config import get_config
+
+log = logging.getLogger(__name__)
+
+
+class SessionCheckpoint:
+    """
+    Checkpoint of a running session, rewritten after every trial so that a session can be resumed after the Python
+    process or the TDT connection died. It holds what cannot be recovered from the results file: the trial sequence,
+    the staircases, the state of the random number generators, the camera offset and the path of the results file.
+
+    save() only pickles the state on the experiment thread (well below a millisecond). The bytes are written by the
+    results writer thread right after the records of the same trial, so the checkpoint never gets ahead of the results
+    file. The file is replaced atomically, a crash while writing keeps the previous checkpoint. Sounds and speakers
+    are loaded again when the resumed session is set up, the stimuli of each trial are drawn and equalized anew.
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path: checkpoint file. If None, the default_path of the session is used, determined at the first save so
+                that settings made after creating the checkpoint, e.g. reversed_speech, are taken into account.
+        """
+        self.path = pathlib.Path(path) if path is not None else None
+        self.state = None  # state read from the file, restored when the resumed session is set up
+
+    @staticmethod
+    def default_path(subject, paradigm, plane, condition=None):
+        """
+        Checkpoint file of a session. The sessions of a subject differ by paradigm, plane and condition, e.g. forward
+        or reversed speech in NumJudge or noise or babble in LocaAccu, see session_condition.
+        """
+        name = f"{subject}_{paradigm}_{plane}" + (f"_{condition}" if condition else "")
+        return os.path.join(get_config("DATA_ROOT"), "checkpoints", f"{name}.pkl")
+
+    @staticmethod
+    def session_condition(exp):
+        if hasattr(exp, "reversed_speech"):
+            return "reversed" if exp.reversed_speech else "forward"
+        return getattr(exp, "mode", None)
+
+    @classmethod
+    def load(cls, path):
+        checkpoint = cls(path)
+        with open(checkpoint.path, "rb") as file:
+            checkpoint.state = pickle.load(file)
+        return checkpoint
+
+    @property
+    def resuming(self):
+        return self.state is not None
+
+    def save(self, exp):
+        """
+        Takes a checkpoint of the experiment at the end of a trial. The experiment lists the attributes to save in
+        checkpoint_attributes.
+        """
+        cam = exp.devices["ArUcoCam"]
+        state = {"paradigm": exp.setting.experiment_name,
+                 "subject": exp.subject.name,
+                 "experimenter": getattr(exp, "experimenter", None),
+                 "plane": exp.plane,
+                 "mode": getattr(exp, "mode", None),
+                 "reversed_speech": getattr(exp, "reversed_speech", None),
+                 "trials_done": exp.setting.current_trial + 1,
+                 "finished": exp.setting.current_trial + 1 >= exp.setting.total_trial,
+                 "results_path": str(exp.results.path),
+                 "offset": cam.offset,
+                 "calibrated": cam.calibrated,
+                 "random_state": random.getstate(),
+                 "numpy_random_state": np.random.get_state(),
+                 "attributes": {name: getattr(exp, name) for name in exp.checkpoint_attributes}}
+        data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        if self.path is None:
+            self.path = pathlib.Path(self.default_path(exp.subject.name, exp.setting.experiment_name, exp.plane,
+                                                       self.session_condition(exp)))
+        if hasattr(exp.results, "enqueue"):
+            exp.results.enqueue(lambda: self._write(data))  # after the records of this trial
+        else:
+            self._write(data)
+
+    def _write(self, data):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp = self.path.with_suffix(".tmp")
+        with open(temp, "wb") as file:
+            file.write(data)
+        os.replace(temp, self.path)
+
+    def restore(self, exp):
+        """
+        Restores the loaded state into the experiment. Call this in setup_experiment after loading the stimuli, the
+        random number generators continue from where the interrupted session stopped.
+        """
+        state, self.state = self.state, None
+        for name, value in state["attributes"].items():
+            setattr(exp, name, value)
+        exp.setting.current_trial = state["trials_done"]
+        exp.devices["ArUcoCam"].offset = state["offset"]
+        exp.devices["ArUcoCam"].calibrated = state["calibrated"]
+        random.setstate(state["random_state"])
+        np.random.set_state(state["numpy_random_state"])
+        exp.results.write(state["trials_done"], "resumed")
+        log.info(f"Resumed {state['paradigm']} session of {state['subject']} after {state['trials_done']} trials")
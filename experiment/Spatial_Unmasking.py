@@ -6,6 +6,12 @@ from labplatform.config import get_config
 from experiment.RP2 import RP2Device
 from experiment.RX8 import RX8Device
 from experiment.Camera import ArUcoCam
+from experiment.HeadposeGate import HeadposeGate
+from experiment.AsyncResultsFile import AsyncResultsFile
+from experiment.TrialPlan import plan_spatial_unmasking, plan_path, new_seed
+from experiment.StaircaseMonitor import StaircaseMonitor
+from experiment.PsiStaircase import PsiStaircase
+from experiment.InterleavedStaircases import InterleavedStaircases
 from Speakers.speaker_config import SpeakerArray
 import os
 from traits.api import List, Str, Int, Dict, Float, Any, Bool
@@ -21,6 +27,30 @@ log = logging.getLogger(__name__)
 config = slab.load_config(os.path.join(get_config("BASE_DIRECTORY"), "config", "spatmask_config.txt"))
 
 
+def make_staircase():
+    """
+    Adaptive procedure of one masker position, selected by procedure in the config: "staircase" (default) for the
+    up-down slab.Staircase, "psi" for the Bayesian PsiStaircase, which stops early once the posterior standard
+    deviation of the threshold falls below psi_threshold_sd.
+    """
+    if getattr(config, "procedure", "staircase") == "psi":
+        return PsiStaircase(start_val=getattr(config, "psi_start_val", None),
+                            min_val=getattr(config, "psi_min_val", -30),
+                            max_val=getattr(config, "psi_max_val", 10),
+                            guess_rate=1 / 8,  # eight target numbers
+                            lapse_rate=getattr(config, "psi_lapse_rate", 0.02),
+                            min_trials=getattr(config, "psi_min_trials", 10),
+                            max_trials=getattr(config, "psi_max_trials", 60),
+                            threshold_sd=getattr(config, "psi_threshold_sd", 2.0))
+    return slab.Staircase(start_val=config.start_val,
+                          n_reversals=config.n_reversals,
+                          step_sizes=config.step_sizes,
+                          step_up_factor=config.step_up_factor,
+                          step_type=config.step_type,
+                          n_down=config.n_down,
+                          n_up=config.n_up)
+
+
 class SpatialUnmaskingSetting(ExperimentSetting):
 
     experiment_name = Str('SpatMask', group='status', dsec='name of the experiment', noshow=True)
@@ -44,13 +74,8 @@ class SpatialUnmaskingExperiment(ExperimentLogic):
     paradigm_start = slab.Sound.read(os.path.join(get_config("SOUND_ROOT"), "misc_48828\\paradigm_start.wav"))
     staircase_end = slab.Sound.read(os.path.join(get_config("SOUND_ROOT"), "misc_48828\\staircase_end.wav"))
     paradigm_end = slab.Sound.read(os.path.join(get_config("SOUND_ROOT"), "misc_48828\\paradigm_end.wav"))
-    stairs = Any(slab.Staircase(start_val=config.start_val,
-                                n_reversals=config.n_reversals,
-                                step_sizes=config.step_sizes,
-                                step_up_factor=config.step_up_factor,
-                                step_type=config.step_type,
-                                n_down=config.n_down,
-                                n_up=config.n_up))
+    stairs = Any(make_staircase())
+    tracks = Any()  # InterleavedStaircases if interleaved is set in the config
     target_speaker = Any()
     selected_target_sounds = List()
     masker_speaker = Any()
@@ -65,6 +90,12 @@ class SpatialUnmaskingExperiment(ExperimentLogic):
     response = Int()
     is_correct = Bool()
     rt = Any()
+    headpose_gate = Any()
+    gate_time = Float()
+    monitor = Any()
+    checkpoint = Any()  # SessionCheckpoint, written after each trial
+    checkpoint_attributes = ["sequence", "stairs", "tracks", "talker", "plan"]
+    plan = Any()  # TrialPlan if planned is set in the config, otherwise the trials are drawn at run time
 
     def _devices_default(self):
         rp2 = RP2Device()
@@ -74,6 +105,12 @@ class SpatialUnmaskingExperiment(ExperimentLogic):
                 "RX8": rx8,
                 "ArUcoCam": cam}
 
+    def _headpose_gate_default(self):
+        return HeadposeGate(threshold=15)
+
+    def _monitor_default(self):
+        return StaircaseMonitor(max_fps=10)
+
     def _initialize(self, **kwargs):
         self.devices["RX8"].handle.write("playbuflen",
                                          self.setting.stim_duration * self.devices["RX8"].setting.sampling_freq,
@@ -86,25 +123,51 @@ class SpatialUnmaskingExperiment(ExperimentLogic):
         pass
 
     def _stop(self, **kwargs):
-        self.stairs.close_plot()
+        self.monitor.close()
+        self.results.flush()
 
     def setup_experiment(self, info=None):
-        self.results.write(self.plane, "plane")
+        resumed = self.checkpoint is not None and self.checkpoint.resuming
+        if not resumed:
+            self.results.write(self.plane, "plane")
         self.load_speakers()
         self.load_signals()
         self.load_maskers()
-        self.talker = random.choice(["229", "318", "256", "307", "248", "245", "284", "268"])
+        talkers = ["229", "318", "256", "307", "248", "245", "284", "268"]
+        if resumed:
+            self.checkpoint.restore(self)  # sequence position, staircases, talker, plan, random state and offset
+        elif getattr(config, "planned", False):
+            seed = getattr(config, "plan_seed", None)
+            seed = new_seed() if seed is None else seed
+            self.plan = plan_spatial_unmasking(seed, n_conditions=self.setting.n_conditions,
+                                               max_trials=self.setting.trial_number, talkers=talkers,
+                                               maskers=list(self.maskers.keys()),
+                                               excluded_maskers={talker: set(self.maskers) - set(
+                                                   self.maskers_without_talker(talker)) for talker in talkers})
+            self.sequence = self.plan.sequence
+            self.talker = self.plan.label("talker", 0)
+            self.plan.save(plan_path(self.results.path))
+            self.results.write(seed, "plan_seed")
+        else:
+            self.talker = random.choice(talkers)
         self.pick_masker_according_to_talker()
         self.selected_target_sounds = self.signals[self.talker]  # select numbers 1-9 for one talker
-        self.results.write(self.sequence, "sequence")
-        self.results.write(self.talker, "talker")
-        self.results.write(np.ndarray.tolist(np.array(self.devices["ArUcoCam"].pose)), "offset")
+        if not resumed:
+            self.results.write(self.sequence, "sequence")
+            self.results.write(self.talker, "talker")
+            self.results.write(np.ndarray.tolist(np.array(self.devices["ArUcoCam"].pose)), "offset")
         self.devices["RX8"].handle.write(tag='bitmask',
                                          value=1,
                                          procs="RX81")  # illuminate central speaker LED
         # self.results.write(self.stairs, "stairs")
         # self._tosave_para["reaction_time"] = Any
-        self.sequence.__next__()
+        if not resumed:
+            self.sequence.__next__()
+            if getattr(config, "interleaved", False):  # one track per masker position, interleaved from trial to trial
+                self.tracks = InterleavedStaircases(conditions=self.sequence.conditions, make_track=make_staircase,
+                                                    order=getattr(config, "interleave_order", "random"))
+        if self.tracks is not None:
+            self.monitor.reset(title="Interleaved staircases")
         self.devices["RX8"].handle.write("data0", self.paradigm_start.data.flatten(), procs="RX81")
         self.devices["RX8"].handle.write("chan0", 1, procs="RX81")
         self.devices["RX8"].handle.trigger("zBusA", proc=self.devices["RX8"].handle)
@@ -115,16 +178,12 @@ class SpatialUnmaskingExperiment(ExperimentLogic):
         time.sleep(1)
 
     def _prepare_trial(self):
+        if self.tracks is not None:
+            self._prepare_interleaved_trial()
+            return
         if self.stairs.finished:
-            self.stairs.close_plot()
             self.devices["RX8"].clear_channels(n_channels=5, proc=["RX81", "RX82"])
-            self.stairs = slab.Staircase(start_val=config.start_val,
-                                         n_reversals=config.n_reversals,
-                                         step_sizes=config.step_sizes,
-                                         step_up_factor=config.step_up_factor,
-                                         step_type=config.step_type,
-                                         n_down=config.n_down,
-                                         n_up=config.n_up)
+            self.stairs = make_staircase()
             # self._tosave_para["stairs"] = self.stairs
             self.devices["RX8"].handle.write("data0", self.staircase_end.data.flatten(), procs="RX81")
             self.devices["RX8"].handle.write("chan0", 1, procs="RX81")
@@ -132,22 +191,44 @@ class SpatialUnmaskingExperiment(ExperimentLogic):
             self.devices["RX8"].wait_to_finish_playing()
             self.devices["RX8"].clear_buffers(n_buffers=1, proc="RX81")
             self.sequence.__next__()
+            self.monitor.reset(title=f"Staircase {self.sequence.this_n + 1} of {self.sequence.n_conditions}")
             time.sleep(1.0)
         self.masker_speaker = self.speakers[self.sequence.this_trial - 1]
         self.results.write(self.masker_speaker.id, "masker_speaker_id")
-        self.masker_sound_id = random.sample(self.potential_maskers.keys(), 1)[0]
-        self.masker_sound = self.potential_maskers[self.masker_sound_id]
+        self.pick_masker_sound()
         self.stairs.print_trial_info()
         log.info(f"Staircase number {self.sequence.this_n} out of {self.sequence.n_conditions}")
 
+    def _prepare_interleaved_trial(self):
+        condition, self.stairs = self.tracks.__next__()
+        self.masker_speaker = self.speakers[condition - 1]
+        self.results.write(self.masker_speaker.id, "masker_speaker_id")
+        self.pick_masker_sound()
+        self.stairs.print_trial_info()
+        log.info(f"Track of masker position {condition}, {len(self.tracks.active)} of {len(self.tracks.conditions)} "
+                 f"tracks active")
+
     def _start_trial(self):
         self.time_0 = time.time()  # starting time of the trial
         level = self.stairs.__next__()
         log.info(f"trial {self.setting.current_trial} dB level: {level}")
         self.check_headpose()
         # self.devices["RX8"].clear_buffer()
-        target_sound_i = random.choice(range(len(self.selected_target_sounds)))
+        if self.plan is not None:
+            target_sound_i = self.plan.trial(self.setting.current_trial)["target_sound"]
+        else:
+            target_sound_i = random.choice(range(len(self.selected_target_sounds)))
         target_sound = self.selected_target_sounds[target_sound_i]  # choose random number from sound_list
+        solution_converter = {"0": 8,
+                              "1": 5,
+                              "2": 4,
+                              "3": 9,
+                              "4": 1,
+                              "5": 6,
+                              "6": 3,
+                              "7": 2
+                              }
+        self.solution = solution_converter[str(target_sound_i)]  # known before the response
         target_sound = self.target_speaker.apply_equalization(target_sound, level_only=False)
         target_sound.level += level
         self.results.write(target_sound.level, "target_sound_level")
@@ -181,21 +262,14 @@ class SpatialUnmaskingExperiment(ExperimentLogic):
         # self._tosave_para["reaction_time"] = reaction_time
         log.info(f"response: {self.response}")
         # self.stairs.add_response(response)
-        solution_converter = {"0": 8,
-                              "1": 5,
-                              "2": 4,
-                              "3": 9,
-                              "4": 1,
-                              "5": 6,
-                              "6": 3,
-                              "7": 2
-                              }
-        self.solution = solution_converter[str(target_sound_i)]
         log.info(f"solution: {self.solution}")
         # self._tosave_para["solution"] = solution
         self.is_correct = True if self.solution == self.response else False
         self.stairs.add_response(1) if self.response == self.solution else self.stairs.add_response(0)
-        self.stairs.plot()
+        trial = self.tracks.this_trial_n - 1 if self.tracks is not None else None  # trial of all interleaved tracks
+        self.monitor.update_from_staircase(self.stairs, trial=trial, rt=self.rt, gate_time=self.gate_time,
+                                           gate_deviation=self.headpose_gate.deviation,
+                                           gate_open=self.headpose_gate.is_open)  # rendered in the monitor process
         # print(response)
         # print(solution)
 
@@ -203,12 +277,15 @@ class SpatialUnmaskingExperiment(ExperimentLogic):
         log.info(f"trial {self.setting.current_trial} end: {time.time() - self.time_0}")
         for device in self.devices.keys():
             self.devices[device].pause()
-        if self.sequence.n_remaining == 0 and self.stairs.finished:
+        if self.tracks is not None and self.tracks.finished or \
+                self.tracks is None and self.sequence.n_remaining == 0 and self.stairs.finished:
             self.setting.current_trial = self.setting.total_trial
         if self.stairs.finished:
             self.threshold = self.stairs.threshold()
-            self.results.write(self.stairs, "stairs")
+            self.results.write(self.stairs.summary() if isinstance(self.stairs, PsiStaircase) else self.stairs,
+                               "stairs")
             self.results.write(self.threshold, "threshold")
+            self.results.write(self.masker_speaker.id, "threshold_speaker_id")  # staircases may finish in any order
         if self.setting.current_trial == self.setting.total_trial:
             self.devices["RX8"].handle.write(tag='bitmask',
                                              value=0,
@@ -218,11 +295,15 @@ class SpatialUnmaskingExperiment(ExperimentLogic):
             self.devices["RX8"].handle.write("chan0", 1, procs="RX81")
             self.devices["RX8"].handle.trigger("zBusA", proc=self.devices["RX8"].handle)
             self.devices["RX8"].wait_to_finish_playing()
-        self.results.write(np.ndarray.tolist(np.array(self.devices["ArUcoCam"].pose)), "headpose")
+        self.results.write(np.array(self.devices["ArUcoCam"].pose), "headpose")
         self.results.write(self.response, "response")
         self.results.write(self.solution, "solution")
         self.results.write(self.rt, "rt")
         self.results.write(self.is_correct, "is_correct")
+        self.results.write(self.gate_time, "gate_time")
+        self.results.commit()  # hand the records of this trial to the writer thread
+        if self.checkpoint is not None:
+            self.checkpoint.save(self)
 
     def load_signals(self, target_sounds_type="tts-numbers_n13_resamp_48828"):
         sound_root = get_config(setting="SOUND_ROOT")
@@ -270,12 +351,22 @@ class SpatialUnmaskingExperiment(ExperimentLogic):
         self.speakers = speakers
         self.target_speaker = spk_array.pick_speakers(23)[0]
 
+    def pick_masker_sound(self):
+        if self.plan is not None:
+            self.masker_sound_id = self.plan.label("masker_sound", self.setting.current_trial)
+        else:
+            self.masker_sound_id = random.sample(self.potential_maskers.keys(), 1)[0]
+        self.masker_sound = self.potential_maskers[self.masker_sound_id]
+
     def pick_masker_according_to_talker(self):
+        self.potential_maskers = self.maskers_without_talker(self.talker)
+
+    def maskers_without_talker(self, talker):
         potential_maskers = dict()
         for key, masker in self.maskers.items():
-            if self.talker not in masker:
+            if talker not in masker:
                 potential_maskers[key] = masker
-        self.potential_maskers = potential_maskers
+        return potential_maskers
 
     def calibrate_camera(self, report=True):
         """
@@ -305,25 +396,15 @@ class SpatialUnmaskingExperiment(ExperimentLogic):
         log.info('Calibration complete!')
 
     def check_headpose(self):
-        while True:
-            #self.devices["ArUcoCam"].configure()
-            self.devices["ArUcoCam"].retrieve()
-            # self.devices["ArUcoCam"].pause()
-            try:
-                if np.sqrt(np.mean(np.array(self.devices["ArUcoCam"].pose) ** 2)) > 15:
-                    log.info("Subject is not looking straight ahead")
-                    self.devices["RX8"].clear_channels(n_channels=2, proc=["RX81", "RX82"])
-                    self.devices["RX8"].handle.write("data0", self.off_center.data.flatten(), procs="RX81")
-                    self.devices["RX8"].handle.write("chan0", 1, procs="RX81")
-                    #self.devices["RX8"].start()
-                    #self.devices["RX8"].pause()
-                    self.devices["RX8"].handle.trigger("zBusA", proc=self.devices["RX8"].handle)
-                    self.devices["RX8"].wait_to_finish_playing()
-                else:
-                    break
-            except TypeError:
-                log.info("Cannot detect markers, make sure cameras are set up correctly and arucomarkers can be detected.")
-                continue
+        self.gate_time = self.headpose_gate.wait(self.devices["ArUcoCam"], cue=self.play_off_center_cue)
+        log.info(f"Head pose gate open after {round(self.gate_time, 3)} s")
+
+    def play_off_center_cue(self):
+        self.devices["RX8"].clear_channels(n_channels=2, proc=["RX81", "RX82"])
+        self.devices["RX8"].handle.write("data0", self.off_center.data.flatten(), procs="RX81")
+        self.devices["RX8"].handle.write("chan0", 1, procs="RX81")
+        self.devices["RX8"].handle.trigger("zBusA", proc=self.devices["RX8"].handle)
+        self.devices["RX8"].wait_to_finish_playing()
 
 
 if __name__ == "__main__":
@@ -358,7 +439,7 @@ if __name__ == "__main__":
     # subject.file_path
     experimenter = "Max"
     su = SpatialUnmaskingExperiment(subject=subject, experimenter=experimenter)
-    su.results = slab.ResultsFile(subject=f"{subject.name}_{su.setting.experiment_name}")
+    su.results = AsyncResultsFile(subject=f"{subject.name}_{su.setting.experiment_name}")
     su.calibrate_camera()
     su.start()
     # su.configure_traits()
@@ -0,0 +1,222 @@
+import time
+import queue
+import logging
+import multiprocessing
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class StaircaseMonitor:
+    """
+    Live plot of the staircase, the trial timing and the head pose gate, rendered in a separate process. The experiment
+    only puts one small record per trial into a queue and never waits for the plot. The monitor process drains the
+    queue, redraws at most max_fps times per second and only blits the changed artists, so rendering does not slow down
+    with the number of trials. If the queue is full or the monitor window was closed, updates are dropped.
+    """
+
+    def __init__(self, max_fps=10, max_queue=1000, enabled=True):
+        """
+        Args:
+            max_fps: maximal number of redraws per second.
+            max_queue: maximal number of pending updates.
+            enabled: if False, all calls are ignored, e.g. for headless runs.
+        """
+        self.max_fps = max_fps
+        self.enabled = enabled
+        self._max_queue = max_queue
+        self._queue = None
+        self._process = None
+
+    @property
+    def is_running(self):
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        if not self.enabled or self.is_running:
+            return
+        context = multiprocessing.get_context("spawn")  # a fresh interpreter for the gui, also on linux
+        self._queue = context.Queue(self._max_queue)
+        self._process = context.Process(target=_run_monitor, args=(self._queue, self.max_fps),
+                                        name="staircase monitor", daemon=True)
+        self._process.start()
+
+    def _put(self, message):
+        if not self.enabled:
+            return
+        if not self.is_running:
+            self.start()
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            log.debug("Staircase monitor is lagging behind, dropped update")
+
+    def update(self, **record):
+        """
+        Sends the data of one trial to the monitor. Known keys: trial, intensity, response, next_intensity, reversal,
+        threshold, rt (ms), gate_time (s), gate_deviation (degrees), gate_open. Missing keys are simply not shown.
+        """
+        self._put(("update", record))
+
+    def update_from_staircase(self, stairs, trial=None, **record):
+        """
+        Convenience wrapper sending the last trial of a slab.Staircase, plus additional keys like in update(). trial
+        defaults to the trial number within the staircase.
+        """
+        if not stairs.intensities:
+            return
+        self.update(trial=len(stairs.intensities) - stairs.n_pretrials - 1 if trial is None else trial,
+                    intensity=float(stairs.intensities[-1]),
+                    response=bool(stairs.data[-1]),
+                    next_intensity=float(stairs._next_intensity),
+                    reversal=bool(stairs.reversal_points) and stairs.reversal_points[-1] == stairs.this_trial_n,
+                    threshold=float(stairs.threshold()) if stairs.finished else None,
+                    **record)
+
+    def reset(self, title=None):
+        """
+        Clears the staircase, e.g. when the next staircase starts. The timing history is kept.
+        """
+        self._put(("reset", title))
+
+    def close(self, timeout=2.0):
+        if self._process is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process = None
+        self._queue = None
+
+
+def _run_monitor(updates, max_fps):
+    import matplotlib.pyplot as plt
+    from matplotlib.lines import Line2D
+    fig, (ax_stairs, ax_time) = plt.subplots(2, 1, num="staircase monitor", figsize=(7, 6),
+                                            gridspec_kw={"height_ratios": [2, 1]})
+    ax_stairs.set(xlabel="Trial", ylabel="Dependent variable", title="Staircase")
+    ax_time.set(xlabel="Trial", ylabel="Time (s)")
+    artists = {"intensity": Line2D([], [], color="C0"),
+               "correct": Line2D([], [], ls="", marker="o", color="green"),
+               "incorrect": Line2D([], [], ls="", marker="o", color="red"),
+               "reversal": Line2D([], [], ls="", marker="x", ms=10, color="black"),
+               "next": Line2D([], [], ls="", marker="o", color="grey"),
+               "threshold": Line2D([], [], color="red"),
+               "rt": Line2D([], [], marker=".", color="C1", label="response time"),
+               "gate_time": Line2D([], [], marker=".", color="C2", label="gate time")}
+    for name, artist in artists.items():
+        artist.set_animated(True)
+        (ax_time if name in ("rt", "gate_time") else ax_stairs).add_line(artist)
+    gate_text = ax_stairs.text(0.01, 0.97, "", transform=ax_stairs.transAxes, va="top", animated=True)
+    ax_time.legend(handles=[artists["rt"], artists["gate_time"]], loc="upper left")
+    stairs = {key: list() for key in ("trial", "intensity", "response", "reversal")}
+    timing = {key: list() for key in ("n", "rt", "gate_time")}
+    info = {"next": None, "threshold": None, "gate": ""}
+    fresh = {ax_stairs: True, ax_time: True}  # axes without data yet, their limits are set from scratch
+    plt.show(block=False)
+    fig.canvas.draw()
+    background = fig.canvas.copy_from_bbox(fig.bbox)
+    t_last_draw = 0.0
+    dirty = False
+    redraw = False
+    running = True
+    while running and plt.fignum_exists(fig.number):
+        while True:  # drain all pending updates, only the latest state is drawn
+            try:
+                message = updates.get_nowait()
+            except queue.Empty:
+                break
+            if message is None:
+                running = False
+                break
+            kind, content = message
+            dirty = True
+            if kind == "reset":
+                for values in stairs.values():
+                    values.clear()
+                info["next"], info["threshold"] = None, None
+                fresh[ax_stairs] = True
+                redraw = True  # the title is part of the background
+                ax_stairs.set_title(content or "Staircase")
+                continue
+            if content.get("intensity") is not None:
+                stairs["trial"].append(content.get("trial", len(stairs["trial"])))
+                stairs["intensity"].append(content["intensity"])
+                stairs["response"].append(bool(content.get("response")))
+                stairs["reversal"].append(bool(content.get("reversal")))
+            info["next"] = content.get("next_intensity", info["next"])
+            info["threshold"] = content.get("threshold", info["threshold"])
+            if "rt" in content or "gate_time" in content:
+                timing["n"].append(len(timing["n"]))
+                timing["rt"].append(content["rt"] / 1000 if content.get("rt") is not None else np.nan)
+                timing["gate_time"].append(content.get("gate_time", np.nan))
+            if "gate_deviation" in content or "gate_open" in content:
+                deviation = content.get("gate_deviation")
+                info["gate"] = f"gate {'open' if content.get('gate_open', True) else 'timed out'}" + \
+                    (f", deviation {deviation:.1f}°" if deviation is not None else "")
+        if dirty and time.perf_counter() - t_last_draw >= 1 / max_fps:
+            x, y = np.array(stairs["trial"]), np.array(stairs["intensity"])
+            responses, reversals = np.array(stairs["response"], dtype=bool), np.array(stairs["reversal"], dtype=bool)
+            artists["intensity"].set_data(x, y)
+            artists["correct"].set_data(x[responses] if len(x) else [], y[responses] if len(y) else [])
+            artists["incorrect"].set_data(x[~responses] if len(x) else [], y[~responses] if len(y) else [])
+            artists["reversal"].set_data(x[reversals] if len(x) else [], y[reversals] if len(y) else [])
+            next_x = x[-1] + 1 if len(x) else 0
+            artists["next"].set_data([next_x] if info["next"] is not None else [],
+                                     [info["next"]] if info["next"] is not None else [])
+            artists["threshold"].set_data([x.min(), x.max()] if info["threshold"] is not None and len(x) else [],
+                                          [info["threshold"]] * 2 if info["threshold"] is not None and len(x) else [])
+            artists["rt"].set_data(timing["n"], timing["rt"])
+            artists["gate_time"].set_data(timing["n"], timing["gate_time"])
+            gate_text.set_text(info["gate"])
+            changed, redraw = redraw, False
+            next_y = np.nan if info["next"] is None else info["next"]
+            for axis, axis_x, axis_y in ((ax_stairs, np.append(x, next_x), np.append(y, next_y)),
+                                         (ax_time, timing["n"] * 2, timing["rt"] + timing["gate_time"])):
+                if _update_limits(axis, axis_x, axis_y, fresh[axis]):
+                    changed, fresh[axis] = True, False
+            if changed:
+                fig.canvas.draw()  # axes changed, redraw the static parts once
+                background = fig.canvas.copy_from_bbox(fig.bbox)
+            fig.canvas.restore_region(background)
+            for artist in list(artists.values()) + [gate_text]:
+                artist.axes.draw_artist(artist)
+            fig.canvas.blit(fig.bbox)
+            t_last_draw = time.perf_counter()
+            dirty = False
+        fig.canvas.flush_events()
+        fig.canvas.start_event_loop(0.02)  # keeps the window responsive while waiting for updates
+    plt.close(fig)
+
+
+def _update_limits(axis, x, y, fresh=False):
+    """
+    Extends the axis limits in steps if the data leaves them, so the background rarely has to be redrawn. Fresh axes
+    get limits fitted to the data. Returns whether the limits changed.
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    finite = np.isfinite(x) & np.isfinite(y)
+    x, y = x[finite], y[finite]
+    if not len(x):
+        return False
+    xlim, ylim = axis.get_xlim(), axis.get_ylim()
+    margin = max(1.0, 0.1 * (y.max() - y.min()))
+    if fresh or x.max() >= xlim[1] or x.min() < xlim[0]:
+        new_xlim = (x.min() if fresh else min(xlim[0], x.min()), (x.max() + 15) // 10 * 10)
+    else:
+        new_xlim = xlim
+    if fresh:
+        new_ylim = (y.min() - margin, y.max() + margin)
+    elif y.max() > ylim[1] or y.min() < ylim[0]:
+        new_ylim = (min(ylim[0], y.min() - margin), max(ylim[1], y.max() + margin))
+    else:
+        new_ylim = ylim
+    if new_xlim == axis.get_xlim() and new_ylim == axis.get_ylim():
+        return False
+    axis.set_xlim(new_xlim)
+    axis.set_ylim(new_ylim)
+    return True
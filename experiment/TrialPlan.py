@@ -0,0 +1,187 @@
+import json
+import pathlib
+import logging
+import numpy as np
+import pandas as pd
+import slab
+
+log = logging.getLogger(__name__)
+
+
+class TrialPlan:
+    """
+    Pre-generated content of every trial of a session, drawn from one seed before the session starts. Each column is
+    a numpy array with one row per trial. Columns with several entries per trial (e.g. the speakers of a NumJudge
+    trial) are 2D and padded with -1. Entries are indices into the speakers, sounds or labels of the experiment, so the
+    plan stays small and the runtime only looks them up. The same seed and config give the same plan, so the exact
+    composition of every trial can be regenerated in the analysis.
+    """
+
+    def __init__(self, paradigm, seed, sequence, columns, labels=None):
+        """
+        Args:
+            paradigm: name of the experiment.
+            seed: seed the plan was drawn from.
+            sequence: slab.Trialsequence the experiment walks through, not started yet.
+            columns: dict of column name and numpy array with one row per trial.
+            labels: dict of column name and list of the ids the indices of the column refer to.
+        """
+        self.paradigm = paradigm
+        self.seed = seed
+        self.sequence = sequence
+        self.columns = columns
+        self.labels = labels or dict()
+
+    def __len__(self):
+        return len(next(iter(self.columns.values())))
+
+    def trial(self, n):
+        """
+        Content of trial n, lists for 2D columns.
+        """
+        row = dict()
+        for name, column in self.columns.items():
+            value = column[n]
+            row[name] = value[value >= 0].tolist() if column.ndim == 2 else value.item()
+        return row
+
+    def label(self, name, n):
+        """
+        Ids the column refers to in trial n, e.g. the talker ids.
+        """
+        value = self.trial(n)[name]
+        return [self.labels[name][i] for i in value] if isinstance(value, list) else self.labels[name][value]
+
+    def to_dataframe(self):
+        return pd.DataFrame({name: list(column) if column.ndim == 2 else column for name, column in
+                             self.columns.items()})
+
+    def save(self, path):
+        """
+        Writes the plan to a numpy .npz file.
+        """
+        meta = {"paradigm": self.paradigm, "seed": self.seed, "labels": self.labels,
+                "conditions": self.sequence.conditions, "trials": self.sequence.trials, "kind": self.sequence.kind}
+        np.savez_compressed(path, _meta=json.dumps(meta), **self.columns)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as file:
+            meta = json.loads(str(file["_meta"]))
+            columns = {name: file[name] for name in file.files if name != "_meta"}
+        sequence = _sequence(meta["conditions"], meta["trials"], meta["kind"])
+        return cls(meta["paradigm"], meta["seed"], sequence, columns, meta["labels"])
+
+
+def new_seed():
+    """
+    Random seed for a new plan, log it or write it to the results to regenerate the plan.
+    """
+    return int(np.random.SeedSequence().entropy % 2 ** 32)
+
+
+def _sequence(conditions, trials, kind):
+    sequence = _seeded_sequence(0, conditions=list(conditions), n_reps=1, kind="random_permutation")
+    sequence.trials = list(trials)  # trials are indices into conditions, starting at 1
+    sequence.n_reps = len(sequence.trials) // len(sequence.conditions)
+    sequence.n_trials = sequence.n_remaining = len(sequence.trials)
+    sequence.data = [[] for _ in sequence.trials]
+    sequence.kind = kind
+    return sequence
+
+
+def _seeded_sequence(seed, conditions, n_reps, kind=None):
+    # slab draws the order from the global numpy generator, seed it for this call only
+    state = np.random.get_state()
+    np.random.seed(seed)
+    try:
+        return slab.Trialsequence(conditions=conditions, n_reps=n_reps, kind=kind)
+    finally:
+        np.random.set_state(state)
+
+
+def _samples_without_replacement(rng, n_rows, n_items, counts):
+    """
+    One row per trial with counts[i] distinct indices out of n_items, padded with -1.
+    """
+    counts = np.asarray(counts)
+    idx = np.argsort(rng.random((n_rows, n_items)), axis=1)[:, :counts.max()]
+    idx[np.arange(counts.max()) >= counts[:, None]] = -1
+    return idx.astype(np.int16)
+
+
+def plan_numerosity_judgement(seed, conditions, trial_number, n_speakers, talkers, n_countries=13):
+    """
+    Plan of a NumJudge session: the sequence of talker numbers and, per trial, the speakers, talkers and country
+    recordings.
+
+    Args:
+        seed: seed of the plan.
+        conditions: numbers of simultaneous talkers.
+        trial_number: repetitions of each condition.
+        n_speakers: number of speakers of the plane.
+        talkers: talker ids, keys of NumerosityJudgementExperiment.signals.
+        n_countries: number of country recordings per talker.
+    """
+    rng = np.random.default_rng(seed)
+    sequence = _seeded_sequence(seed, conditions=list(conditions), n_reps=trial_number)
+    counts = np.asarray(sequence.conditions)[np.asarray(sequence.trials) - 1]
+    columns = {"n_talkers": counts.astype(np.int16),
+               "speakers": _samples_without_replacement(rng, len(counts), n_speakers, counts),
+               "talkers": _samples_without_replacement(rng, len(counts), len(talkers), counts),
+               "countries": _samples_without_replacement(rng, len(counts), n_countries, counts)}
+    return TrialPlan("NumJudge", seed, sequence, columns, labels={"talkers": list(talkers)})
+
+
+def plan_spatial_unmasking(seed, n_conditions, max_trials, talkers, maskers, n_target_sounds=8, excluded_maskers=None):
+    """
+    Plan of a SpatMask session: the talker of the session, the order of the masker positions and, per trial, the
+    target number and masker recording. The target level is chosen by the staircase during the session, so rows are
+    indexed by the trial number of the session up to max_trials.
+
+    Args:
+        seed: seed of the plan.
+        n_conditions: number of masker positions.
+        max_trials: upper bound of the number of trials.
+        talkers: candidate target talker ids.
+        maskers: ids of the masker recordings, keys of SpatialUnmaskingExperiment.maskers.
+        n_target_sounds: number of target recordings per talker.
+        excluded_maskers: dict of talker id and the masker ids that must not be played with that talker, e.g. the
+            recordings of the talker itself. The maskers are drawn from the rest.
+    """
+    rng = np.random.default_rng(seed)
+    sequence = _seeded_sequence(seed, conditions=n_conditions, n_reps=1, kind="random_permutation")
+    talker = rng.integers(len(talkers))
+    target_sound = rng.integers(n_target_sounds, size=max_trials).astype(np.int16)
+    if excluded_maskers is None:
+        masker_sound = rng.integers(len(maskers), size=max_trials)
+    else:
+        excluded = set(excluded_maskers.get(talkers[talker], ()))
+        allowed = [i for i, masker in enumerate(maskers) if masker not in excluded]
+        if not allowed:
+            raise ValueError(f"All maskers are excluded for talker {talkers[talker]}")
+        masker_sound = rng.choice(allowed, size=max_trials)
+    columns = {"talker": np.full(max_trials, talker, dtype=np.int16),
+               "target_sound": target_sound,
+               "masker_sound": masker_sound.astype(np.int16)}
+    return TrialPlan("SpatMask", seed, sequence, columns, labels={"talker": list(talkers),
+                                                                  "masker_sound": list(maskers)})
+
+
+def plan_localization_accuracy(seed, conditions, trial_number, n_signals):
+    """
+    Plan of a LocaAccu session: the sequence of target speakers and, per trial, the stimulus.
+    """
+    rng = np.random.default_rng(seed)
+    sequence = _seeded_sequence(seed, conditions=conditions, n_reps=trial_number)
+    columns = {"speaker": (np.asarray(sequence.trials) - 1).astype(np.int16),
+               "signal": rng.integers(n_signals, size=sequence.n_trials).astype(np.int16)}
+    return TrialPlan("LocaAccu", seed, sequence, columns)
+
+
+def plan_path(results_path):
+    """
+    File the plan is saved to, next to the results file.
+    """
+    results_path = pathlib.Path(results_path)
+    return results_path.with_name(results_path.stem + "_plan.npz")
@@ -5,6 +5,8 @@ from labplatform.config import get_config
 from experiment.RP2 import RP2Device
 from experiment.RX8 import RX8Device
 from experiment.Camera import ArUcoCam
+from experiment.HeadposeGate import HeadposeGate
+from experiment.StaircaseMonitor import StaircaseMonitor
 from Speakers.speaker_config import SpeakerArray
 import os
 from traits.api import List, Str, Int, Dict, Float, Any, Bool
@@ -61,6 +63,9 @@ class SpatialUnmaskingExperiment_exmp(ExperimentLogic):
     response = Int()
     is_correct = Bool()
     rt = Any()
+    headpose_gate = Any()
+    gate_time = Float()
+    monitor = Any()
 
     def _devices_default(self):
         rp2 = RP2Device()
@@ -70,6 +75,12 @@ class SpatialUnmaskingExperiment_exmp(ExperimentLogic):
                 "RX8": rx8,
                 "ArUcoCam": cam}
 
+    def _headpose_gate_default(self):
+        return HeadposeGate(threshold=12.5)
+
+    def _monitor_default(self):
+        return StaircaseMonitor(max_fps=10)
+
     def _initialize(self, **kwargs):
         self.devices["RX8"].handle.write("playbuflen",
                                          self.setting.stim_duration * self.devices["RX8"].setting.sampling_freq,
@@ -82,7 +93,8 @@ class SpatialUnmaskingExperiment_exmp(ExperimentLogic):
         pass
 
     def _stop(self, **kwargs):
-        self.stairs.close_plot()
+        self.monitor.close()
+        self.results.flush()
 
     def setup_experiment(self, info=None):
         self.load_speakers()
@@ -114,7 +126,6 @@ class SpatialUnmaskingExperiment_exmp(ExperimentLogic):
         if self.stairs.finished:
             self.threshold = self.stairs.threshold()
             self.results.write(self.threshold, "threshold")
-            self.stairs.close_plot()
             self.devices["RX8"].clear_channels(n_channels=5, proc=["RX81", "RX82"])
             self.stairs = slab.Staircase(start_val=70,
                                          n_reversals=2,
@@ -128,6 +139,7 @@ class SpatialUnmaskingExperiment_exmp(ExperimentLogic):
             self.devices["RX8"].wait_to_finish_playing()
             self.devices["RX8"].clear_buffers(n_buffers=1, proc="RX81")
             self.sequence.__next__()
+            self.monitor.reset(title=f"Staircase {self.sequence.this_n + 1} of {self.sequence.n_conditions}")
             time.sleep(1.0)
         self.masker_speaker = self.speakers[self.sequence.this_trial - 1]
         self.masker_sound_id = random.sample(self.potential_maskers.keys(), 1)[0]
@@ -186,7 +198,9 @@ class SpatialUnmaskingExperiment_exmp(ExperimentLogic):
         # self._tosave_para["solution"] = solution
         self.is_correct = True if self.solution == self.response else False
         self.stairs.add_response(1) if self.response == self.solution else self.stairs.add_response(0)
-        self.stairs.plot()
+        self.monitor.update_from_staircase(self.stairs, rt=self.rt, gate_time=self.gate_time,
+                                           gate_deviation=self.headpose_gate.deviation,
+                                           gate_open=self.headpose_gate.is_open)  # rendered in the monitor process
         # print(response)
         # print(solution)
 
@@ -205,11 +219,12 @@ class SpatialUnmaskingExperiment_exmp(ExperimentLogic):
             self.devices["RX8"].handle.write("chan0", 1, procs="RX81")
             self.devices["RX8"].handle.trigger("zBusA", proc=self.devices["RX8"].handle)
             self.devices["RX8"].wait_to_finish_playing()
-        self.results.write(np.ndarray.tolist(np.array(self.devices["ArUcoCam"].pose)), "headpose")
+        self.results.write(np.array(self.devices["ArUcoCam"].pose), "headpose")
         self.results.write(self.response, "response")
         self.results.write(self.solution, "solution")
         self.results.write(self.rt, "rt")
         self.results.write(self.is_correct, "is_correct")
+        self.results.commit()  # hand the records of this trial to the writer thread
 
     def load_signals(self, target_sounds_type="tts-numbers_n13_resamp_48828"):
         sound_root = get_config(setting="SOUND_ROOT")
@@ -292,25 +307,15 @@ class SpatialUnmaskingExperiment_exmp(ExperimentLogic):
         log.info('Calibration complete!')
 
     def check_headpose(self):
-        while True:
-            #self.devices["ArUcoCam"].configure()
-            self.devices["ArUcoCam"].retrieve()
-            # self.devices["ArUcoCam"].pause()
-            try:
-                if np.sqrt(np.mean(np.array(self.devices["ArUcoCam"].pose) ** 2)) > 12.5:
-                    log.info("Subject is not looking straight ahead")
-                    self.devices["RX8"].clear_channels(n_channels=2, proc=["RX81", "RX82"])
-                    self.devices["RX8"].handle.write("data0", self.off_center.data.flatten(), procs="RX81")
-                    self.devices["RX8"].handle.write("chan0", 1, procs="RX81")
-                    #self.devices["RX8"].start()
-                    #self.devices["RX8"].pause()
-                    self.devices["RX8"].handle.trigger("zBusA", proc=self.devices["RX8"].handle)
-                    self.devices["RX8"].wait_to_finish_playing()
-                else:
-                    break
-            except TypeError:
-                log.info("Cannot detect markers, make sure cameras are set up correctly and arucomarkers can be detected.")
-                continue
+        self.gate_time = self.headpose_gate.wait(self.devices["ArUcoCam"], cue=self.play_off_center_cue)
+        log.info(f"Head pose gate open after {round(self.gate_time, 3)} s")
+
+    def play_off_center_cue(self):
+        self.devices["RX8"].clear_channels(n_channels=2, proc=["RX81", "RX82"])
+        self.devices["RX8"].handle.write("data0", self.off_center.data.flatten(), procs="RX81")
+        self.devices["RX8"].handle.write("chan0", 1, procs="RX81")
+        self.devices["RX8"].handle.trigger("zBusA", proc=self.devices["RX8"].handle)
+        self.devices["RX8"].wait_to_finish_playing()
 
 class NumerosityJudgementSetting(ExperimentSetting):
 
@@ -344,6 +349,8 @@ class NumerosityJudgementExperiment_exmp(ExperimentLogic):
     solution = Any()
     rt = Any()
     is_correct = Bool()
+    headpose_gate = Any()
+    gate_time = Float()
 
     def _devices_default(self):
         rp2 = RP2Device()
@@ -353,6 +360,9 @@ class NumerosityJudgementExperiment_exmp(ExperimentLogic):
                 "RX8": rx8,
                 "ArUcoCam": cam}
 
+    def _headpose_gate_default(self):
+        return HeadposeGate(threshold=12.5)
+
     def _initialize(self, **kwargs):
         self.devices["RX8"].handle.write("playbuflen",
                                          self.setting.stim_duration * self.devices["RX8"].setting.sampling_freq,
@@ -366,7 +376,7 @@ class NumerosityJudgementExperiment_exmp(ExperimentLogic):
         pass
 
     def _stop(self, **kwargs):
-        pass
+        self.results.flush()
 
     def setup_experiment(self, info=None):
         self.results.write(self.sequence, "sequence")
@@ -433,9 +443,10 @@ class NumerosityJudgementExperiment_exmp(ExperimentLogic):
         self.results.write(self.solution, "solution")
         self.results.write(self.rt, "rt")
         self.results.write(self.is_correct, "is_correct")
-        self.results.write(np.ndarray.tolist(np.array(self.devices["ArUcoCam"].pose)), "headpose")
+        self.results.write(np.array(self.devices["ArUcoCam"].pose), "headpose")
         self.results.write([x.id for x in self.speakers_sample], "speakers_sample")
         self.results.write([x for x in self.signals_sample.keys()], "signals_sample")
+        self.results.commit()  # hand the records of this trial to the writer thread
 
     def load_signals(self, sound_type="tts-countries_n13_resamp_48828"):
         sound_root = get_config(setting="SOUND_ROOT")
@@ -507,25 +518,15 @@ class NumerosityJudgementExperiment_exmp(ExperimentLogic):
         log.info('Calibration complete!')
 
     def check_headpose(self):
-        while True:
-            #self.devices["ArUcoCam"].configure()
-            self.devices["ArUcoCam"].retrieve()
-            # self.devices["ArUcoCam"].pause()
-            try:
-                if np.sqrt(np.mean(np.array(self.devices["ArUcoCam"].pose) ** 2)) > 12.5:
-                    log.info("Subject is not looking straight ahead")
-                    self.devices["RX8"].clear_channels(n_channels=1, proc=["RX81", "RX82"])
-                    self.devices["RX8"].handle.write("data0", self.off_center.data.flatten(), procs="RX81")
-                    self.devices["RX8"].handle.write("chan0", 1, procs="RX81")
-                    #self.devices["RX8"].start()
-                    #self.devices["RX8"].pause()
-                    self.devices["RX8"].handle.trigger("zBusA", proc=self.devices["RX8"].handle)
-                    self.devices["RX8"].wait_to_finish_playing()
-                else:
-                    break
-            except TypeError:
-                log.info("Cannot detect markers, make sure cameras are set up correctly and arucomarkers can be detected.")
-                continue
+        self.gate_time = self.headpose_gate.wait(self.devices["ArUcoCam"], cue=self.play_off_center_cue)
+        log.info(f"Head pose gate open after {round(self.gate_time, 3)} s")
+
+    def play_off_center_cue(self):
+        self.devices["RX8"].clear_channels(n_channels=1, proc=["RX81", "RX82"])
+        self.devices["RX8"].handle.write("data0", self.off_center.data.flatten(), procs="RX81")
+        self.devices["RX8"].handle.write("chan0", 1, procs="RX81")
+        self.devices["RX8"].handle.trigger("zBusA", proc=self.devices["RX8"].handle)
+        self.devices["RX8"].wait_to_finish_playing()
 
 
 class LocalizationAccuracySetting(ExperimentSetting):
@@ -576,6 +577,8 @@ class LocalizationAccuracyExperiment_exmp(ExperimentLogic):
     accuracy = Any()
     rt = Any()
     solution = Any()
+    headpose_gate = Any()
+    gate_time = Float()
 
     def _devices_default(self):
         rp2 = RP2Device()
@@ -585,6 +588,9 @@ class LocalizationAccuracyExperiment_exmp(ExperimentLogic):
                 "RX8": rx8,
                 "ArUcoCam": cam}
 
+    def _headpose_gate_default(self):
+        return HeadposeGate(threshold=12.5)
+
     def _initialize(self, **kwargs):
         self.devices["RX8"].handle.write("playbuflen",
                                          self.setting.stim_duration * self.devices["RX8"].setting.sampling_freq,
@@ -598,6 +604,7 @@ class LocalizationAccuracyExperiment_exmp(ExperimentLogic):
 
     def _stop(self, **kwargs):
         log.info(f"Final mean error - azimuth: {np.mean(np.array(self.error)[:, 0])}, elevation: {np.mean(np.array(self.error)[:, 1])}")
+        self.results.flush()
 
     def setup_experiment(self, info=None):
         self.results.write(self.sequence, "sequence")
@@ -687,6 +694,7 @@ class LocalizationAccuracyExperiment_exmp(ExperimentLogic):
         self.results.write(self.accuracy, "accuracy")
         self.results.write(self.rt, "rt")
         self.results.write(self.target.id, "target_spk_id")
+        self.results.commit()  # hand the records of this trial to the writer thread
 
     def load_babble(self, sound_type="babble-numbers-reversed-n13-shifted_resamp_48828"):
         sound_root = get_config(setting="SOUND_ROOT")
@@ -750,22 +758,12 @@ class LocalizationAccuracyExperiment_exmp(ExperimentLogic):
         log.info('Calibration complete!')
 
     def check_headpose(self):
-        while True:
-            #self.devices["ArUcoCam"].configure()
-            self.devices["ArUcoCam"].retrieve()
-            # self.devices["ArUcoCam"].pause()
-            try:
-                if np.sqrt(np.mean(np.array(self.devices["ArUcoCam"].pose) ** 2)) > 12.5:
-                    log.info("Subject is not looking straight ahead")
-                    self.devices["RX8"].clear_channels(n_channels=1, proc=["RX81", "RX82"])
-                    self.devices["RX8"].handle.write("data0", self.off_center.data.flatten(), procs="RX81")
-                    self.devices["RX8"].handle.write("chan0", 1, procs="RX81")
-                    #self.devices["RX8"].start()
-                    #self.devices["RX8"].pause()
-                    self.devices["RX8"].handle.trigger("zBusA", proc=self.devices["RX8"].handle)
-                    self.devices["RX8"].wait_to_finish_playing()
-                else:
-                    break
-            except TypeError:
-                log.info("Cannot detect markers, make sure cameras are set up correctly and arucomarkers can be detected.")
-                continue
\ No newline at end of file
+        self.gate_time = self.headpose_gate.wait(self.devices["ArUcoCam"], cue=self.play_off_center_cue)
+        log.info(f"Head pose gate open after {round(self.gate_time, 3)} s")
+
+    def play_off_center_cue(self):
+        self.devices["RX8"].clear_channels(n_channels=1, proc=["RX81", "RX82"])
+        self.devices["RX8"].handle.write("data0", self.off_center.data.flatten(), procs="RX81")
+        self.devices["RX8"].handle.write("chan0", 1, procs="RX81")
+        self.devices["RX8"].handle.trigger("zBusA", proc=self.devices["RX8"].handle)
+        self.devices["RX8"].wait_to_finish_playing()
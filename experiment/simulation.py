@@ -0,0 +1,593 @@
+"""
+Headless simulation of complete sessions of the NumJudge, SpatMask and LocaAccu paradigms. The experiment classes run
+their own setup_experiment, _prepare_trial, _start_trial and _stop_trial methods, but the RX8, RP2 and ArUcoCam are
+replaced by stand-ins and the responses come from simulated observers. Waiting (time.sleep, playback, button presses)
+advances a virtual clock instead of real time, so a session takes seconds while reaction times, head pose gate times
+and session durations keep their protocol values. Sessions are spread over a process pool and aggregated into one
+table. Loading the paradigm modules still needs the labplatform config, the sound files and the speaker tables.
+
+The trials are driven by StandInStateMachine, which reproduces the state transitions of labplatform's ExperimentLogic
+the paradigms rely on, including a stop requested after a trial was prepared. It counts the prepared and the run
+trials, so check_last_trial shows whether the last trial of a session is run.
+"""
+import os
+import tempfile
+import pathlib
+import copy
+import time
+import random
+import logging
+import importlib
+import multiprocessing
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+PARADIGMS = {"NumJudge": ("experiment.Numerosity_Judgement", "NumerosityJudgementExperiment"),
+             "SpatMask": ("experiment.Spatial_Unmasking", "SpatialUnmaskingExperiment"),
+             "LocaAccu": ("experiment.Localization_Accuracy", "LocalizationAccuracyExperiment")}
+
+
+class VirtualClock:
+    """
+    Replaces time.time, time.perf_counter and time.sleep of the current process. Sleeping advances the clock
+    immediately, so all timing in the experiment code runs in simulated time.
+    """
+
+    def __init__(self):
+        self.offset = 0.0
+        self._originals = None
+
+    def install(self):
+        if self._originals is not None:
+            return
+        self._originals = time.time, time.perf_counter, time.sleep
+        real_time, real_perf_counter = self._originals[:2]
+        time.time = lambda: real_time() + self.offset
+        time.perf_counter = lambda: real_perf_counter() + self.offset
+        time.sleep = self.advance
+
+    def uninstall(self):
+        if self._originals is None:
+            return
+        time.time, time.perf_counter, time.sleep = self._originals
+        self._originals = None
+
+    def advance(self, seconds):
+        self.offset += max(0.0, seconds)
+
+
+clock = VirtualClock()
+
+
+class NumerosityObserver:
+    """
+    Judges the number of talkers as the true number scaled by bias plus gaussian noise proportional to the number
+    (scalar variability), rounded and clipped to the response range (by default the conditions of the paradigm).
+    """
+
+    def __init__(self, weber_fraction=0.15, bias=1.0, response_range=None, rt_mean=1.5, rt_sd=0.4):
+        self.weber_fraction = weber_fraction
+        self.bias = bias
+        self.response_range = response_range
+        self.rt_mean = rt_mean
+        self.rt_sd = rt_sd
+
+    def respond(self, exp, rng):
+        n = exp.solution
+        estimate = rng.normal(n * self.bias, self.weber_fraction * n)
+        response_range = self.response_range or (min(exp.setting.conditions), max(exp.setting.conditions))
+        return int(np.clip(np.round(estimate), *response_range)), None
+
+    def params(self):
+        return {"weber_fraction": self.weber_fraction, "bias": self.bias}
+
+
+class SpatialUnmaskingObserver:
+    """
+    Identifies the target number with a logistic psychometric function of the staircase level. The threshold drops
+    with the angular separation of masker and target (spatial release from masking) up to max_release.
+    """
+
+    def __init__(self, threshold=-5.0, slope=2.0, release_per_degree=0.3, max_release=10.0, lapse=0.02,
+                 n_alternatives=8, rt_mean=1.2, rt_sd=0.3):
+        self.threshold = threshold
+        self.slope = slope
+        self.release_per_degree = release_per_degree
+        self.max_release = max_release
+        self.lapse = lapse
+        self.n_alternatives = n_alternatives
+        self.rt_mean = rt_mean
+        self.rt_sd = rt_sd
+
+    def p_correct(self, level, separation):
+        threshold = self.threshold - min(self.max_release, self.release_per_degree * separation)
+        guess = 1 / self.n_alternatives
+        return guess + (1 - guess - self.lapse) / (1 + np.exp(-(level - threshold) / self.slope))
+
+    def respond(self, exp, rng):
+        level = exp.stairs.intensities[-1]
+        target, masker = exp.target_speaker, exp.masker_speaker
+        separation = np.hypot(target.azimuth - masker.azimuth, target.elevation - masker.elevation)
+        if rng.random() < self.p_correct(level, separation):
+            return exp.solution, None
+        alternatives = [n for n in (1, 2, 3, 4, 5, 6, 8, 9) if n != exp.solution]
+        return int(rng.choice(alternatives)), None
+
+    def params(self):
+        return {"threshold": self.threshold, "slope": self.slope, "release_per_degree": self.release_per_degree}
+
+
+class LocalizationObserver:
+    """
+    Points the head at the target with a gain (compression towards the midline), a constant bias and gaussian noise,
+    separately for azimuth and elevation. Every second button press returns the head to the center.
+    """
+
+    def __init__(self, gain=(1.0, 0.8), bias=(0.0, 0.0), noise=(4.0, 8.0), rt_mean=2.0, rt_sd=0.5):
+        self.gain = np.asarray(gain, dtype=float)
+        self.bias = np.asarray(bias, dtype=float)
+        self.noise = np.asarray(noise, dtype=float)
+        self.rt_mean = rt_mean
+        self.rt_sd = rt_sd
+        self._pointing = False
+
+    def respond(self, exp, rng):
+        self._pointing = not self._pointing
+        if not self._pointing:
+            return 0, None  # back to the center
+        target = np.array([exp.target.azimuth, exp.target.elevation], dtype=float)
+        return 0, list(target * self.gain + self.bias + rng.normal(0, self.noise))
+
+    def params(self):
+        return {"gain_azi": self.gain[0], "gain_ele": self.gain[1], "noise_azi": self.noise[0],
+                "noise_ele": self.noise[1]}
+
+
+OBSERVERS = {"NumJudge": NumerosityObserver, "SpatMask": SpatialUnmaskingObserver, "LocaAccu": LocalizationObserver}
+
+
+class _Setting:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class _Handle:
+    """
+    Stand-in for the TDT processors handle. Stores written tags and plays the written buffers in virtual time.
+    """
+
+    def __init__(self, sampling_freq):
+        self.sampling_freq = sampling_freq
+        self.procs = {"RX81": None, "RX82": None}
+        self.tags = dict()
+        self._pending = 0  # longest buffer written since the last trigger, in samples
+
+    def write(self, tag, value, procs=None):
+        if isinstance(procs, dict):  # the processors of a device handle, e.g. {"RX81": ..., "RX82": ...}
+            procs = list(procs)
+        procs = procs if isinstance(procs, (list, tuple)) else [procs]
+        for proc in procs:
+            self.tags[(proc, tag)] = value
+        if tag.startswith("data") and np.ndim(value):
+            self._pending = max(self._pending, len(value))
+
+    def read(self, tag, proc=None, n_samples=None):
+        value = self.tags.get((proc, tag), 0)
+        return value[:n_samples] if n_samples and np.ndim(value) else value
+
+    def trigger(self, trig, proc=None):
+        time.sleep(self._pending / self.sampling_freq)  # plays in virtual time
+        self._pending = 0
+
+    def GetTagVal(self, tag):
+        return 0
+
+    def halt(self):
+        pass
+
+    Halt = halt
+
+
+class _StandInDevice:
+    def initialize(self, **kwargs):
+        pass
+
+    def configure(self, **kwargs):
+        pass
+
+    def start(self, **kwargs):
+        pass
+
+    def pause(self, **kwargs):
+        pass
+
+    def stop(self, **kwargs):
+        pass
+
+
+class StandInRX8(_StandInDevice):
+
+    def __init__(self, sampling_freq=48828):
+        self.setting = _Setting(sampling_freq=sampling_freq)
+        self.handle = _Handle(sampling_freq)
+
+    def start(self, **kwargs):
+        self.handle.trigger("zBusA")
+
+    def wait_to_finish_playing(self, proc="all", tag="playback"):
+        pass  # trigger already advanced the clock by the playback duration
+
+    def clear_channels(self, n_channels, proc):
+        for idx in range(n_channels):
+            self.handle.write(f"chan{idx}", 99, procs=proc)
+
+    def clear_buffers(self, n_buffers, proc, buffer_length=48828):
+        for idx in range(n_buffers):
+            self.handle.write(f"data{idx}", np.zeros(buffer_length), procs=proc)
+        self.handle._pending = 0
+
+
+class StandInRP2(_StandInDevice):
+    """
+    Button box whose presses come from the observer after a lognormal reaction time.
+    """
+
+    def __init__(self, exp, observer, cam, rng):
+        self.exp = exp
+        self.observer = observer
+        self.cam = cam
+        self.rng = rng
+        self.response = 0
+        self.button_press_count = 0
+
+    def wait_for_button(self):
+        sigma = np.sqrt(np.log(1 + (self.observer.rt_sd / self.observer.rt_mean) ** 2))
+        mu = np.log(self.observer.rt_mean) - sigma ** 2 / 2
+        time.sleep(self.rng.lognormal(mu, sigma))
+        self.response, self.cam.pointing = self.observer.respond(self.exp, self.rng)
+        self.button_press_count += 1
+
+    def get_response(self):
+        return self.response
+
+
+class StandInCam(_StandInDevice):
+    """
+    Head pose source: straight ahead with gaussian jitter, or the direction the observer points to.
+    """
+
+    def __init__(self, rng, jitter=2.0):
+        self.rng = rng
+        self.jitter = jitter
+        self.pointing = None
+        self.pose = [0.0, 0.0]
+        self.offset = [0.0, 0.0]
+        self.calibrated = True
+        self.pose_confidence = 1.0
+
+    def retrieve(self):
+        center = [0.0, 0.0] if self.pointing is None else self.pointing
+        self.pose = list(np.asarray(center) + self.rng.normal(0, self.jitter, 2))
+
+
+class SimulationResults:
+    """
+    In-memory stand-in for the results file. Every commit() closes one record (one trial).
+    """
+
+    def __init__(self):
+        self.records = list()
+        self._current = dict()
+        self.path = pathlib.Path(tempfile.gettempdir()) / f"simulation_{os.getpid()}.txt"  # trial plans go next to it
+
+    def write(self, data, tag=None):
+        if hasattr(data, "__dict__"):
+            return  # sequence and staircase objects are not needed in the table
+        if isinstance(data, np.ndarray):
+            data = data.tolist()
+        self._current[tag] = copy.deepcopy(data)
+
+    def commit(self):
+        self._current["clock"] = time.time()
+        self.records.append(self._current)
+        self._current = dict()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class StandInStateMachine:
+    """
+    Stand-in for the state machine of labplatform's ExperimentLogic, driving the trials of an experiment in this thread.
+    The transitions are those the paradigms rely on:
+
+    - start: Ready -> Running, calls setup_experiment and _start, then runs the first trial.
+    - trial: while current_trial < total_trial, _prepare_trial and, unless a stop was requested in the meantime,
+      _start_trial and _stop_trial. current_trial is incremented after _stop_trial, which is why the paradigms test
+      current_trial + 1 == total_trial there, and SpatMask ends a session by setting current_trial to total_trial.
+    - stop: Running -> Stopped, calls _stop. A stop requested while a trial is prepared (the stop button of the GUI,
+      or request_stop) takes effect before the trial starts, so that trial is prepared but not run.
+
+    Attributes:
+        n_prepared: number of trials prepared.
+        n_run: number of trials started and stopped.
+    """
+
+    def __init__(self, exp, stop_after=None):
+        """
+        Args:
+            exp: the experiment.
+            stop_after: request a stop after this many trials were prepared, None runs the session to the end.
+        """
+        self.exp = exp
+        self.stop_after = stop_after
+        self.state = "Ready"
+        self.n_prepared = 0
+        self.n_run = 0
+        self._stop_requested = False
+
+    def request_stop(self):
+        self._stop_requested = True
+
+    def start(self):
+        if self.state != "Ready":
+            raise RuntimeError(f"Cannot start the experiment in state {self.state}")
+        exp = self.exp
+        exp.setup_experiment()
+        exp.results.commit()  # session header
+        exp.setting.current_trial = 0
+        exp._start()
+        self.state = "Running"
+        while self.state == "Running":
+            if self._stop_requested or exp.setting.current_trial >= exp.setting.total_trial:
+                self.stop()
+                break
+            try:
+                exp._prepare_trial()
+            except StopIteration:
+                log.warning(f"sequence exhausted at trial {exp.setting.current_trial} of {exp.setting.total_trial}")
+                self.stop()
+                break
+            self.n_prepared += 1
+            if self.stop_after is not None and self.n_prepared >= self.stop_after:
+                self.request_stop()
+            if self._stop_requested:  # stop after prepare, the prepared trial is not run
+                self.stop()
+                break
+            exp._start_trial()
+            exp._stop_trial()
+            self.n_run += 1
+            exp.setting.current_trial += 1
+
+    def stop(self):
+        if self.state == "Stopped":
+            return
+        self.exp._stop()
+        self.state = "Stopped"
+
+
+@dataclass
+class SessionSpec:
+    """
+    One simulated session. observer defaults to the default observer of the paradigm.
+    """
+    paradigm: str
+    seed: int = 0
+    observer: object = None
+    plane: str = "v"
+    mode: str = "noise"  # LocaAccu stimulus, noise or babble
+    settings: dict = field(default_factory=dict)  # paradigm setting overrides, e.g. {"trial_number": 2}
+    stop_after: int = None  # request a stop after this many prepared trials, see StandInStateMachine
+
+
+_pristine = dict()  # class level sequence and staircase of each paradigm, before any session used them
+
+
+def _experiment_class(paradigm):
+    module, name = PARADIGMS[paradigm]
+    cls = getattr(importlib.import_module(module), name)
+    if cls not in _pristine:
+        _pristine[cls] = {key: copy.deepcopy(getattr(cls, key)) for key in ("sequence", "stairs") if
+                          hasattr(cls, key)}
+    return cls
+
+
+def _fresh_sequence(sequence):
+    import slab
+    return slab.Trialsequence(conditions=sequence.conditions, n_reps=sequence.n_reps, kind=sequence.kind)
+
+
+def run_session(spec):
+    """
+    Runs one complete session with stand-in devices.
+
+    Returns:
+        pandas DataFrame with one row per trial.
+    """
+    from labplatform.core.Subject import Subject
+    random.seed(spec.seed)
+    np.random.seed(spec.seed)
+    rng = np.random.default_rng(spec.seed)
+    observer = copy.deepcopy(spec.observer) if spec.observer is not None else OBSERVERS[spec.paradigm]()
+    cls = _experiment_class(spec.paradigm)
+    exp = cls(subject=Subject(name=f"sim_{spec.seed}", group="simulation", species="Human"),
+              experimenter="simulation")
+    defaults = {key: getattr(exp.setting, key) for key in spec.settings}  # the setting is shared by all instances
+    for key, value in spec.settings.items():
+        setattr(exp.setting, key, value)
+    try:
+        return _run_trials(exp, spec, observer, rng)
+    finally:
+        for key, value in defaults.items():
+            setattr(exp.setting, key, value)
+
+
+def _run_trials(exp, spec, observer, rng):
+    from experiment.HeadposeGate import HeadposeGate
+    from experiment.StaircaseMonitor import StaircaseMonitor
+    cls = type(exp)
+    pristine = _pristine[cls]
+    exp.sequence = _fresh_sequence(pristine["sequence"])
+    if "stairs" in pristine:
+        exp.stairs = copy.deepcopy(pristine["stairs"])
+    if hasattr(exp, "monitor"):
+        exp.monitor = StaircaseMonitor(enabled=False)
+    exp.headpose_gate = HeadposeGate(threshold=exp.headpose_gate.threshold)
+    exp.plane = spec.plane
+    if spec.paradigm == "LocaAccu":
+        exp.mode = spec.mode
+    cam = StandInCam(rng)
+    exp.devices = {"RX8": StandInRX8(), "RP2": StandInRP2(exp, observer, cam, rng), "ArUcoCam": cam}
+    exp.results = SimulationResults()
+    exp._initialize()
+    t_start = time.time()
+    machine = StandInStateMachine(exp, stop_after=spec.stop_after)
+    machine.start()
+    records = exp.results.records[1:]
+    trials = pd.DataFrame(records)
+    if not len(trials):
+        return trials
+    trials.insert(0, "trial", np.arange(len(trials)))
+    trials["trial_duration"] = np.diff(np.append(exp.results.records[0]["clock"], trials.clock.values))
+    trials["session_time"] = trials.clock - t_start
+    trials = trials.drop(columns="clock")
+    trials.insert(0, "paradigm", spec.paradigm)
+    trials.insert(1, "seed", spec.seed)
+    trials.insert(2, "plane", spec.plane)
+    for key, value in observer.params().items():
+        trials[key] = value
+    trials["n_trials_planned"] = exp.setting.total_trial
+    trials["n_trials_prepared"] = machine.n_prepared
+    trials["sequence_remaining"] = exp.sequence.n_remaining
+    return trials
+
+
+def _init_worker(level):
+    logging.getLogger().setLevel(level)
+    clock.install()
+
+
+def _run_session_safe(spec):
+    try:
+        return run_session(spec)
+    except Exception as e:
+        log.error(f"{spec.paradigm} session {spec.seed} failed: {e!r}")
+        return pd.DataFrame({"paradigm": [spec.paradigm], "seed": [spec.seed], "error": [repr(e)]})
+
+
+def simulate(specs, n_jobs=None, log_level=logging.WARNING, skip_errors=False):
+    """
+    Runs the sessions in a process pool.
+
+    Args:
+        specs: list of SessionSpec.
+        n_jobs: number of worker processes, defaults to the number of cpus. 1 runs in this process.
+        log_level: logging level inside the workers, the paradigms log every trial.
+        skip_errors: if False, the first failing session raises its exception. If True, a failing session becomes a
+            row with the error and the run only fails when every session failed.
+
+    Returns:
+        pandas DataFrame with one row per trial of all sessions.
+    """
+    run = _run_session_safe if skip_errors else run_session
+    if n_jobs == 1:
+        clock.install()
+        try:
+            tables = [run(spec) for spec in specs]
+        finally:
+            clock.uninstall()
+    else:
+        n_jobs = n_jobs or multiprocessing.cpu_count()
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(log_level,)) as pool:
+            tables = list(pool.map(run, specs, chunksize=max(1, len(specs) // (4 * n_jobs))))
+    results = pd.concat(tables, ignore_index=True)
+    if "error" in results:
+        failed = results.dropna(subset="error")
+        if len(failed) == len(specs):
+            raise RuntimeError(f"All {len(specs)} simulated sessions failed, e.g. {failed.error.iloc[0]}")
+        log.warning(f"{len(failed)} of {len(specs)} simulated sessions failed")
+    return results
+
+
+def smoke_test():
+    """
+    Runs one session of each paradigm in this process and checks that it completes with trials.
+    """
+    results = simulate([SessionSpec(paradigm) for paradigm in PARADIGMS], n_jobs=1)
+    for paradigm in PARADIGMS:
+        n_trials = (results.paradigm == paradigm).sum()
+        if not n_trials:
+            raise RuntimeError(f"The simulated {paradigm} session ran no trials")
+        log.info(f"{paradigm}: {n_trials} trials")
+    return results
+
+
+def check_last_trial(paradigm="NumJudge", seeds=range(4), stop_after=None, settings=None):
+    """
+    Runs sessions in this process and reports for each whether all planned trials were run, e.g. to check the
+    suspected skipped last trial in NumJudge.
+
+    Args:
+        paradigm: NumJudge, SpatMask or LocaAccu.
+        seeds: one session per seed.
+        stop_after: request a stop after this many prepared trials, see StandInStateMachine.
+        settings: paradigm setting overrides, e.g. {"trial_number": 2} for short sessions.
+
+    Returns:
+        pandas DataFrame with one row per session: planned, prepared and run trials, the trials left in the
+        sequence and whether the last trial was run.
+    """
+    specs = [SessionSpec(paradigm, seed=seed, stop_after=stop_after, settings=dict(settings or {})) for seed in seeds]
+    results = simulate(specs, n_jobs=1)
+    rows = list()
+    for seed, session in results.groupby("seed"):
+        n_planned = session.n_trials_planned.iloc[0]
+        rows.append({"paradigm": paradigm, "seed": seed, "n_trials_planned": n_planned,
+                     "n_trials_prepared": session.n_trials_prepared.iloc[0], "n_trials_run": len(session),
+                     "sequence_remaining": session.sequence_remaining.iloc[0],
+                     "last_trial_run": len(session) == n_planned and session.sequence_remaining.iloc[0] == 0})
+    return pd.DataFrame(rows)
+
+
+def summarize(results):
+    """
+    Session level summary: number of trials run against planned, session duration and the main outcome measure of
+    each paradigm (proportion correct, staircase threshold or mean absolute localization error).
+    """
+    rows = list()
+    for (paradigm, seed), session in results.groupby(["paradigm", "seed"]):
+        row = {"paradigm": paradigm, "seed": seed, "n_trials": len(session),
+               "n_trials_planned": session.n_trials_planned.iloc[0] if "n_trials_planned" in session else np.nan,
+               "sequence_remaining": session.sequence_remaining.iloc[0] if "sequence_remaining" in session else np.nan,
+               "duration": session.session_time.max() if "session_time" in session else np.nan,
+               "gate_time": session.gate_time.mean() if "gate_time" in session else np.nan}
+        if "is_correct" in session:
+            row["p_correct"] = session.is_correct.mean()
+        if "threshold" in session:
+            row["threshold"] = session.threshold.dropna().mean()
+        if "accuracy" in session:
+            row["abs_error_azi"], row["abs_error_ele"] = np.nanmean(np.vstack(session.accuracy.dropna()), axis=0)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    if "--smoke" in sys.argv:
+        smoke_test()
+        sys.exit()
+    if "--last-trial" in sys.argv:
+        print(check_last_trial("NumJudge"))
+        sys.exit()
+    specs = [SessionSpec(paradigm, seed=seed) for paradigm in PARADIGMS for seed in range(8)]
+    results = simulate(specs)
+    results.to_csv(os.path.join(os.getcwd(), "simulated_sessions.csv"), index=False)
+    print(summarize(results).groupby("paradigm").mean(numeric_only=True))
@@ -1,4 +1,3 @@
-import slab
 from labplatform.core.Subject import Subject
 from labplatform.config import get_config
 import os
@@ -6,6 +5,8 @@ import logging
 from experiment.Numerosity_Judgement import NumerosityJudgementExperiment
 from experiment.Spatial_Unmasking import SpatialUnmaskingExperiment
 from experiment.Localization_Accuracy import LocalizationAccuracyExperiment
+from experiment.AsyncResultsFile import AsyncResultsFile
+from experiment.SessionCheckpoint import SessionCheckpoint
 from experiment.exp_examples import LocalizationAccuracyExperiment_exmp, SpatialUnmaskingExperiment_exmp, \
     NumerosityJudgementExperiment_exmp
 
@@ -86,8 +87,43 @@ def setup_experiment():
             exp.plane = group
         else:
             log.info("Paradigm not found, aborting ...")
-    exp.results = slab.ResultsFile(subject=f"{exp.subject.name}",
+    exp.results = AsyncResultsFile(subject=f"{exp.subject.name}",
                                    filename=f"{exp.setting.experiment_name}_{group}_{cohort}")
+    if is_example == "n":
+        exp.checkpoint = SessionCheckpoint()  # file named after subject, paradigm, plane and condition
+    return exp
+
+
+def resume(subject, paradigm, plane, condition=None):
+    """
+    Continues an interrupted session from its last checkpoint. The results are appended to the results file of the
+    interrupted session, the camera offset is restored, so the camera does not have to be calibrated again. Start the
+    returned experiment with exp.start().
+    Parameters:
+        subject: subject id as entered in setup_experiment, e.g. "01" for sub_01.
+        paradigm: NumJudge, SpatMask or LocaAccu.
+        plane: v or h.
+        condition: forward or reversed for NumJudge, noise or babble for LocaAccu, None for SpatMask.
+    """
+    paradigms = {"NumJudge": NumerosityJudgementExperiment,
+                 "SpatMask": SpatialUnmaskingExperiment,
+                 "LocaAccu": LocalizationAccuracyExperiment}
+    checkpoint = SessionCheckpoint.load(SessionCheckpoint.default_path(f"sub_{subject}", paradigm, plane, condition))
+    state = checkpoint.state
+    if state["finished"]:
+        raise ValueError(f"The {paradigm} session of sub_{subject} is already complete")
+    subject = Subject(name=state["subject"], group=state["plane"], species="Human")
+    subject.read_info_from_h5file(file=os.path.join(get_config("SUBJECT_ROOT"), f"{state['subject']}.h5"))
+    subject.data_path = os.path.join(get_config("DATA_ROOT"), f"{state['subject']}.h5")
+    exp = paradigms[paradigm](subject=subject, experimenter=state["experimenter"])
+    exp.plane = state["plane"]
+    if state["mode"] is not None:
+        exp.mode = state["mode"]
+    if state.get("reversed_speech") is not None:
+        exp.reversed_speech = state["reversed_speech"]  # selects the stimuli in setup_experiment
+    exp.results = AsyncResultsFile(subject=state["subject"], path=state["results_path"])
+    exp.checkpoint = checkpoint
+    log.info(f"Resuming {paradigm} session of {state['subject']} at trial {state['trials_done']}")
     return exp
 
 
@@ -0,0 +1,249 @@
+"""
+Synthetic benchmark for the ArUco head pose pipeline. The 7x4 grid boards from generate_board.py are rendered under
+known yaw, pitch, distance, blur, noise and exposure into camera frames. Each pose backend is run over the frames and
+we report throughput, latency percentiles, detection rate and the angular error against the ground truth rotation.
+A backend is any callable backend(image, dictionary) -> (pose, info) with the same return values as
+ArUcoCam.pose_from_image, where info[i][2] holds the rotation vector of marker i.
+"""
+import time
+import itertools
+import logging
+import numpy as np
+import pandas as pd
+import cv2
+
+log = logging.getLogger(__name__)
+
+BOARD_DICTS = {"4x4": cv2.aruco.DICT_4X4_100,
+               "5x5": cv2.aruco.DICT_5X5_100}
+
+# flips the board frame (x right, y down, z into the board) into the aruco marker frame (x right, y up, z out)
+_MARKER_FLIP = np.diag([1.0, -1.0, -1.0])
+
+
+def make_board(dict_name="4x4", markers_x=7, markers_y=4, marker_length=0.015, marker_separation=0.007,
+               px_per_meter=8000, margin=40):
+    """
+    Renders a grid board like generate_board.py.
+
+    Returns:
+        board image (uint8), the aruco dictionary, the board size in meters (width, height), the pixel scale and
+        the margin in pixels.
+    """
+    aruco_dict = cv2.aruco.Dictionary_get(BOARD_DICTS[dict_name])
+    board = cv2.aruco.GridBoard_create(markersX=markers_x, markersY=markers_y, markerLength=marker_length,
+                                       markerSeparation=marker_separation, dictionary=aruco_dict)
+    size = (markers_x * marker_length + (markers_x - 1) * marker_separation,
+            markers_y * marker_length + (markers_y - 1) * marker_separation)
+    out_size = (int(round(size[0] * px_per_meter)) + 2 * margin, int(round(size[1] * px_per_meter)) + 2 * margin)
+    image = board.draw(out_size, marginSize=margin, borderBits=1)
+    return image, aruco_dict, size, px_per_meter, margin
+
+
+def rotation_from_angles(yaw, pitch):
+    """
+    Rotation of the board relative to the camera for a head turned by yaw (around the vertical axis) and pitch
+    (around the horizontal axis) in degrees.
+    """
+    yaw, pitch = np.radians(yaw), np.radians(pitch)
+    rot_y = np.array([[np.cos(yaw), 0, np.sin(yaw)],
+                      [0, 1, 0],
+                      [-np.sin(yaw), 0, np.cos(yaw)]])
+    rot_x = np.array([[1, 0, 0],
+                      [0, np.cos(pitch), -np.sin(pitch)],
+                      [0, np.sin(pitch), np.cos(pitch)]])
+    return rot_y @ rot_x
+
+
+def camera_matrix(image_shape, focal_length=None):
+    """
+    Pinhole camera matrix. Defaults to the assumption in ArUcoCam.pose_from_image (focal length = image width).
+    """
+    focal_length = focal_length or image_shape[1]
+    return np.array([[focal_length, 0, image_shape[1] / 2],
+                     [0, focal_length, image_shape[0] / 2],
+                     [0, 0, 1]], dtype="double")
+
+
+def render_frame(board, yaw=0.0, pitch=0.0, distance=0.5, blur=0.0, noise=0.0, exposure=1.0,
+                 image_shape=(1080, 1440), focal_length=None, background=128, rng=None):
+    """
+    Renders one synthetic camera frame of the board.
+
+    Args:
+        board: tuple as returned by make_board.
+        yaw, pitch: rotation of the board in degrees.
+        distance: distance of the board from the camera in meters.
+        blur: standard deviation of the gaussian blur in pixels.
+        noise: standard deviation of additive gaussian noise in gray values.
+        exposure: gain applied to the image intensities.
+        image_shape: (height, width) of the frame.
+        focal_length: focal length in pixels, see camera_matrix.
+        background: gray value outside of the board.
+        rng: numpy random Generator for the noise.
+
+    Returns:
+        frame (uint8) and the ground truth rotation matrix of the markers.
+    """
+    image, _, size, px_per_meter, margin = board
+    rotation = rotation_from_angles(yaw, pitch)
+    # board pixel -> board plane coordinates in meters, centered on the board
+    to_plane = np.array([[1 / px_per_meter, 0, -margin / px_per_meter - size[0] / 2],
+                         [0, 1 / px_per_meter, -margin / px_per_meter - size[1] / 2],
+                         [0, 0, 1]])
+    extrinsic = np.column_stack((rotation[:, 0], rotation[:, 1], [0, 0, distance]))
+    homography = camera_matrix(image_shape, focal_length) @ extrinsic @ to_plane
+    frame = cv2.warpPerspective(image, homography, (image_shape[1], image_shape[0]), flags=cv2.INTER_LINEAR,
+                                borderMode=cv2.BORDER_CONSTANT, borderValue=background)
+    frame = frame.astype(np.float32)
+    if blur > 0:
+        frame = cv2.GaussianBlur(frame, (0, 0), blur)
+    frame *= exposure
+    if noise > 0:
+        rng = rng or np.random.default_rng()
+        frame += rng.normal(0, noise, frame.shape).astype(np.float32)
+    frame = np.clip(frame, 0, 255).astype(np.uint8)
+    return frame, rotation @ _MARKER_FLIP
+
+
+def make_scenarios(yaws=(-30, -15, 0, 15, 30), pitches=(-20, 0, 20), distances=(0.5, 1.0), blurs=(0, 1.5),
+                   noises=(0, 8), exposures=(0.6, 1.0)):
+    """
+    Full factorial grid of rendering conditions.
+
+    Returns:
+        pandas DataFrame with one row per condition.
+    """
+    rows = itertools.product(yaws, pitches, distances, blurs, noises, exposures)
+    return pd.DataFrame(rows, columns=["yaw", "pitch", "distance", "blur", "noise", "exposure"])
+
+
+def generate_frames(scenarios, board=None, seed=0, **kwargs):
+    """
+    Renders one frame per scenario.
+
+    Returns:
+        list of frames and list of ground truth rotation matrices.
+    """
+    board = board or make_board()
+    rng = np.random.default_rng(seed)
+    frames, rotations = list(), list()
+    for scenario in scenarios.itertuples(index=False):
+        frame, rotation = render_frame(board, rng=rng, **scenario._asdict(), **kwargs)
+        frames.append(frame)
+        rotations.append(rotation)
+    return frames, rotations
+
+
+def angular_error(rotation_vecs, rotation):
+    """
+    Median over the detected markers of the geodesic angle in degrees between estimated and ground truth rotation.
+    """
+    errors = list()
+    for rvec in rotation_vecs:
+        estimated = cv2.Rodrigues(np.asarray(rvec, dtype=float).reshape(3, 1))[0]
+        cos = (np.trace(estimated.T @ rotation) - 1) / 2
+        errors.append(np.degrees(np.arccos(np.clip(cos, -1, 1))))
+    return float(np.median(errors))
+
+
+def run_backend(backend, frames, rotations, dictionary, warmup=3):
+    """
+    Runs one backend over all frames. Without ground truth (rotations is None) the angular error is NaN.
+
+    Returns:
+        pandas DataFrame with latency (ms), detection, the median marker angle used by ArUcoCam.get_pose and the
+        angular error per frame.
+    """
+    for frame in frames[:warmup]:
+        backend(frame, dictionary)
+    rows = list()
+    rotations = [None] * len(frames) if rotations is None else rotations
+    for frame, rotation in zip(frames, rotations):
+        t_start = time.perf_counter()
+        pose, info = backend(frame, dictionary)
+        latency = (time.perf_counter() - t_start) * 1000
+        detected = bool(pose)
+        angle = np.median(np.asarray(pose)[:, 2]) if detected else np.nan
+        error = angular_error([i[2] for i in info], rotation) if detected and rotation is not None else np.nan
+        rows.append({"latency": latency, "detected": detected, "n_markers": len(pose) if detected else 0,
+                     "angle": angle, "error": error})
+    return pd.DataFrame(rows)
+
+
+def summarize(results):
+    """
+    Summary statistics of run_backend results.
+    """
+    latency = results.latency.values
+    return pd.Series({"fps": 1000 / latency.mean(),
+                      "latency_p50": np.percentile(latency, 50),
+                      "latency_p99": np.percentile(latency, 99),
+                      "detection_rate": results.detected.mean(),
+                      "n_markers": results.n_markers.mean(),
+                      "error_median": results.error.median(),
+                      "error_p90": results.error.quantile(0.9)})
+
+
+def with_resolution(backend, resolution):
+    """
+    Wraps a backend so that frames are downscaled before detection, like ArUcoCam.get_pose(resolution=...).
+    The rescaling is part of the measured latency.
+    """
+    def scaled_backend(image, dictionary):
+        if resolution < 1.0:
+            image = cv2.resize(image, None, fx=resolution, fy=resolution, interpolation=cv2.INTER_AREA)
+        return backend(image, dictionary)
+    return scaled_backend
+
+
+def default_backends():
+    """
+    The pose backend of ArUcoCam, once with default detector parameters and once at half resolution.
+    """
+    from experiment.Camera import ArUcoCam
+    cam = ArUcoCam()
+    return {"ArUcoCam": cam.pose_from_image,
+            "ArUcoCam_half_res": with_resolution(cam.pose_from_image, 0.5)}
+
+
+def run_benchmark(backends=None, scenarios=None, dict_name="4x4", seed=0, by=None, **kwargs):
+    """
+    Renders the synthetic frames and benchmarks all backends on them.
+
+    Args:
+        backends: dict of name -> backend. Defaults to default_backends().
+        scenarios: DataFrame of rendering conditions. Defaults to make_scenarios().
+        dict_name: which board to render, "4x4" (camera 0) or "5x5" (camera 1).
+        seed: seed for the rendering noise.
+        by: optional list of scenario columns to additionally break the summary down by.
+        kwargs: passed to render_frame, e.g. image_shape or focal_length.
+
+    Returns:
+        pandas DataFrame with one summary row per backend (and condition if by is given).
+    """
+    backends = backends or default_backends()
+    scenarios = make_scenarios() if scenarios is None else scenarios
+    board = make_board(dict_name)
+    frames, rotations = generate_frames(scenarios, board=board, seed=seed, **kwargs)
+    summaries = dict()
+    for name, backend in backends.items():
+        results = pd.concat([scenarios.reset_index(drop=True), run_backend(backend, frames, rotations, board[1])],
+                            axis=1)
+        if by:
+            for condition, group in results.groupby(by):
+                condition = condition if isinstance(condition, tuple) else (condition,)
+                summaries[(name, *condition)] = summarize(group)
+        else:
+            summaries[name] = summarize(results)
+        log.info(f"Benchmarked {name}")
+    summary = pd.DataFrame(summaries).transpose()
+    summary.index.names = ["backend"] + (list(by) if by else [])
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    pd.set_option("display.width", 200)
+    print(run_benchmark())
+    print(run_benchmark(by=["blur"]))
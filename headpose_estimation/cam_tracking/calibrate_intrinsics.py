@@ -0,0 +1,205 @@
+"""
+Intrinsic calibration of the head tracking cameras from ChArUco captures (the calibration started in
+generate_board.py). Camera matrix and distortion coefficients are stored in a pickle in the CAL_ROOT of the
+labplatform, keyed by (camera serial, (width, height)). ArUcoCam loads this file once at _initialize and uses the
+calibration of each camera instead of assuming focal length = image width and no lens distortion.
+"""
+import os
+import time
+import pickle
+import logging
+import datetime
+import numpy as np
+import cv2
+
+log = logging.getLogger(__name__)
+
+INTRINSICS_FILE = "camera_intrinsics.pkl"
+
+# ChArUco board used for calibration: 7 x 5 squares, marker length 0.8 of the square length
+CHARUCO_DICT = cv2.aruco.Dictionary_get(cv2.aruco.DICT_6X6_250)
+CHARUCO_BOARD = cv2.aruco.CharucoBoard_create(7, 5, 1, .8, CHARUCO_DICT)
+
+
+def default_intrinsics_file():
+    from labplatform.config import get_config
+    return os.path.join(get_config("CAL_ROOT"), INTRINSICS_FILE)
+
+
+def camera_serial(cap, index=0):
+    """
+    Serial number of the FLIR camera behind an EasyPySpin.VideoCapture. Captures without a camera (e.g.
+    ReplayCapture) are identified by their index.
+    """
+    try:
+        return str(cap.cam.TLDevice.DeviceSerialNumber.GetValue())
+    except AttributeError:
+        return f"cam{index}"
+
+
+def capture_images(cap, n_images=12, interval=5.0, folder=None):
+    """
+    Takes calibration images with a capture device, move the board between the images.
+
+    Args:
+        cap: EasyPySpin.VideoCapture or any object with a read() method.
+        n_images: number of images.
+        interval: time in seconds between two images.
+        folder: if given, the images are saved there as png.
+
+    Returns:
+        list of gray scale images.
+    """
+    images = list()
+    while len(images) < n_images:
+        ret, image = cap.read()
+        if image is None:
+            continue
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        images.append(image)
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+            cv2.imwrite(os.path.join(folder, f"calibration_{len(images):02d}.png"), image)
+        log.info(f"Took calibration image {len(images)}/{n_images}, next one in {interval} s")
+        time.sleep(interval)
+    return images
+
+
+def read_chessboards(images, board=CHARUCO_BOARD):
+    """
+    Detects the ChArUco corners in the calibration images.
+
+    Args:
+        images: list of gray scale images or image file paths.
+        board: the ChArUco board shown in the images.
+
+    Returns:
+        list of corner arrays, list of corner id arrays and the image size (width, height).
+    """
+    all_corners, all_ids = list(), list()
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 0.00001)  # sub pixel corner criterion
+    image_size = None
+    for image in images:
+        if isinstance(image, str):
+            image = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+        elif image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        image_size = (image.shape[1], image.shape[0])
+        corners, ids, rejected = cv2.aruco.detectMarkers(image, board.dictionary)
+        if len(corners) == 0:
+            continue
+        for corner in corners:
+            cv2.cornerSubPix(image, corner, winSize=(3, 3), zeroZone=(-1, -1), criteria=criteria)
+        n, charuco_corners, charuco_ids = cv2.aruco.interpolateCornersCharuco(corners, ids, image, board)
+        if charuco_corners is not None and charuco_ids is not None and n > 3:
+            all_corners.append(charuco_corners)
+            all_ids.append(charuco_ids)
+    log.info(f"Found the board in {len(all_corners)} of {len(images)} images")
+    return all_corners, all_ids, image_size
+
+
+def calibrate_camera(all_corners, all_ids, image_size, board=CHARUCO_BOARD):
+    """
+    Estimates the camera matrix and distortion coefficients from the detected ChArUco corners.
+
+    Returns:
+        reprojection error (pixels), camera matrix and distortion coefficients.
+    """
+    if len(all_corners) < 4:
+        raise ValueError(f"Need at least 4 images showing the board, got {len(all_corners)}")
+    camera_matrix_init = np.array([[1000., 0., image_size[0] / 2.],
+                                   [0., 1000., image_size[1] / 2.],
+                                   [0., 0., 1.]])
+    dist_coeffs_init = np.zeros((5, 1))
+    flags = cv2.CALIB_USE_INTRINSIC_GUESS + cv2.CALIB_RATIONAL_MODEL + cv2.CALIB_FIX_ASPECT_RATIO
+    ret, camera_matrix, dist_coeffs, rvecs, tvecs = cv2.aruco.calibrateCameraCharuco(
+        charucoCorners=all_corners, charucoIds=all_ids, board=board, imageSize=image_size,
+        cameraMatrix=camera_matrix_init, distCoeffs=dist_coeffs_init, flags=flags,
+        criteria=(cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 10000, 1e-9))
+    log.info(f"Calibrated camera with a reprojection error of {round(ret, 3)} pixels")
+    return ret, camera_matrix, dist_coeffs
+
+
+def load_intrinsics(file=None):
+    """
+    Returns:
+        dict of (serial, (width, height)) -> dict with camera_matrix, dist_coeffs, error and date. Empty if the
+        calibration file does not exist.
+    """
+    file = file or default_intrinsics_file()
+    if not os.path.isfile(file):
+        return dict()
+    with open(file, "rb") as f:
+        return pickle.load(f)
+
+
+def save_intrinsics(serial, image_size, camera_matrix, dist_coeffs, error=None, file=None):
+    """
+    Adds the calibration of one camera at one resolution to the calibration file, replacing an older calibration
+    with the same key.
+    """
+    file = file or default_intrinsics_file()
+    intrinsics = load_intrinsics(file)
+    intrinsics[(str(serial), tuple(image_size))] = {"camera_matrix": np.asarray(camera_matrix),
+                                                    "dist_coeffs": np.asarray(dist_coeffs),
+                                                    "error": error,
+                                                    "date": datetime.datetime.now().strftime("%Y-%m-%d")}
+    with open(file, "wb") as f:
+        pickle.dump(intrinsics, f, pickle.HIGHEST_PROTOCOL)
+    log.info(f"Saved intrinsics of camera {serial} at {image_size[0]}x{image_size[1]} to {file}")
+
+
+def get_intrinsics(intrinsics, serial, image_size):
+    """
+    Looks up the calibration of a camera. If the camera was only calibrated at another resolution with the same
+    aspect ratio, the camera matrix is rescaled (the distortion coefficients do not depend on the resolution).
+
+    Args:
+        intrinsics: dict as returned by load_intrinsics.
+        serial: camera serial.
+        image_size: (width, height) of the images.
+
+    Returns:
+        camera matrix and distortion coefficients, or None, None if the camera is not calibrated.
+    """
+    serial, image_size = str(serial), tuple(image_size)
+    if (serial, image_size) in intrinsics:
+        calibration = intrinsics[(serial, image_size)]
+        return calibration["camera_matrix"], calibration["dist_coeffs"]
+    for (_serial, _size), calibration in intrinsics.items():
+        if _serial == serial and np.isclose(_size[0] * image_size[1], _size[1] * image_size[0]):
+            return scale_camera_matrix(calibration["camera_matrix"], image_size[0] / _size[0]), \
+                calibration["dist_coeffs"]
+    return None, None
+
+
+def scale_camera_matrix(camera_matrix, factor):
+    """
+    Camera matrix for images rescaled by factor, e.g. by ArUcoCam.change_res.
+    """
+    camera_matrix = np.array(camera_matrix, dtype="double")
+    camera_matrix[:2] *= factor
+    return camera_matrix
+
+
+def calibrate(cap, serial=None, n_images=12, interval=5.0, folder=None, file=None):
+    """
+    Captures calibration images with a camera, calibrates it and saves the intrinsics.
+    """
+    serial = serial or camera_serial(cap)
+    images = capture_images(cap, n_images=n_images, interval=interval, folder=folder)
+    all_corners, all_ids, image_size = read_chessboards(images)
+    error, camera_matrix, dist_coeffs = calibrate_camera(all_corners, all_ids, image_size)
+    save_intrinsics(serial, image_size, camera_matrix, dist_coeffs, error=error, file=file)
+    return camera_matrix, dist_coeffs
+
+
+if __name__ == "__main__":
+    import EasyPySpin
+    logging.basicConfig(level=logging.INFO)
+    for index in range(2):
+        cap = EasyPySpin.VideoCapture(index)
+        cap.set(cv2.CAP_PROP_EXPOSURE, 100000.0)  # disable auto exposure
+        calibrate(cap, serial=camera_serial(cap, index))
+        cap.release()
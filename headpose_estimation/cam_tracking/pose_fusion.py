@@ -0,0 +1,125 @@
+"""
+Fusion of the marker poses of several cameras into one head orientation. Every detected marker gives an estimate of
+the head rotation in the dome frame (x to the right, y up, z straight ahead):
+
+    head = camera_rotation @ marker_rotation @ board_rotation.T
+
+where camera_rotation is the orientation of the camera in the dome frame and board_rotation the orientation of the
+marker board on the head (both fixed by the setup). The estimates of all markers of all cameras are averaged (chordal
+L2 mean), so each camera contributes to both axes and the orientation is still defined if one camera drops out.
+"""
+import numpy as np
+import cv2
+
+
+def rotation_from_degrees(rotation_vec):
+    """
+    Rotation matrix from a rotation vector in degrees.
+    """
+    return cv2.Rodrigues(np.radians(np.asarray(rotation_vec, dtype=float)).reshape(3, 1))[0]
+
+
+def project_to_rotation(matrix):
+    """
+    Closest rotation matrix (in the Frobenius norm) to a 3x3 matrix.
+    """
+    u, s, vt = np.linalg.svd(matrix)
+    d = np.sign(np.linalg.det(u @ vt))
+    return u @ np.diag([1, 1, d]) @ vt
+
+
+def mean_rotation(rotations, weights=None):
+    """
+    Weighted chordal L2 mean of rotation matrices.
+
+    Returns:
+        mean rotation and the agreement of the rotations, the mean singular value of the averaged matrices. The
+        agreement is 1 if all rotations are equal and decreases with their spread.
+    """
+    rotations = np.asarray(rotations, dtype=float)
+    weights = np.ones(len(rotations)) if weights is None else np.asarray(weights, dtype=float)
+    average = np.einsum("i,ijk->jk", weights / weights.sum(), rotations)
+    agreement = float(np.clip(np.linalg.svd(average, compute_uv=False).mean(), 0, 1))
+    return project_to_rotation(average), agreement
+
+
+def angle_between(rotation_a, rotation_b):
+    """
+    Geodesic angle in degrees between two rotation matrices, works on stacks of rotations.
+    """
+    cos = (np.trace(np.swapaxes(rotation_a, -1, -2) @ rotation_b, axis1=-2, axis2=-1) - 1) / 2
+    return np.degrees(np.arccos(np.clip(cos, -1, 1)))
+
+
+def fuse(marker_rvecs, camera_rotations, board_rotations, outlier_threshold=20.0):
+    """
+    Fuses the marker rotations of all cameras into one head rotation.
+
+    Args:
+        marker_rvecs: list with one entry per camera, each a list of marker rotation vectors (radians, as returned by
+            cv2.aruco.estimatePoseSingleMarkers). Cameras without detections have an empty list or None.
+        camera_rotations: orientation of each camera in the dome frame, list of rotation matrices.
+        board_rotations: orientation of the board seen by each camera on the head, list of rotation matrices.
+        outlier_threshold: markers deviating more than this angle (degrees) from the weighted mean of all estimates
+            are discarded and the mean is computed again from the rest.
+
+    Returns:
+        head rotation matrix (None if no camera detected a marker) and the confidence between 0 and 1, which is the
+        fraction of cameras contributing times the agreement of the marker estimates.
+    """
+    estimates, cams = list(), list()
+    for i, rvecs in enumerate(marker_rvecs):
+        if rvecs is None:
+            continue
+        for rvec in rvecs:
+            marker_rotation = cv2.Rodrigues(np.asarray(rvec, dtype=float).reshape(3, 1))[0]
+            estimates.append(camera_rotations[i] @ marker_rotation @ board_rotations[i].T)
+            cams.append(i)
+    if not estimates:
+        return None, 0.0
+    estimates, cams = np.asarray(estimates), np.asarray(cams)
+    # weight the cameras equally, independent of the number of markers they detect
+    weights = 1 / np.bincount(cams)[cams]
+    rotation, _ = mean_rotation(estimates, weights)
+    inliers = angle_between(estimates, rotation) <= outlier_threshold
+    if inliers.any() and not inliers.all():
+        estimates, cams, weights = estimates[inliers], cams[inliers], 1 / np.bincount(cams[inliers])[cams[inliers]]
+    rotation, agreement = mean_rotation(estimates, weights)
+    coverage = len(np.unique(cams)) / len(marker_rvecs)
+    return rotation, coverage * agreement
+
+
+def camera_rotations_from_reference(marker_rvecs, board_rotations):
+    """
+    Camera orientations measured from markers seen while the head faces straight ahead (head rotation = identity):
+    camera_rotation = board_rotation @ marker_rotation.T, with the marker rotations of a camera averaged over all
+    detections. The board rotations must be known, they follow from how the board is mounted on the head.
+
+    Args:
+        marker_rvecs: list with one entry per camera, each a list of marker rotation vectors (radians), e.g. collected
+            over several frames. Cameras without detections have an empty list or None.
+        board_rotations: orientation of the board seen by each camera on the head, list of rotation matrices.
+
+    Returns:
+        rotation vector in degrees of each camera, None for cameras without detections.
+    """
+    camera_rvecs = list()
+    for rvecs, board_rotation in zip(marker_rvecs, board_rotations):
+        if not rvecs:
+            camera_rvecs.append(None)
+            continue
+        marker_rotation, _ = mean_rotation([cv2.Rodrigues(np.asarray(rvec, dtype=float).reshape(3, 1))[0]
+                                            for rvec in rvecs])
+        camera_rotation = board_rotation @ marker_rotation.T
+        camera_rvecs.append(np.degrees(cv2.Rodrigues(camera_rotation)[0].ravel()).tolist())
+    return camera_rvecs
+
+
+def azimuth_elevation(rotation):
+    """
+    Azimuth (positive to the right) and elevation (positive upwards) in degrees of the direction the head is facing.
+    """
+    forward = rotation[:, 2]
+    azimuth = np.degrees(np.arctan2(forward[0], forward[2]))
+    elevation = np.degrees(np.arcsin(np.clip(forward[1], -1, 1)))
+    return float(azimuth), float(elevation)
@@ -0,0 +1,172 @@
+"""
+Sweeps the aruco DetectorParameters and the resolution scale over a synthetic (benchmark.py) or recorded
+(ReplayCapture) frame set in parallel, finds the Pareto front of detection time against detection rate and angular
+error / jitter, and writes the chosen settings into the config file ArUcoCam loads at _initialize.
+"""
+import os
+import itertools
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import cv2
+from headpose_estimation.cam_tracking import benchmark
+
+log = logging.getLogger(__name__)
+
+DEFAULT_GRID = {"cornerRefinementMethod": [cv2.aruco.CORNER_REFINE_NONE, cv2.aruco.CORNER_REFINE_SUBPIX],
+                "adaptiveThreshWinSizeMin": [3, 5],
+                "adaptiveThreshWinSizeMax": [13, 23],
+                "adaptiveThreshWinSizeStep": [10, 100],
+                "resolution": [0.5, 0.75, 1.0]}
+
+_frames = None
+_rotations = None
+_dictionary = None
+_cam = None
+
+
+def load_recorded_frames(source, n_frames=None):
+    """
+    Reads a recording made with ArUcoCam.record (or any video file / image sequence) through ReplayCapture.
+    """
+    from experiment.ReplayCapture import ReplayCapture
+    capture = ReplayCapture(source, rate="max")
+    frames = list()
+    while n_frames is None or len(frames) < n_frames:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+def parameter_sets(grid):
+    """
+    All combinations of the grid. Combinations with adaptiveThreshWinSizeMin > adaptiveThreshWinSizeMax are skipped.
+    """
+    names = list(grid.keys())
+    for values in itertools.product(*grid.values()):
+        settings = dict(zip(names, values))
+        if settings.get("adaptiveThreshWinSizeMin", 0) > settings.get("adaptiveThreshWinSizeMax", np.inf):
+            continue
+        yield settings
+
+
+def detector_parameters(settings):
+    """
+    DetectorParameters with the given attributes set. The resolution entry is not a detector parameter and ignored.
+    """
+    params = cv2.aruco.DetectorParameters_create()
+    for name, value in settings.items():
+        if name != "resolution":
+            setattr(params, name, value)
+    return params
+
+
+def _init_worker(frames, rotations, dict_name):
+    global _frames, _rotations, _dictionary, _cam
+    from experiment.Camera import ArUcoCam
+    _frames, _rotations = frames, rotations
+    _dictionary = cv2.aruco.Dictionary_get(benchmark.BOARD_DICTS[dict_name])
+    _cam = ArUcoCam()
+
+
+def _evaluate(settings):
+    _cam.params = detector_parameters(settings)
+    backend = benchmark.with_resolution(_cam.pose_from_image, settings.get("resolution", 1.0))
+    results = benchmark.run_backend(backend, _frames, _rotations, _dictionary)
+    if _rotations is None:
+        # recorded frames have no ground truth, judge the angular stability by the frame to frame jitter instead
+        jitter = np.abs(np.diff(results.angle.dropna().values))
+        results["error"] = np.nan
+        results.loc[results.angle.notna().values.nonzero()[0][1:], "error"] = jitter
+    summary = benchmark.summarize(results)
+    return {**settings, **summary.to_dict()}
+
+
+def pareto_front(results, minimize=("latency_p50", "error_median"), maximize=("detection_rate",)):
+    """
+    Boolean mask of the parameter sets not dominated by any other set.
+    """
+    costs = np.column_stack([results[c].fillna(np.inf).values for c in minimize] +
+                            [-results[c].fillna(-np.inf).values for c in maximize])
+    front = np.ones(len(costs), dtype=bool)
+    for i, cost in enumerate(costs):
+        dominated = np.all(costs <= cost, axis=1) & np.any(costs < cost, axis=1)
+        front[i] = not dominated.any()
+    return front
+
+
+def choose(results, min_detection_rate=0.95, max_error=None):
+    """
+    The fastest Pareto optimal parameter set satisfying the detection rate and error constraints. Falls back to the
+    set with the highest detection rate if none does.
+    """
+    front = results[results.pareto]
+    valid = front[front.detection_rate >= min_detection_rate]
+    if max_error is not None:
+        valid = valid[valid.error_median <= max_error]
+    if len(valid):
+        return valid.sort_values("latency_p50").iloc[0]
+    return front.sort_values(["detection_rate", "latency_p50"], ascending=[False, True]).iloc[0]
+
+
+def tune(frames=None, rotations=None, grid=None, dict_name="4x4", n_jobs=None, scenarios=None):
+    """
+    Evaluates every parameter set of the grid on the frame set.
+
+    Args:
+        frames: list of frames. If None, synthetic frames are rendered from scenarios.
+        rotations: ground truth rotations of the frames, None for recorded frames.
+        grid: dict of parameter name -> list of values, see DEFAULT_GRID.
+        dict_name: board dictionary, "4x4" (camera 0) or "5x5" (camera 1).
+        n_jobs: number of worker processes, defaults to the number of cpus.
+        scenarios: rendering conditions for the synthetic frames, see benchmark.make_scenarios.
+
+    Returns:
+        pandas DataFrame with one row per parameter set and a boolean pareto column.
+    """
+    grid = grid or DEFAULT_GRID
+    if frames is None:
+        scenarios = benchmark.make_scenarios() if scenarios is None else scenarios
+        frames, rotations = benchmark.generate_frames(scenarios, board=benchmark.make_board(dict_name))
+    settings = list(parameter_sets(grid))
+    log.info(f"Evaluating {len(settings)} parameter sets on {len(frames)} frames")
+    n_jobs = n_jobs or multiprocessing.cpu_count()
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                             initargs=(frames, rotations, dict_name)) as pool:
+        results = pd.DataFrame(list(pool.map(_evaluate, settings)))
+    results["pareto"] = pareto_front(results)
+    return results
+
+
+def write_config(settings, filename):
+    """
+    Writes the chosen settings as a config text file readable by slab.load_config, as ArUcoCam does at _initialize.
+    """
+    params = cv2.aruco.DetectorParameters_create()
+    names = [name for name in settings.keys() if name == "resolution" or hasattr(params, name)]
+    with open(filename, "w") as file:
+        for name in names:
+            value = settings[name]
+            value = value.item() if isinstance(value, np.generic) else value
+            if name != "resolution":
+                value = type(getattr(params, name))(value)  # rows of a numeric DataFrame come as floats
+            file.write(f"{name} = {value!r}\n")
+    log.info(f"Saved detector settings to {filename}")
+
+
+if __name__ == "__main__":
+    from labplatform.config import get_config
+    logging.basicConfig(level=logging.INFO)
+    pd.set_option("display.width", 200)
+    results = tune()
+    print(results[results.pareto].sort_values("latency_p50"))
+    best = choose(results)
+    print(best)
+    write_config(best, os.path.join(get_config("BASE_DIRECTORY"), "config", "aruco_config.txt"))
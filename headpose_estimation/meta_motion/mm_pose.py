@@ -1,5 +1,6 @@
 from mbientlab.metawear import *
 import time
+import collections
 import freefield
 import numpy
 import numpy as np
@@ -64,7 +65,12 @@ def disconnect(sensor):
 def get_pose(sensor, n_datapoints=100):
     pose_log = numpy.zeros((n_datapoints, 2))
     n = 0
+    last_sample = sensor.samples
     while n < n_datapoints:  # filter invalid values
+        if sensor.samples == last_sample:  # wait for the next callback instead of re-reading the same sample
+            time.sleep(0.001)
+            continue
+        last_sample = sensor.samples
         pose = numpy.array((sensor.pose.yaw, sensor.pose.roll))
         if not any(numpy.isnan(pose)) and all(-180 <= _pose <= 360 for _pose in pose)\
                 and not any(-1e-3 <= _pose <= 1e-3 for _pose in pose):
@@ -86,21 +92,21 @@ def print_pose(pose):
 
 def test_sensor(sensor, n_datapoints=100, timer=False):
     # sensor = start_sensor()
-    log = get_pose(sensor, n_datapoints)
+    log = [get_pose(sensor, n_datapoints)]
     t_start = time.time()
     t = True
     try:
         while t:
             pose = get_pose(sensor, n_datapoints)
             print_pose(pose)
-            log = numpy.vstack((log, pose))
+            log.append(pose)
             if timer and (time.time() < t_start + 30):
                 t = False
     except KeyboardInterrupt:
         pass
     # disconnect(sensor)
     # print('test completed')
-    return log
+    return numpy.array(log)
 
 def calibrate_pose(sensor, limit=0.2, report=False):
     [led_speaker] = freefield.pick_speakers(23)  #s get object for center speaker LED
@@ -109,21 +115,21 @@ def calibrate_pose(sensor, limit=0.2, report=False):
     # print('rest at center speaker and press button to start calibration...', end="\r", flush=True)
     freefield.wait_for_button()  # start calibration after button press
     # print('calibrating', end="\r", flush=True)
-    log = numpy.zeros(2)
+    max_logsize = 100
+    log = collections.deque([numpy.zeros(2)], maxlen=max_logsize + 1)  # only the last poses are needed
     while True:  # wait in loop for sensor to stabilize
         pose = get_pose(sensor)
         # print(pose)
-        log = numpy.vstack((log, pose))
+        log.append(pose)
         # check if orientation is stable for at least 30 data points
-        max_logsize = 100
         if len(log) > max_logsize:
-            diff = numpy.mean(numpy.abs(numpy.diff(log[-max_logsize:], axis=0)), axis=0).astype('float16')
+            diff = numpy.mean(numpy.abs(numpy.diff(numpy.array(log)[-max_logsize:], axis=0)), axis=0).astype('float16')
             if report:
                 print('az diff: %f,  ele diff: %f' % (diff[0], diff[1]), end="\r", flush=True)
             if diff[0] < limit and diff[1] < limit:  # limit in degree
                 break
     freefield.write(tag='bitmask', value=0, processors=led_speaker.digital_proc)  # turn off LED
-    pose_offset = numpy.around(numpy.mean(log[-int(max_logsize/2):].astype('float16'), axis=0), decimals=2)
+    pose_offset = numpy.around(numpy.mean(numpy.array(log)[-int(max_logsize/2):].astype('float16'), axis=0), decimals=2)
     # print('calibration complete.', end="\r", flush=True)
     return pose_offset
 
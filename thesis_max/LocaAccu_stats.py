@@ -1,6 +1,6 @@
 import scipy.stats as stats
 from statsmodels.stats.multitest import multipletests
-from sklearn.linear_model import LinearRegression
+from analysis.utils.stats import grouped_linregress
 from analysis.utils.misc import *
 from labplatform.config import get_config
 
@@ -23,15 +23,21 @@ filledv = dfv["mode"].ffill()
 noisev = dfv[np.where(filledv=="noise", True, False)]  # True where reversed_speech is True
 babblev= dfv[np.where(filledv=="babble", True, False)]  # True where reversed_speech is False
 
+# accuracy per trial, expanded once, missing responses count as 0
+accnoiseh = replace_in_array(azimuth_array(noiseh.accuracy))
+accbabbleh = replace_in_array(azimuth_array(babbleh.accuracy))
+accnoisev = replace_in_array(elevation_array(noisev.accuracy))
+accbabblev = replace_in_array(elevation_array(babblev.accuracy))
+
 # MAD
-madnoiseh = np.mean(np.abs(replace_in_array(get_azimuth_from_df(noiseh.accuracy))))
-madbabbleh = np.mean(np.abs(replace_in_array(get_azimuth_from_df(babbleh.accuracy))))
-madnoisev = np.mean(np.abs(replace_in_array(get_elevation_from_df(noisev.accuracy))))
-madbabblev = np.mean(np.abs(replace_in_array(get_elevation_from_df(babblev.accuracy))))
-madnoiseherr = stats.sem(np.abs(replace_in_array(get_azimuth_from_df(noiseh.accuracy))))
-madbabbleherr = stats.sem(np.abs(replace_in_array(get_azimuth_from_df(babbleh.accuracy))))
-madnoiseverr = stats.sem(np.abs(replace_in_array(get_elevation_from_df(noisev.accuracy))))
-madbabbleverr = stats.sem(np.abs(replace_in_array(get_elevation_from_df(babblev.accuracy))))
+madnoiseh = np.mean(np.abs(accnoiseh))
+madbabbleh = np.mean(np.abs(accbabbleh))
+madnoisev = np.mean(np.abs(accnoisev))
+madbabblev = np.mean(np.abs(accbabblev))
+madnoiseherr = stats.sem(np.abs(accnoiseh))
+madbabbleherr = stats.sem(np.abs(accbabbleh))
+madnoiseverr = stats.sem(np.abs(accnoisev))
+madbabbleverr = stats.sem(np.abs(accbabblev))
 
 
 print(f"AZIMUTH: \n"
@@ -44,15 +50,15 @@ print(f"AZIMUTH: \n"
 
 # stats
 print(f"WILCOXON SIGNED RANK TEST MAD: \n"
-      f"Babble noise elevation vs. azimuth: {stats.wilcoxon(replace_in_array(get_azimuth_from_df(babbleh.accuracy)), replace_in_array(get_elevation_from_df(babblev.accuracy)))} \n"
-      f"Rifle noise elevation vs. azimuth: {stats.wilcoxon(replace_in_array(get_azimuth_from_df(noiseh.accuracy)), replace_in_array(get_elevation_from_df(noisev.accuracy)))} \n"
-      f"Babble vs rifle elevation: {stats.wilcoxon(replace_in_array(get_elevation_from_df(babblev.accuracy)), replace_in_array(get_elevation_from_df(noisev.accuracy)))} \n"
-      f"Babble vs rifle azimuth: {stats.wilcoxon(replace_in_array(get_azimuth_from_df(babbleh.accuracy)), replace_in_array(get_azimuth_from_df(noiseh.accuracy)))} \n")
+      f"Babble noise elevation vs. azimuth: {stats.wilcoxon(accbabbleh, accbabblev)} \n"
+      f"Rifle noise elevation vs. azimuth: {stats.wilcoxon(accnoiseh, accnoisev)} \n"
+      f"Babble vs rifle elevation: {stats.wilcoxon(accbabblev, accnoisev)} \n"
+      f"Babble vs rifle azimuth: {stats.wilcoxon(accbabbleh, accnoiseh)} \n")
 
-pvals = [stats.wilcoxon(replace_in_array(get_azimuth_from_df(babbleh.accuracy)), replace_in_array(get_elevation_from_df(babblev.accuracy)))[1],
-         stats.wilcoxon(replace_in_array(get_azimuth_from_df(noiseh.accuracy)), replace_in_array(get_elevation_from_df(noisev.accuracy)))[1],
-         stats.wilcoxon(replace_in_array(get_elevation_from_df(babblev.accuracy)), replace_in_array(get_elevation_from_df(noisev.accuracy)))[1],
-         stats.wilcoxon(replace_in_array(get_azimuth_from_df(babbleh.accuracy)), replace_in_array(get_azimuth_from_df(noiseh.accuracy)))[1]]
+pvals = [stats.wilcoxon(accbabbleh, accbabblev)[1],
+         stats.wilcoxon(accnoiseh, accnoisev)[1],
+         stats.wilcoxon(accbabblev, accnoisev)[1],
+         stats.wilcoxon(accbabbleh, accnoiseh)[1]]
 
 multitest_method = "bonferroni"
 print(f"Bonferroni-corrected: {multipletests(pvals, method=multitest_method)}")
@@ -63,23 +69,19 @@ dfh = pd.read_csv(fromfph, index_col=0)
 fromfpv = "/home/max/labplatform/data/linear_model/final_df_revspeech_v.csv"
 dfv = pd.read_csv(fromfpv, index_col=0)
 
-x1 = np.unique(dfh.lababble).reshape((-1, 1))
-y1 = np.unique(dfh.lanoise)
-
-x2 = np.unique(dfv.lababble).reshape((-1, 1))
-y2 = np.unique(dfv.lanoise)
+regression = pd.concat([pd.DataFrame({"plane": plane, "lababble": np.unique(df.lababble),
+                                      "lanoise": np.unique(df.lanoise)}) for plane, df in [("h", dfh), ("v", dfv)]])
 
 # fit model
-model1 = LinearRegression().fit(x1, y1)
-model2 = LinearRegression().fit(x2, y2)
+fits = grouped_linregress(regression, "lababble", "lanoise", by="plane")
 
 print(f"LINEAR REGRESSION \n"
       f"AZIMUTH BABBLE VS PINK NOISE: \n"
-      f"Line slope: {model1.coef_} \n"
-      f"Correlation: {model1.score(x1, y1)} \n"
+      f"Line slope: {fits.loc['h', 'slope']} \n"
+      f"Correlation: {fits.loc['h', 'r2']} \n"
       f"ELEVATION BABBLE VS PINK NOISE: \n"
-      f"Line slope: {model2.coef_} \n"
-      f"Correlation: {model2.score(x2, y2)}")
+      f"Line slope: {fits.loc['v', 'slope']} \n"
+      f"Correlation: {fits.loc['v', 'r2']}")
 
 # reaction times
 rtnoiseh = np.mean(noiseh.rt)
@@ -106,10 +106,7 @@ plt.savefig("/home/max/labplatform/plots/MA_thesis/results/spectro_temporal_cove
             dpi=400, bbox_inches="tight")
 
 # Dynamic Range Distribution
-"""
-CAREFUL: THE BELOW CODE IS VERY COMPUTATION INTENSE AND MIGHT TAKE AGES FOR RUNNING. SO BE CAREFUL!!!
-"""
-from analysis.utils.math import spectemp_coverage, variance
+from analysis.utils.coverage import spectemp_coverages
 
 signals_sample_clear_h = clearspeechh.signals_sample  # talker IDs
 country_idxs_clear_h = clearspeechh.country_idxs  # indices of the country names from a talker
@@ -120,22 +117,14 @@ with open(talker_files_path, "rb") as files:
     sounds_clear = pkl.load(files)
 
 upper_freq_lim = 11000
-variances = dict()
-for dyn_range in range(1, 101):
-    observations = list()
-    variances[dyn_range] = list()
-    for trial_n in range(len(clearspeechh)):
-        signals = signals_sample_clear_h[trial_n]
-        country_idx = country_idxs_clear_h[trial_n]
-        trial_composition = [sounds_clear[x][y].resize(0.6) for x, y in zip(signals, country_idx)]
-        coverage = spectemp_coverage(trial_composition, dyn_range, upper_freq_lim)
-        observations.append(coverage)
-    variances[dyn_range].append(variance(observations))
+dyn_ranges = np.arange(1, 101)
+# one spectrogram per distinct talker composition gives the coverage of all dynamic ranges
+coverages = spectemp_coverages(signals_sample_clear_h, country_idxs_clear_h, sounds_clear, dyn_range=dyn_ranges,
+                               upper_freq=upper_freq_lim, resize=0.6)
 
 df = pd.DataFrame()
-var_vals = [x[0] for x in list(variances.values())]
-df["variance"] = var_vals
-df["dyn_range"] = variances.keys()
+df["variance"] = coverages.var(axis=0)
+df["dyn_range"] = dyn_ranges
 
 sns.lineplot(x=df.dyn_range, y=df.variance, marker="o")  # plot results
 plt.axvline(x=65,
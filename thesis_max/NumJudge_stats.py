@@ -3,8 +3,7 @@ from analysis.utils.misc import *
 from labplatform.config import get_config
 import pickle as pkl
 from analysis.utils.stats import permutation_test
-import statsmodels.formula.api as smf
-import statsmodels.api as sm
+from analysis.utils.mixed_models import ModelSpec, fit_models, bootstrap_fixed_effects
 
 
 fp = os.path.join(get_config("DATA_ROOT"), "MSL")
@@ -99,32 +98,18 @@ vc_formula = {"spatmask": "0 + spatmask",
               "lanoise": "0 + lanoise",
               "numjudge": "0 + numjudge"}
 
-# clearspeech azimuth
-clearspeechh_model_fp = "/home/max/labplatform/data/linear_model/final_df_clearspeech_h.csv"
-clearspeechh_model_df = pd.read_csv(clearspeechh_model_fp, index_col=0)
-modelch = smf.mixedlm(formula=formula, data=clearspeechh_model_df, groups=clearspeechh_model_df["subID"])
-resultch = modelch.fit()
+# clearspeech and reversed speech, azimuth and elevation, refitted only when the data changed
+model_dir = "/home/max/labplatform/data/linear_model"
+cache_dir = os.path.join(model_dir, ".cache")
+specs = [ModelSpec(condition, formula, pd.read_csv(os.path.join(model_dir, f"final_df_{condition}.csv"), index_col=0),
+                   groups="subID")
+         for condition in ["clearspeech_h", "clearspeech_v", "revspeech_h", "revspeech_v"]]
+results = fit_models(specs, cache_dir=cache_dir)
+resultch, resultcv, resultrh, resultrv = [results[spec.name] for spec in specs]
 resultch.summary()
-
-# clearspeech elevation
-clearspeechv_model_fp = "/home/max/labplatform/data/linear_model/final_df_clearspeech_v.csv"
-clearspeechv_model_df = pd.read_csv(clearspeechv_model_fp, index_col=0)
-modelcv = smf.mixedlm(formula, data=clearspeechv_model_df, groups=clearspeechv_model_df["subID"])
-resultcv = modelcv.fit()
 resultcv.summary()
-
-# reversed speech azimuth
-revspeechh_model_fp = "/home/max/labplatform/data/linear_model/final_df_revspeech_h.csv"
-revspeechh_model_df = pd.read_csv(revspeechh_model_fp, index_col=0)
-modelrh = smf.mixedlm(formula, data=revspeechh_model_df, groups=revspeechh_model_df["subID"])
-resultrh = modelrh.fit()
 resultrh.summary()
-
-# reversed speech elevation
-revspeechv_model_fp = "/home/max/labplatform/data/linear_model/final_df_revspeech_v.csv"
-revspeechv_model_df = pd.read_csv(revspeechv_model_fp, index_col=0)
-modelrv = smf.mixedlm(formula, data=revspeechv_model_df, groups=revspeechv_model_df["subID"])
-resultrv = modelrv.fit()
 resultrv.summary()
 
-
+# cluster bootstrap confidence intervals of the fixed effects
+bootstrap_cis = {spec.name: bootstrap_fixed_effects(spec, n_boot=1000, seed=0, cache_dir=cache_dir) for spec in specs}